@@ -0,0 +1,68 @@
+"""High rate IMU throughput: decoding into batches and batch features.
+
+Reports samples/sec through ImuBatcher (protobuf decode included) and
+the time per batch for the vectorized features, for a few batch sizes.
+Run it on the target board for numbers that mean anything there.
+
+    python benchmarks/imu_batch.py --seconds 2
+"""
+import argparse
+import math
+import time
+
+from matrix_io.proto.malos.v1 import sense_pb2
+
+from matrix.components.imu import ImuBatcher
+
+SAMPLE_RATE = 200.0
+
+def samples(count):
+    messages = []
+    for i in range(count):
+        t = i / SAMPLE_RATE
+        messages.append(sense_pb2.Imu(
+            yaw = 170.0 + 20.0 * math.sin(t), pitch = 2.0, roll = -1.0,
+            accel_x = 0.01, accel_y = 0.02, accel_z = 1.0 + 0.05 * math.sin(2 * math.pi * 25 * t),
+            gyro_x = 0.1, gyro_y = 0.2, gyro_z = 0.3, mag_x = 0.3, mag_y = 0.1, mag_z = -0.4
+        ).SerializeToString())
+    return messages
+
+def batching_rate(messages, batch_size, seconds):
+    batcher = ImuBatcher(batch_size, SAMPLE_RATE, lambda batch: None)
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        # as delivered by a batch_size > 1 subscription
+        for offset in range(0, len(messages), 16):
+            batcher.extend(messages[offset:offset + 16], 0.0)
+        count += len(messages)
+    return count / (time.perf_counter() - started)
+
+def feature_time(batch, seconds):
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        batch.features()
+        batch.smoothed_orientation(5)
+        batch.rms()
+        count += 1
+    return (time.perf_counter() - started) / count
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=2.0, help='duration of each measurement')
+    args = parser.parse_args()
+
+    messages = samples(1024)
+    for batch_size in (32, 128, 512):
+        published = []
+        batcher = ImuBatcher(batch_size, SAMPLE_RATE, published.append)
+        batcher.extend(messages[:batch_size], 0.0)
+        batch = published[0]
+        rate = batching_rate(messages, batch_size, args.seconds)
+        per_batch = feature_time(batch, args.seconds)
+        print('batch {:>4}: {:>10,.0f} samples/s batched, features {:>8.1f} us/batch ({:.2f} us/sample)'.format(
+            batch_size, rate, per_batch * 1e6, per_batch * 1e6 / batch_size))
+
+if __name__ == '__main__':
+    main()
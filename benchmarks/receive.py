@@ -0,0 +1,118 @@
+"""Compare per-socket register_callback tasks with the single poller Receiver.
+
+Publishes bursts of messages on a number of local PUB sockets and reports
+messages/sec and event loop wakeups (selector polls) per message.
+
+    python benchmarks/receive.py --sockets 12 --messages 20000
+"""
+import argparse
+import asyncio
+import selectors
+import threading
+import time
+import zmq
+
+from matrix.matrix import register_callback
+from matrix.receiver import Receiver
+
+HOST = '127.0.0.1'
+
+class CountingSelector(selectors.DefaultSelector):
+    """Counts how often the event loop wakes up from its selector"""
+    def __init__(self):
+        super().__init__()
+        self.wakeups = 0
+
+    def select(self, timeout=None):
+        events = super().select(timeout)
+        self.wakeups += 1
+        return events
+
+def bind_publishers(count):
+    ctx = zmq.Context.instance()
+    publishers = []
+    for _ in range(count):
+        s = ctx.socket(zmq.PUB)
+        s.setsockopt(zmq.SNDHWM, 0)
+        port = s.bind_to_random_port('tcp://{0}'.format(HOST))
+        publishers.append((s, port))
+    return publishers
+
+def publish(publishers, messages, payload, burst):
+    sent = 0
+    while sent < messages:
+        for s, _ in publishers:
+            for _ in range(burst):
+                s.send(payload)
+        sent += burst
+        time.sleep(0)
+
+async def run_mode(mode, publishers, messages, payload, burst, selector):
+    loop = asyncio.get_event_loop()
+    expected = len(publishers) * messages
+    received = [0]
+    done = loop.create_future()
+
+    def callback(msg):
+        received[0] += 1
+        if received[0] == expected and not done.done():
+            done.set_result(None)
+
+    tasks = []
+    receiver = None
+    if mode == 'tasks':
+        tasks = [loop.create_task(register_callback(HOST, port, callback)) for _, port in publishers]
+    else:
+        receiver = Receiver()
+        for _, port in publishers:
+            receiver.subscribe(HOST, port, callback)
+        receiver.start()
+
+    # give the SUB sockets time to connect before publishing
+    await asyncio.sleep(0.5)
+
+    wakeups_before = selector.wakeups
+    start = time.perf_counter()
+    publisher = threading.Thread(target=publish, args=(publishers, messages, payload, burst))
+    publisher.start()
+    await asyncio.wait_for(done, 60)
+    elapsed = time.perf_counter() - start
+    wakeups = selector.wakeups - wakeups_before
+    publisher.join()
+
+    for t in tasks:
+        t.cancel()
+    if receiver is not None:
+        receiver.close()
+
+    return {
+        'mode': mode,
+        'messages': expected,
+        'seconds': elapsed,
+        'messages_per_sec': expected / elapsed,
+        'wakeups_per_message': wakeups / expected
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sockets', type=int, default=12)
+    parser.add_argument('--messages', type=int, default=20000, help='messages per socket')
+    parser.add_argument('--size', type=int, default=64, help='payload size in bytes')
+    parser.add_argument('--burst', type=int, default=16, help='messages per socket per burst')
+    args = parser.parse_args()
+
+    payload = b'x' * args.size
+    for mode in ('tasks', 'poller'):
+        selector = CountingSelector()
+        loop = asyncio.SelectorEventLoop(selector)
+        asyncio.set_event_loop(loop)
+        publishers = bind_publishers(args.sockets)
+        result = loop.run_until_complete(run_mode(mode, publishers, args.messages, payload, args.burst, selector))
+        for s, _ in publishers:
+            s.close(linger=0)
+        loop.close()
+        print('{mode:>6}: {messages} msgs in {seconds:.2f}s, {messages_per_sec:,.0f} msgs/s, '
+              '{wakeups_per_message:.4f} loop wakeups/msg'.format(**result))
+
+if __name__ == '__main__':
+    main()
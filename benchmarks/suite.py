@@ -0,0 +1,216 @@
+"""End-to-end benchmark suite with machine readable results.
+
+Measures Everloop frame build and serialize time, per sensor decode
+throughput, Zigbee command encode rate, and push-to-ack and
+publish-to-callback latency through local ZMQ endpoints served by
+matrix.simulator.
+
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --baseline baseline.json --tolerance 0.15
+
+With --baseline the run is compared benchmark by benchmark and the exit
+status is 1 if anything regressed by more than the tolerance.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import time
+
+from matrix_io.proto.malos.v1 import sense_pb2
+
+from matrix.components.everloop import EverloopFrame, _encode_frame
+from matrix.components.humidity import HumidityReading
+from matrix.components.imu import ImuReading
+from matrix.components.pressure import PressureReading
+from matrix.components.uv import UvReading
+from matrix.components.zigbee import ZigbeeBulb, _IS_PROXY_ACTIVE_COMMAND
+from matrix.config import Config, ComponentConfig
+from matrix.matrix import Matrix, get_push_fn, register_callback
+from matrix.simulator import MalosSimulator
+
+HOST = '127.0.0.1'
+LED_COUNT = 35
+# far away from test.py's layout so a simulator started by hand does not collide
+HUMIDITY_PORT = 31013
+ZIGBEE_PORT = 31001
+
+SENSOR_MESSAGES = [
+    ('humidity', HumidityReading, sense_pb2.Humidity(
+        humidity = 45.5, temperature = 22.25, temperature_raw = 25.1, temperature_is_calibrated = True)),
+    ('imu', ImuReading, sense_pb2.Imu(
+        yaw = 12.5, pitch = 1.5, roll = -0.5, accel_x = 0.01, accel_y = 0.02, accel_z = 1.0,
+        gyro_x = 0.1, gyro_y = 0.2, gyro_z = 0.3, mag_x = 0.3, mag_y = 0.1, mag_z = -0.4)),
+    ('pressure', PressureReading, sense_pb2.Pressure(pressure = 101325.0, altitude = 120.0, temperature = 23.0)),
+    ('uv', UvReading, sense_pb2.UV(uv_index = 3.5, oms_risk = 'Moderate')),
+]
+
+def rate(fn, seconds):
+    """Calls of fn per second"""
+    count = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        for i in range(100):
+            fn(i)
+        count += 100
+    return count / (time.perf_counter() - started)
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * p / 100.0), len(ordered) - 1)]
+
+def result(value, unit, higher_is_better):
+    return {'value': value, 'unit': unit, 'higher_is_better': higher_is_better}
+
+def latency_results(name, samples):
+    return {
+        name + '_p50': result(percentile(samples, 50) * 1e6, 'us', False),
+        name + '_p99': result(percentile(samples, 99) * 1e6, 'us', False),
+    }
+
+def bench_everloop(seconds):
+    colors = [(i * 7 % 256, i * 13 % 256, i * 29 % 256, 0) for i in range(LED_COUNT)]
+    frame = EverloopFrame.from_colors(LED_COUNT, *colors)
+    frame_bytes = frame.tobytes()
+    return {
+        'everloop_frame_build': result(1e6 / rate(lambda i: EverloopFrame.from_colors(LED_COUNT, *colors), seconds), 'us', False),
+        # bypass the frame cache, a new image has to be encoded every time
+        'everloop_serialize': result(1e6 / rate(lambda i: _encode_frame.__wrapped__(frame_bytes), seconds), 'us', False),
+        'everloop_serialize_cached': result(1e6 / rate(lambda i: frame.serialize(), seconds), 'us', False),
+    }
+
+def bench_decode(seconds):
+    results = {}
+    for name, reading_type, message in SENSOR_MESSAGES:
+        data = message.SerializeToString()
+        field = reading_type.fields[0]
+        results['decode_' + name] = result(
+            rate(lambda i: getattr(reading_type.decode(data, 0.0), field), seconds), 'msg/s', True)
+    return results
+
+def bench_zigbee(seconds):
+    bulb = ZigbeeBulb(lambda proto, key = None: None, 0x1234, 1)
+    return {
+        'zigbee_turn_on': result(rate(lambda i: bulb.turn_on(), seconds), 'cmd/s', True),
+        'zigbee_set_brightness': result(rate(lambda i: bulb.set_brightness(i & 0xff), seconds), 'cmd/s', True),
+    }
+
+async def bench_push_to_ack(simulator, samples):
+    """Push IS_PROXY_ACTIVE to the simulated gateway and wait for its answer"""
+    loop = asyncio.get_event_loop()
+    simulator.add('zigbee', ZIGBEE_PORT).start()
+    answers = []
+
+    def on_answer(data):
+        if answers and not answers[-1].done():
+            answers[-1].set_result(time.perf_counter())
+
+    push = await get_push_fn(HOST, ZIGBEE_PORT)
+    receiving = loop.create_task(register_callback(HOST, ZIGBEE_PORT + 3, on_answer))
+    # let the subscription reach the publisher before measuring
+    await asyncio.sleep(0.3)
+
+    latencies = []
+    try:
+        for _ in range(samples):
+            answers.append(loop.create_future())
+            started = time.perf_counter()
+            push(_IS_PROXY_ACTIVE_COMMAND)
+            latencies.append(await asyncio.wait_for(answers[-1], 1.0) - started)
+            answers.clear()
+    finally:
+        receiving.cancel()
+        push.socket.close(linger = 0)
+    return latency_results('push_to_ack', latencies)
+
+async def bench_publish_to_callback(simulator, samples):
+    """Publish a humidity message and wait for the decoded reading at a subscriber"""
+    simulated = simulator.add('humidity', HUMIDITY_PORT)
+    simulated.start()
+    matrix = await Matrix.create(Config(HOST, [ComponentConfig('humidity', HUMIDITY_PORT)]))
+    readings = matrix.get_component('humidity').stream()
+    await asyncio.sleep(0.3)
+
+    latencies = []
+    try:
+        for seq in range(samples):
+            # the humidity value tags the message, the simulator's own readings stay below 100
+            tag = 1000.0 + seq
+            started = time.perf_counter()
+            simulated.publish(sense_pb2.Humidity(humidity = tag).SerializeToString())
+            while True:
+                reading = await asyncio.wait_for(readings.get(), 1.0)
+                if reading.humidity == tag:
+                    break
+            latencies.append(time.perf_counter() - started)
+    finally:
+        readings.close()
+        matrix.close()
+    return latency_results('publish_to_callback', latencies)
+
+async def bench_latency(samples):
+    simulator = MalosSimulator(HOST)
+    try:
+        results = await bench_push_to_ack(simulator, samples)
+        results.update(await bench_publish_to_callback(simulator, samples))
+    finally:
+        simulator.stop()
+    return results
+
+def run(seconds, samples):
+    results = {}
+    results.update(bench_everloop(seconds))
+    results.update(bench_decode(seconds))
+    results.update(bench_zigbee(seconds))
+    results.update(asyncio.get_event_loop().run_until_complete(bench_latency(samples)))
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'created': time.time(),
+        'results': results,
+    }
+
+def compare(results, baseline, tolerance):
+    """Print the change to every baseline benchmark, return the names of regressions"""
+    regressions = []
+    for name, current in sorted(results['results'].items()):
+        before = baseline['results'].get(name)
+        if before is None or not before['value']:
+            print('{:>28}: {:>12,.2f} {:<6} (new)'.format(name, current['value'], current['unit']))
+            continue
+        change = (current['value'] - before['value']) / before['value']
+        worse = -change if current['higher_is_better'] else change
+        regressed = worse > tolerance
+        if regressed:
+            regressions.append(name)
+        print('{:>28}: {:>12,.2f} {:<6} baseline {:>12,.2f} ({:+.1%}){}'.format(
+            name, current['value'], current['unit'], before['value'], change, '  REGRESSION' if regressed else ''))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=1.0, help='duration of each throughput measurement')
+    parser.add_argument('--samples', type=int, default=1000, help='round trips per latency measurement')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='compare against results saved with --output')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed relative regression')
+    args = parser.parse_args()
+
+    results = run(args.seconds, args.samples)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+    else:
+        for name, current in sorted(results['results'].items()):
+            print('{:>28}: {:>12,.2f} {}'.format(name, current['value'], current['unit']))
+
+if __name__ == '__main__':
+    main()
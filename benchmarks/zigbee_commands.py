@@ -0,0 +1,71 @@
+"""Zigbee command encoding rate, before and after command templates.
+
+"before" rebuilds every command the way ZigbeeBulb used to: a fresh
+DriverConfig and string-to-enum lookups per call. "after" uses the
+ZigbeeBulb methods with their prebuilt templates.
+
+    python benchmarks/zigbee_commands.py --seconds 2
+"""
+import argparse
+import time
+
+from matrix_io.proto.malos.v1 import comm_pb2
+from matrix_io.proto.malos.v1 import driver_pb2
+
+from matrix.components.zigbee import ZigbeeBulb
+
+def legacy_on_off(node_id, endpoint_index, on_off):
+    config = driver_pb2.DriverConfig()
+    config.zigbee_message.type = comm_pb2.ZigBeeMsg.ZigBeeCmdType.Value("ZCL")
+    config.zigbee_message.zcl_cmd.type = comm_pb2.ZigBeeMsg.ZCLCmd.ZCLCmdType.Value("ON_OFF")
+    config.zigbee_message.zcl_cmd.onoff_cmd.type = comm_pb2.ZigBeeMsg.ZCLCmd.OnOffCmd.ZCLOnOffCmdType.Value(on_off)
+    config.zigbee_message.zcl_cmd.node_id = node_id
+    config.zigbee_message.zcl_cmd.endpoint_index = endpoint_index
+    return config.SerializeToString()
+
+def legacy_level(node_id, endpoint_index, brightness):
+    config = driver_pb2.DriverConfig()
+    config.zigbee_message.type = comm_pb2.ZigBeeMsg.ZigBeeCmdType.Value("ZCL")
+    config.zigbee_message.zcl_cmd.type = comm_pb2.ZigBeeMsg.ZCLCmd.ZCLCmdType.Value("LEVEL")
+    config.zigbee_message.zcl_cmd.level_cmd.type = comm_pb2.ZigBeeMsg.ZCLCmd.LevelCmd.ZCLLevelCmdType.Value("MOVE_TO_LEVEL")
+    config.zigbee_message.zcl_cmd.level_cmd.move_to_level_params.level = brightness
+    config.zigbee_message.zcl_cmd.level_cmd.move_to_level_params.transition_time = 10
+    config.zigbee_message.zcl_cmd.node_id = node_id
+    config.zigbee_message.zcl_cmd.endpoint_index = endpoint_index
+    return config.SerializeToString()
+
+def rate(fn, seconds):
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for i in range(1000):
+            fn(i)
+        count += 1000
+    return count / seconds
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=2.0, help='duration of each measurement')
+    args = parser.parse_args()
+
+    sent = []
+    bulb = ZigbeeBulb(lambda proto, key = None: sent.append(proto), 0x1234, 1)
+
+    # both paths must produce the same bytes
+    bulb.turn_on()
+    bulb.set_brightness(128)
+    assert sent == [legacy_on_off(0x1234, 1, "ON"), legacy_level(0x1234, 1, 128)]
+    bulb.push = lambda proto, key = None: None
+
+    cases = [
+        ('turn_on', lambda i: legacy_on_off(0x1234, 1, "ON"), lambda i: bulb.turn_on()),
+        ('set_brightness', lambda i: legacy_level(0x1234, 1, i & 0xff), lambda i: bulb.set_brightness(i & 0xff)),
+    ]
+    for name, before, after in cases:
+        before_rate = rate(before, args.seconds)
+        after_rate = rate(after, args.seconds)
+        print('{:>15}: before {:>10,.0f} cmd/s, after {:>10,.0f} cmd/s ({:.1f}x)'.format(
+            name, before_rate, after_rate, after_rate / before_rate))
+
+if __name__ == '__main__':
+    main()
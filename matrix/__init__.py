@@ -1,12 +1,28 @@
 # http://stackoverflow.com/questions/17583443/what-is-the-correct-way-to-share-package-version-with-setup-py-and-the-package
-from pkg_resources import get_distribution, DistributionNotFound
+# The version is looked up on first access only, importing the package
+# metadata machinery (pkg_resources in particular) is slow on small boards.
 
 __project__ = 'matrix'
-__version__ = None  # required for initial installation
-
-try:
-    __version__ = get_distribution(__project__).version
-except DistributionNotFound:
-    VERSION = __project__ + '-' + '(local)'
-else:
-    VERSION = __project__ + '-' + __version__
\ No newline at end of file
+
+def __getattr__(name):
+    if name not in ('__version__', 'VERSION'):
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+    version = _get_version()
+    globals()['__version__'] = version
+    globals()['VERSION'] = __project__ + '-' + (version if version is not None else '(local)')
+    return globals()[name]
+
+def _get_version():
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:
+        from pkg_resources import get_distribution, DistributionNotFound
+        try:
+            return get_distribution(__project__).version
+        except DistributionNotFound:
+            return None
+    try:
+        return version(__project__)
+    except PackageNotFoundError:
+        return None
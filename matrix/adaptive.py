@@ -0,0 +1,125 @@
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+# Default rate of change (fraction of the value per second) that counts as "changing fast"
+RELATIVE_RATE = 0.05
+# Slow down after this many stable readings in a row
+HOLD = 5
+# Factor the interval grows by per slow down step
+BACKOFF = 1.5
+# Intervals within this fraction of the current one are not pushed again
+HYSTERESIS = 0.1
+
+class AdaptivePolling():
+    """Adjusts a sensor's update interval to how fast its readings change.
+
+    A reading changes fast when any watched field moves faster than its
+    threshold in `thresholds` ({field: units per second}) or, for fields
+    without one, faster than relative_rate of its value per second. The
+    interval then drops straight to min_interval so no transient is
+    missed. After `hold` stable readings in a row it grows by `backoff`,
+    up to max_interval (the configured interval by default).
+
+    Subscribers needing a finer resolution can request() a shorter
+    interval, it is never polled slower than the shortest request.
+    """
+    def __init__(self, sensor, min_interval, max_interval = None, fields = None, thresholds = None,
+                 relative_rate = RELATIVE_RATE, hold = HOLD, backoff = BACKOFF):
+        self.sensor = sensor
+        self.min_interval = min_interval
+        self.max_interval = max_interval if max_interval is not None else max(sensor.update_interval, min_interval)
+        self.thresholds = dict(thresholds or {})
+        self.fields = tuple(fields) if fields is not None else tuple(set(sensor.reading_type.numeric_fields) | set(self.thresholds))
+        self.relative_rate = relative_rate
+        self.hold = hold
+        self.backoff = backoff
+        self.interval = sensor.update_interval
+        self.changes = 0
+        self._original_interval = sensor.update_interval
+        self._requests = {}
+        self._request_counter = 0
+        self._stable = 0
+        self._last = None
+
+    def start(self):
+        if self.on_reading not in self.sensor.observers:
+            self.sensor.observers.append(self.on_reading)
+        self._apply(self.max_interval)
+
+    def stop(self):
+        """Stop adapting and go back to the interval the sensor had before"""
+        if self.on_reading in self.sensor.observers:
+            self.sensor.observers.remove(self.on_reading)
+        self._requests = {}
+        self.interval = self._original_interval
+        self.sensor.set_update_interval(self._original_interval)
+
+    def request(self, interval):
+        """Never poll slower than interval until the returned token is released"""
+        self._request_counter += 1
+        self._requests[self._request_counter] = interval
+        if interval < self.interval:
+            self._apply(interval)
+        return self._request_counter
+
+    def release(self, token):
+        self._requests.pop(token, None)
+
+    def get_ceiling(self):
+        """The longest interval currently allowed"""
+        if self._requests:
+            return max(min(min(self._requests.values()), self.max_interval), self.min_interval)
+        return self.max_interval
+
+    ceiling = property(get_ceiling)
+
+    def get_stats(self):
+        return {
+            'interval': self.interval,
+            'changes': self.changes,
+            'requests': len(self._requests)
+        }
+
+    stats = property(get_stats)
+
+    def on_reading(self, reading):
+        values = [getattr(reading, field) for field in self.fields]
+        last, self._last = self._last, (reading.timestamp, values)
+        if last is None:
+            return
+        elapsed = reading.timestamp - last[0]
+        if elapsed <= 0:
+            return
+
+        if self._changing_fast(last[1], values, elapsed):
+            self._stable = 0
+            self._apply(self.min_interval)
+            return
+
+        self._stable += 1
+        ceiling = self.ceiling
+        if self._stable >= self.hold and self.interval < ceiling:
+            self._stable = 0
+            self._apply(min(self.interval * self.backoff, ceiling))
+        elif self.interval > ceiling:
+            self._apply(ceiling)
+
+    def _changing_fast(self, previous, values, elapsed):
+        for field, before, now in zip(self.fields, previous, values):
+            rate = abs(now - before) / elapsed
+            threshold = self.thresholds.get(field)
+            if threshold is None:
+                threshold = self.relative_rate * abs(before)
+            if threshold and rate > threshold:
+                return True
+        return False
+
+    def _apply(self, interval):
+        interval = min(max(interval, self.min_interval), max(self.max_interval, self.min_interval))
+        if abs(interval - self.interval) <= HYSTERESIS * self.interval:
+            return
+        _LOGGER.debug("%s: update interval %.3fs -> %.3fs", self.sensor.name, self.interval, interval)
+        self.interval = interval
+        self.changes += 1
+        self.sensor.set_update_interval(interval)
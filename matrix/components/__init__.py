@@ -0,0 +1,24 @@
+import importlib
+
+# Component name -> (module, class). Modules are only imported when a
+# component of that type is created for the first time.
+COMPONENTS = {
+    'everloop': ('matrix.components.everloop', 'Everloop'),
+    'humidity': ('matrix.components.humidity', 'Humidity'),
+    'imu': ('matrix.components.imu', 'Imu'),
+    'pressure': ('matrix.components.pressure', 'Pressure'),
+    'uv': ('matrix.components.uv', 'Uv'),
+    'zigbee': ('matrix.components.zigbee', 'Zigbee'),
+}
+
+_classes = {}
+
+def get_component_class(name):
+    """The component class registered for name, imported and cached on first use"""
+    cls = _classes.get(name)
+    if cls is None:
+        # unregistered names follow the matrix.components.<name>.<Name> convention
+        module_name, class_name = COMPONENTS.get(name, ('matrix.components.{}'.format(name), name.title()))
+        cls = getattr(importlib.import_module(module_name), class_name)
+        _classes[name] = cls
+    return cls
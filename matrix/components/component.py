@@ -1,14 +1,39 @@
-import importlib
+import asyncio
+import functools
+import logging
+import time
+
+from matrix import metrics
+from matrix.components import get_component_class
+from matrix.filters import create_change_filter
+from matrix.streams import Broadcast, DEFAULT_QUEUE_SIZE, DROP_OLDEST
+
+_LOGGER = logging.getLogger(__name__)
+
+# Without a max_age, a reading is stale once this many updates are overdue
+STALE_UPDATES = 3
 
 class Component():
-    def __init__(self, config, push_fn):
+    def __init__(self, config, push_fn, host = None):
         self.name = config.name
         self.port = config.port
+        # the board's host, labels the component's metrics
+        self.host = host
         self.push = push_fn
         self._configuration_proto = {}
-        self._error_callback = lambda error: print('error: {0}'.format(error.decode('utf-8')))
+        self._error_callback = self.handle_error
         self._data_callback = None #lambda data: print('data: {0}'.format(data))
+        self._batch_data_callback = None
         self._needs_keep_alive = False
+        # skip messages whose payload equals the previous one
+        self.suppress_duplicates = getattr(config, 'suppress_duplicates', False)
+        self.skipped_decodes = 0
+        self._last_payload = None
+        self.errors = 0
+        # set by Matrix when the component's messages are handled off the event loop
+        self.work_queue = None
+        self.results = Broadcast()
+        self._error_metric = metrics.registry.counter('matrix_component_errors_total', 'Errors published by the driver', host = host, component = self.name, port = self.port)
         
     def get_configuration_proto(self):
         return self._configuration_proto
@@ -16,25 +41,348 @@ class Component():
     def get_error_callback(self):
         return self._error_callback
     
-    def get_data_callback(self):
+    def handle_error(self, error):
+        self.errors += 1
+        self._error_metric.inc()
+        _LOGGER.error("%s: %s", self.name, bytes(error).decode('utf-8', 'replace'))
+
+    def get_decoder(self, quiet = False):
+        """A picklable decoder(data, timestamp) for worker pools, None if messages must be handled inline.
+
+        A quiet decoder only feeds a worker_fn, the message is handled
+        inline again afterwards, so it skips side effects such as logging.
+        """
+        return None
+
+    def deliver(self, item):
+        """Handle a message decoded by the decoder, on the event loop; only called for components with one"""
+        return None
+
+    def get_inline_data_callback(self):
         return self._data_callback
 
+    def get_data_callback(self):
+        callback = self._data_callback
+        if callback is None:
+            return None
+        if self.work_queue is not None:
+            callback = self.work_queue.submit
+        if not self.suppress_duplicates:
+            return callback
+
+        def deduplicated(data):
+            if self.is_duplicate(data):
+                return self.handle_duplicate(time.time())
+            return callback(data)
+        return deduplicated
+
+    def get_batch_data_callback(self):
+        callback = self._batch_data_callback
+        if self.work_queue is not None:
+            callback = self.work_queue.submit_batch
+        elif callback is None:
+            if self._data_callback is None:
+                return None
+            callback = unbatch(self._data_callback)
+        if not self.suppress_duplicates:
+            return callback
+
+        def deduplicated(buffers):
+            now = time.time()
+            results = []
+            run = []
+            # hand over runs of new payloads, so duplicates are handled in order
+            for buf in buffers:
+                if not self.is_duplicate(buf):
+                    run.append(buf)
+                    continue
+                if run:
+                    results.append(callback(run))
+                    run = []
+                results.append(self.handle_duplicate(now))
+            if run:
+                results.append(callback(run))
+            return gather_pending(results)
+        return deduplicated
+
+    def is_duplicate(self, data):
+        """True if data is byte for byte the previous payload, which is then not decoded again"""
+        if self._last_payload is not None and self._last_payload == data:
+            self.skipped_decodes += 1
+            return True
+        self._last_payload = bytes(data)
+        return False
+
+    def handle_duplicate(self, timestamp):
+        """Called instead of the data callback for a payload equal to the previous one"""
+        return None
+
     def get_needs_keep_alives(self):
         return self._needs_keep_alive
 
     configuration_proto = property(get_configuration_proto)
     error_callback = property(get_error_callback)
+    inline_data_callback = property(get_inline_data_callback)
     data_callback = property(get_data_callback)
+    batch_data_callback = property(get_batch_data_callback)
     needs_keep_alive = property(get_needs_keep_alives)
 
     @classmethod
-    def create(cls, config, push_fn):
-        return get_component(config, push_fn)
+    def create(cls, config, push_fn, host = None):
+        return get_component(config, push_fn, host)
     
-def get_component(config, push_fn):
-    module = importlib.import_module('matrix.components.{}'.format(config.name))
-    my_class = getattr(module, config.name.title())
-    my_instance = my_class(config, push_fn)
+class Reading():
+    """Base for the typed, slotted readings decoded from sensor messages.
+
+    The payload is only parsed when a field is read for the first time.
+    Subclasses list their proto fields in `fields` and get a read-only
+    property for each of them.
+    """
+    __slots__ = ('timestamp', '_data', '_proto')
+    proto_type = None
+    fields = ()
+    # fields that can be kept in a History
+    numeric_fields = ()
+
+    def __init__(self, data, timestamp):
+        self.timestamp = timestamp
+        self._data = data
+        self._proto = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for field in cls.__dict__.get('fields', ()):
+            setattr(cls, field, property(_field_getter(field)))
+
+    @classmethod
+    def decode(cls, data, timestamp):
+        return cls(data, timestamp)
+
+    def with_timestamp(self, timestamp):
+        """The same payload received again at timestamp, sharing the decoded proto if there is one"""
+        reading = object.__new__(type(self))
+        reading.timestamp = timestamp
+        # _data first: get_proto sets _proto before it clears _data
+        reading._data = self._data
+        reading._proto = self._proto
+        return reading
+
+    def get_proto(self):
+        proto = self._proto
+        if proto is None:
+            data = self._data
+            if data is None:
+                # another thread decoded it meanwhile
+                return self._proto
+            proto = self._proto = self.proto_type.FromString(data)
+            self._data = None
+        return proto
+
+    def get_decoded(self):
+        return self._proto is not None
+
+    proto = property(get_proto)
+    decoded = property(get_decoded)
+
+    def __repr__(self):
+        return '{}({})'.format(
+            type(self).__name__,
+            ', '.join('{}={!r}'.format(f, getattr(self, f)) for f in self.fields)
+        )
+
+def _timed_reading_type(reading_type, host, component, port):
+    """A subclass of reading_type measuring the (lazy) decode of every reading"""
+    duration = metrics.registry.histogram('matrix_decode_seconds', 'Time spent decoding readings', host = host, component = component, port = port)
+    errors = metrics.registry.counter('matrix_decode_errors_total', 'Readings that could not be decoded', host = host, component = component, port = port)
+    decode = reading_type.get_proto
+    perf_counter = time.perf_counter
+
+    def get_proto(self):
+        if self._proto is not None:
+            return self._proto
+        started = perf_counter()
+        try:
+            return decode(self)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            duration.observe(perf_counter() - started)
+
+    return type(reading_type.__name__, (reading_type,), {
+        '__slots__': (),
+        'get_proto': get_proto,
+        'proto': property(get_proto)
+    })
+
+def _field_getter(field):
+    def getter(self):
+        return getattr(self.get_proto(), field)
+    return getter
+
+class Sensor(Component):
+    """A component publishing typed readings to its subscribers"""
+    reading_type = Reading
+
+    def __init__(self, config, push_fn, host = None):
+        Component.__init__(self, config, push_fn, host)
+        self.readings = Broadcast()
+        self.history = None
+        # the newest reading, kept before any filtering
+        self.latest = None
+        self.max_age = getattr(config, 'max_age', None)
+        # called with every reading before the change filter
+        self.observers = []
+        # set by Matrix, reschedules the keep-alive for a new driver timeout
+        self.update_keep_alive = None
+        if metrics.is_enabled():
+            self.reading_type = _timed_reading_type(self.reading_type, host, self.name, self.port)
+        self.change_filter = create_change_filter(config)
+        self._data_callback = self.sensor_data_callback
+        self._batch_data_callback = self.sensor_batch_data_callback
+        self._needs_keep_alive = True
+        if getattr(config, 'history_size', 0):
+            self.enable_history(config.history_size)
+
+    def stream(self, maxsize = DEFAULT_QUEUE_SIZE, overflow = DROP_OLDEST):
+        """Subscribe to readings: `async for reading in sensor.stream()`"""
+        return self.readings.subscribe(maxsize, overflow)
+
+    def snapshot(self, now = None):
+        """The latest reading with its age, None before the first reading"""
+        reading = self.latest
+        if reading is None:
+            return None
+        age = (time.time() if now is None else now) - reading.timestamp
+        return Snapshot(reading, age, age > self.get_staleness_bound())
+
+    def get_staleness_bound(self):
+        if self.max_age is not None:
+            return self.max_age
+        return STALE_UPDATES * self.configuration_proto.delay_between_updates
+
+    def get_update_interval(self):
+        return self.configuration_proto.delay_between_updates
+
+    update_interval = property(get_update_interval)
+
+    def set_update_interval(self, interval, timeout = None):
+        """Re-push the driver config with a new delay between updates (and ping timeout)"""
+        config = self.configuration_proto
+        config.delay_between_updates = interval
+        if timeout is not None and timeout != config.timeout_after_last_ping:
+            config.timeout_after_last_ping = timeout
+            if self.update_keep_alive is not None:
+                self.update_keep_alive(timeout)
+        # a newer rate replaces one still waiting in the send queue
+        self.push(config, 'rate')
+
+    def enable_adaptive_polling(self, min_interval, max_interval = None, **kwargs):
+        """Poll slowly while readings are stable and speed up when they change, see AdaptivePolling"""
+        from matrix.adaptive import AdaptivePolling
+        policy = AdaptivePolling(self, min_interval, max_interval, **kwargs)
+        policy.start()
+        return policy
+
+    def enable_history(self, capacity):
+        """Keep the last `capacity` readings of all numeric fields"""
+        # imported here, NumPy is expensive to import and most setups run without history
+        from matrix.history import History
+        self.history = History(self.reading_type.numeric_fields, capacity)
+        return self.history
+
+    def get_decoder(self, quiet = False):
+        return functools.partial(decode_reading, type(self).reading_type)
+
+    def deliver(self, reading):
+        return self.handle_reading(reading)
+
+    def sensor_data_callback(self, data):
+        return self.handle_reading(self.reading_type.decode(data, time.time()))
+
+    def sensor_batch_data_callback(self, buffers):
+        now = time.time()
+        return gather_pending([self.handle_reading(self.reading_type.decode(buf, now)) for buf in buffers])
+
+    def get_events_suppressed(self):
+        return self.change_filter.suppressed if self.change_filter is not None else 0
+
+    events_suppressed = property(get_events_suppressed)
+
+    def handle_reading(self, reading):
+        self.latest = reading
+        if self.history is not None:
+            self.history.append_reading(reading)
+        if self.observers:
+            for observer in self.observers:
+                observer(reading)
+        if self.change_filter is not None and not self.change_filter.accept(reading):
+            return None
+        return self.readings.publish(reading)
+
+    def handle_duplicate(self, timestamp):
+        """Refresh the latest reading without decoding it again.
+
+        Observers still see it and the change filter may report it, as a
+        heartbeat or as a change min_interval held back, otherwise it is
+        not published.
+        """
+        latest = self.latest
+        # a reading still in the work queue would be overtaken
+        if latest is None or (self.work_queue is not None and self.work_queue.pending):
+            return None
+        reading = self.latest = latest.with_timestamp(timestamp)
+        for observer in self.observers:
+            observer(reading)
+        if self.change_filter is not None and self.change_filter.heartbeat(reading):
+            return self.readings.publish(reading)
+        return None
+
+class Snapshot():
+    """A sensor's latest reading, how old it is and whether that is too old"""
+    __slots__ = ('reading', 'age', 'stale')
+
+    def __init__(self, reading, age, stale):
+        self.reading = reading
+        self.age = age
+        self.stale = stale
+
+    def get_timestamp(self):
+        return self.reading.timestamp
+
+    timestamp = property(get_timestamp)
+
+    def get(self, field, default = None):
+        """A field of the reading, default if it is stale"""
+        if self.stale:
+            return default
+        return getattr(self.reading, field)
+
+    def __repr__(self):
+        return 'Snapshot({!r}, age={:.3f}, stale={})'.format(self.reading, self.age, self.stale)
+
+def decode_reading(reading_type, data, timestamp):
+    """A fully decoded reading, for decoding in worker threads"""
+    reading = reading_type.decode(data, timestamp)
+    reading.get_proto()
+    return reading
+
+def unbatch(callback):
+    """Adapt a per-message callback to receive lists of buffers"""
+    def per_message(buffers):
+        return gather_pending([callback(bytes(buf)) for buf in buffers])
+    return per_message
+
+def gather_pending(results):
+    """Combine the awaitables among callback results, None if there are none"""
+    pending = [r for r in results if r is not None]
+    if not pending:
+        return None
+    return pending[0] if len(pending) == 1 else asyncio.gather(*pending)
+
+def get_component(config, push_fn, host = None):
+    my_class = get_component_class(config.name)
+    my_instance = my_class(config, push_fn, host)
     return my_instance
 
 
@@ -2,24 +2,26 @@ from matrix.components.component import Component
 from matrix_io.proto.malos.v1 import driver_pb2
 from matrix_io.proto.malos.v1 import io_pb2
 
-import math
+from array import array
+from functools import lru_cache
+import asyncio
 import logging
 
 _LOGGER = logging.getLogger(__name__)
 
+# Number of distinct serialized frames kept around for re-sending
+FRAME_CACHE_SIZE = 256
+
 class Everloop(Component):
-    def __init__(self, config, push_fn):
-        Component.__init__(self, config, push_fn)
+    def __init__(self, config, push_fn, host = None):
+        Component.__init__(self, config, push_fn, host)
         self.led_count = 35
         self._configuration_proto = self.construct_config_proto()
         self._needs_keep_alive = False
+        self.animator = None
 
     def construct_config_proto(self):
-        return _create_everloop_color_config(
-            _create_everloop_colors(
-                self.led_count, [0,0,0,0]
-            )
-        )
+        return EverloopFrame(self.led_count).to_proto()
 
     def set_uniform_intensity(self, intensity):
         self._set_colors([0, 0, 0, intensity])
@@ -28,35 +30,339 @@ class Everloop(Component):
         self._set_colors([r, g, b, w])
 
     def set_multiple_colors(self, *color_arrays):
-        self._set_colors(color_arrays)
+        self._set_colors(*color_arrays)
+
+    def set_frame(self, frame):
+        """Send a full frame, either an EverloopFrame or any (led_count, 4) RGBW sequence"""
+        if not isinstance(frame, EverloopFrame):
+            frame = EverloopFrame(self.led_count, frame)
+        if self.animator is not None:
+            self.animator.submit(frame)
+        else:
+            self._push_frame(frame)
+
+    def create_frame(self, *led_colors_array):
+        return EverloopFrame.from_colors(self.led_count, *led_colors_array)
+
+    def start_animation(self, fps = 30):
+        """Route all frames through a frame rate limited scheduler"""
+        if self.animator is None:
+            self.animator = EverloopAnimator(self._push_frame, fps)
+            self.animator.start()
+        return self.animator
+
+    def stop_animation(self):
+        if self.animator is not None:
+            self.animator.stop()
+            self.animator = None
+
+    def play(self, keyframes, repeat = False):
+        """Play (seconds, frame) keyframes, interpolated ahead of time at the animator's fps"""
+        animator = self.start_animation()
+        frames = interpolate_keyframes(
+            self.led_count,
+            [(t, f if isinstance(f, EverloopFrame) else EverloopFrame(self.led_count, f)) for t, f in keyframes],
+            animator.fps
+        )
+        animator.play(serialize_frames(frames), repeat)
+
+    def _push_frame(self, frame):
+        # a newer frame replaces an older one still waiting in the send queue
+        self.push(frame if isinstance(frame, bytes) else frame.serialize(), 'image')
 
     def _set_colors(self, *color_arrays):
-        colors = _create_everloop_colors(self.led_count, *color_arrays)
-        config = _create_everloop_color_config(colors)
-        self.push(config)
-
-def _create_everloop_colors(led_count, *led_colors_array):
-    if len(led_colors_array) > led_count:
-        _LOGGER.warn(
-            "To many led colors given for everloop. Given: {}. Number of leds: {}".format(
-                len(led_colors_array), 
+        self.set_frame(EverloopFrame.from_colors(self.led_count, *color_arrays))
+
+class EverloopFrame():
+    """A full everloop image stored as a compact, flat RGBW array('B').
+
+    NumPy arrays are accepted as data, and as_array() gives a writable
+    (led_count, 4) NumPy view for vectorized edits; NumPy itself is only
+    imported by the vectorized paths. Frames with equal contents share one
+    cached, already serialized DriverConfig.
+    """
+    __slots__ = ('led_count', 'data')
+
+    def __init__(self, led_count, data=None):
+        self.led_count = led_count
+        if data is None:
+            data = array('B', bytes(led_count * 4))
+        elif hasattr(data, '__array_interface__'):
+            # whoever passes a NumPy array has imported NumPy already
+            import numpy as np
+            data = array('B', np.ascontiguousarray(data, dtype=np.uint8).tobytes())
+        else:
+            data = array('B', _flatten(data))
+        if len(data) != led_count * 4:
+            raise ValueError("Frame needs {} values, got {}".format(led_count * 4, len(data)))
+        self.data = data
+
+    @classmethod
+    def from_colors(cls, led_count, *led_colors_array):
+        """Spread the given RGBW colors evenly over the ring"""
+        color_count = len(led_colors_array)
+        if color_count > led_count:
+            _LOGGER.warning(
+                "To many led colors given for everloop. Given: %s. Number of leds: %s",
+                color_count,
                 led_count
             )
-        )
-    
+
+        if color_count == 1:
+            return cls(led_count, bytes(led_colors_array[0]) * led_count)
+
+        colors = [bytes(color) for color in led_colors_array]
+        return cls(led_count, b''.join([colors[led_idx * color_count // led_count] for led_idx in range(led_count)]))
+
+    def __getitem__(self, led_idx):
+        return tuple(self.data[led_idx * 4:led_idx * 4 + 4])
+
+    def __setitem__(self, led_idx, color):
+        self.data[led_idx * 4:led_idx * 4 + 4] = array('B', color)
+
+    def as_array(self):
+        """The frame as a (led_count, 4) uint8 NumPy array sharing its memory"""
+        import numpy as np
+        return np.frombuffer(self.data, dtype=np.uint8).reshape(self.led_count, 4)
+
+    def __eq__(self, other):
+        return isinstance(other, EverloopFrame) and self.tobytes() == other.tobytes()
+
+    def __hash__(self):
+        return hash(self.tobytes())
+
+    def tobytes(self):
+        return self.data.tobytes()
+
+    def to_proto(self):
+        return _create_everloop_color_config(_create_everloop_image(self.tobytes()))
+
+    def serialize(self, cached = True):
+        """The serialized DriverConfig; one-off frames skip the cache so they do not evict others"""
+        if cached:
+            return _encode_frame(self.tobytes())
+        return _encode_frame.__wrapped__(self.tobytes())
+
+class EverloopAnimator():
+    """Sends at most one frame per tick at a fixed target frame rate.
+
+    Only the newest submitted frame is kept; frames replaced before their
+    tick came are counted as dropped. Precomputed animations are played
+    one frame per tick until a new frame is submitted. Every round of a
+    repeated animation counts as produced again, and the frames of an
+    animation cut short as dropped, so produced is always sent + dropped
+    + queued.
+    """
+    def __init__(self, send_fn, fps = 30):
+        self.fps = fps
+        self._send = send_fn
+        self._pending = None
+        self._animation = None
+        self._repeat = False
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.frames_produced = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.jitter = 0.0
+        self.max_jitter = 0.0
+
+    def submit(self, frame):
+        self.frames_produced += 1
+        if self._pending is not None:
+            self.frames_dropped += 1
+        # a directly submitted frame always wins over a running animation
+        self._drop_animation()
+        self._pending = frame
+        self._wakeup.set()
+
+    def play(self, frames, repeat = False):
+        self.frames_produced += len(frames)
+        if self._pending is not None:
+            self.frames_dropped += 1
+            self._pending = None
+        self._drop_animation()
+        self._animation = (frames, 0)
+        self._repeat = repeat
+        self._wakeup.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self.run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def get_queued(self):
+        """Frames produced but neither sent nor dropped yet"""
+        queued = 1 if self._pending is not None else 0
+        if self._animation is not None:
+            frames, idx = self._animation
+            queued += len(frames) - idx
+        return queued
+
+    queued = property(get_queued)
+
+    def get_stats(self):
+        return {
+            'fps': self.fps,
+            'produced': self.frames_produced,
+            'sent': self.frames_sent,
+            'dropped': self.frames_dropped,
+            'queued': self.queued,
+            'jitter': self.jitter,
+            'max_jitter': self.max_jitter
+        }
+
+    stats = property(get_stats)
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        interval = 1.0 / self.fps
+        next_tick = loop.time()
+        while True:
+            if self._pending is None and self._animation is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                next_tick = max(next_tick, loop.time())
+
+            delay = next_tick - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            now = loop.time()
+            # smoothed deviation from the frame schedule, as in RFC 3550
+            deviation = abs(now - next_tick)
+            self.jitter += (deviation - self.jitter) / 16
+            self.max_jitter = max(self.max_jitter, deviation)
+
+            frame = self._next_frame()
+            if frame is not None:
+                self._send(frame)
+                self.frames_sent += 1
+
+            next_tick += interval
+            if next_tick < now:
+                # we fell behind, do not try to catch up with a burst
+                next_tick = now
+
+    def _next_frame(self):
+        if self._pending is not None:
+            frame, self._pending = self._pending, None
+            return frame
+        if self._animation is not None:
+            frames, idx = self._animation
+            if idx + 1 < len(frames):
+                self._animation = (frames, idx + 1)
+            elif self._repeat:
+                self._animation = (frames, 0)
+                self.frames_produced += len(frames)
+            else:
+                self._animation = None
+            return frames[idx]
+        return None
+
+    def _drop_animation(self):
+        if self._animation is not None:
+            frames, idx = self._animation
+            self.frames_dropped += len(frames) - idx
+            self._animation = None
+
+def interpolate_keyframes(led_count, keyframes, fps):
+    """Linearly interpolate (seconds, EverloopFrame) keyframes into a list of frames at fps"""
+    if not keyframes:
+        raise ValueError("An animation needs at least one keyframe")
+    keyframes = sorted(keyframes, key=lambda k: k[0])
+    start, end = keyframes[0][0], keyframes[-1][0]
+    frame_count = max(int(round((end - start) * fps)), 0) + 1
+    times = [k[0] for k in keyframes]
+
+    np = _numpy()
+    if np is not None:
+        # compute the whole animation as one (frames, led_count, 4) array
+        stack = np.stack([k[1].as_array() for k in keyframes]).astype(np.float32)
+        t = start + np.arange(frame_count) / fps
+        seg = np.clip(np.searchsorted(times, t, side='right') - 1, 0, max(len(keyframes) - 2, 0))
+        if len(keyframes) > 1:
+            span = np.maximum(np.take(times, seg + 1) - np.take(times, seg), 1e-9)
+            weight = np.clip((t - np.take(times, seg)) / span, 0.0, 1.0)[:, None, None]
+            frames = stack[seg] * (1.0 - weight) + stack[seg + 1] * weight
+        else:
+            frames = stack[seg]
+        frames = np.rint(frames).astype(np.uint8)
+        return [EverloopFrame(led_count, f) for f in frames]
+
+    frames = []
+    seg = 0
+    for i in range(frame_count):
+        t = start + i / fps
+        while seg < len(keyframes) - 2 and t >= times[seg + 1]:
+            seg += 1
+        a = keyframes[seg][1].tobytes()
+        if seg + 1 < len(keyframes):
+            b = keyframes[seg + 1][1].tobytes()
+            span = max(times[seg + 1] - times[seg], 1e-9)
+            weight = min(max((t - times[seg]) / span, 0.0), 1.0)
+        else:
+            b, weight = a, 0.0
+        frames.append(EverloopFrame(led_count, bytes(int(round(x * (1.0 - weight) + y * weight)) for x, y in zip(a, b))))
+    return frames
+
+def gradient(led_count, start_color, end_color):
+    """A frame fading from start_color on the first led to end_color on the last"""
+    np = _numpy()
+    if np is not None:
+        weight = (np.arange(led_count) / max(led_count - 1, 1))[:, None]
+        colors = np.asarray(start_color, dtype=np.float32) * (1.0 - weight) + np.asarray(end_color, dtype=np.float32) * weight
+        return EverloopFrame(led_count, np.rint(colors).astype(np.uint8))
+
+    image = bytearray()
+    for led_idx in range(led_count):
+        weight = led_idx / max(led_count - 1, 1)
+        image.extend(int(round(a * (1.0 - weight) + b * weight)) for a, b in zip(start_color, end_color))
+    return EverloopFrame(led_count, image)
+
+@lru_cache(maxsize=None)
+def _numpy():
+    """NumPy for the vectorized helpers, None without it; imported on first use only"""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+def serialize_frames(frames):
+    """Serialize the frames of an animation once, outside the frame cache; equal frames share their bytes"""
+    encoded = {}
+    result = []
+    for frame in frames:
+        key = frame.tobytes()
+        data = encoded.get(key)
+        if data is None:
+            data = encoded[key] = _encode_frame.__wrapped__(key)
+        result.append(data)
+    return result
+
+def frame_cache_info():
+    """Hit/miss statistics of the serialized frame cache"""
+    return _encode_frame.cache_info()
+
+@lru_cache(maxsize=FRAME_CACHE_SIZE)
+def _encode_frame(frame_bytes):
+    return _create_everloop_color_config(_create_everloop_image(frame_bytes)).SerializeToString()
+
+def _create_everloop_image(frame_bytes):
     # initialize an empty list for the "image" or LEDS
     image = []
-    
-    for led_idx in range(led_count):
-        color_count = len(led_colors_array)
-        color_idx = math.floor(((led_idx / color_count) / (led_count / color_count)) * color_count)
-        led_color = led_colors_array[color_idx]
 
+    for offset in range(0, len(frame_bytes), 4):
         ledValue = io_pb2.LedValue()
-        ledValue.red = led_color[0]
-        ledValue.green = led_color[1]
-        ledValue.blue = led_color[2]
-        ledValue.white = led_color[3]
+        ledValue.red = frame_bytes[offset]
+        ledValue.green = frame_bytes[offset + 1]
+        ledValue.blue = frame_bytes[offset + 2]
+        ledValue.white = frame_bytes[offset + 3]
         image.append(ledValue)
 
     return image
@@ -69,3 +375,8 @@ def _create_everloop_color_config(led_array):
     config.image.led.extend(led_array)
 
     return config
+
+def _flatten(data):
+    if isinstance(data, (bytes, bytearray, memoryview, array)):
+        return data
+    return [value for color in data for value in color]
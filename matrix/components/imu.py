@@ -1,21 +1,251 @@
-from matrix.components.component import Component
+from matrix.components.component import Reading, Sensor, gather_pending
+from matrix.streams import Broadcast, DEFAULT_QUEUE_SIZE, DROP_OLDEST
 from matrix_io.proto.malos.v1 import driver_pb2
 from matrix_io.proto.malos.v1 import sense_pb2
 
-class Imu(Component):
-    def __init__(self, config, push_fn):
-        Component.__init__(self, config, push_fn)
+from operator import attrgetter
+import time
+
+# NumPy, bound by _import_numpy() once batches are used; plain readings never need it
+np = None
+
+DEFAULT_HIGH_RATE = 100.0
+DEFAULT_IMU_BATCH_SIZE = 128
+
+class ImuReading(Reading):
+    __slots__ = ()
+    fields = (
+        'yaw', 'pitch', 'roll',
+        'accel_x', 'accel_y', 'accel_z',
+        'gyro_x', 'gyro_y', 'gyro_z',
+        'mag_x', 'mag_y', 'mag_z'
+    )
+    numeric_fields = fields
+    proto_type = sense_pb2.Imu
+
+class Imu(Sensor):
+    reading_type = ImuReading
+
+    def __init__(self, config, push_fn, host = None):
+        Sensor.__init__(self, config, push_fn, host)
         self._configuration_proto = construct_config_proto()
-        self._data_callback = humidity_data_callback
-        self._needs_keep_alive = True
+        self.batches = Broadcast()
+        self.batcher = None
+
+    def set_rate(self, hz):
+        """Ask the driver for hz samples per second"""
+        self.set_update_interval(1.0 / hz)
+
+    def enable_high_rate(self, hz = DEFAULT_HIGH_RATE, batch_size = DEFAULT_IMU_BATCH_SIZE):
+        """Sample at hz and collect samples into ImuBatches of batch_size.
+
+        While enabled, samples only go to the batch subscribers, not to
+        readings and history.
+        """
+        try:
+            _import_numpy()
+        except ImportError:
+            raise ImportError("The high rate IMU mode needs NumPy") from None
+        self.batcher = ImuBatcher(batch_size, hz, self.batches.publish)
+        self.set_rate(hz)
+        return self.batcher
+
+    def disable_high_rate(self, hz = None):
+        self.batcher = None
+        if hz is not None:
+            self.set_rate(hz)
+
+    def batch_stream(self, maxsize = DEFAULT_QUEUE_SIZE, overflow = DROP_OLDEST):
+        """Subscribe to batches: `async for batch in imu.batch_stream()`"""
+        return self.batches.subscribe(maxsize, overflow)
+
+    def deliver(self, reading):
+        batcher = self.batcher
+        if batcher is not None:
+            self.latest = reading
+            return batcher.add_row(batcher.values(reading.proto), reading.timestamp)
+        return self.handle_reading(reading)
+
+    def handle_duplicate(self, timestamp):
+        batcher = self.batcher
+        if batcher is not None and self.latest is not None:
+            # batches keep their sample rate, the repeated sample is added again
+            latest = self.latest = self.latest.with_timestamp(timestamp)
+            return batcher.add_row(batcher.values(latest.proto), timestamp)
+        return Sensor.handle_duplicate(self, timestamp)
+
+    def sensor_data_callback(self, data):
+        batcher = self.batcher
+        if batcher is not None:
+            now = time.time()
+            # decoded through the reading, so decode metrics see the sample
+            reading = self.latest = self.reading_type(data, now)
+            return batcher.add_row(batcher.values(reading.proto), now)
+        return Sensor.sensor_data_callback(self, data)
+
+    def sensor_batch_data_callback(self, buffers):
+        batcher = self.batcher
+        if batcher is not None:
+            now = time.time()
+            if buffers:
+                # received without copying, the buffer does not outlive the callback
+                self.latest = self.reading_type(bytes(buffers[-1]), now)
+            return batcher.extend(buffers, now)
+        return Sensor.sensor_batch_data_callback(self, buffers)
+
+class ImuBatcher():
+    """Decodes raw IMU messages straight into rows of fixed size batches"""
+    def __init__(self, batch_size, sample_rate, publish):
+        self.batch_size = batch_size
+        self.sample_rate = sample_rate
+        self.publish = publish
+        _import_numpy()
+        self.samples = 0
+        self.batches = 0
+        self._rows = []
+        self._timestamps = []
+        self._decode = sense_pb2.Imu.FromString
+        self.values = attrgetter(*ImuReading.fields)
+
+    def add(self, data, timestamp):
+        return self.add_row(self.values(self._decode(data)), timestamp)
+
+    def add_row(self, row, timestamp):
+        """Add one sample given as a tuple ordered like ImuReading.fields"""
+        self._rows.append(row)
+        self._timestamps.append(timestamp)
+        if len(self._rows) >= self.batch_size:
+            return self.flush()
+        return None
+
+    def extend(self, buffers, timestamp):
+        """Add messages received together; all of them get the same timestamp"""
+        decode, values = self._decode, self.values
+        self._rows.extend(values(decode(buf)) for buf in buffers)
+        self._timestamps.extend([timestamp] * len(buffers))
+        results = []
+        while len(self._rows) >= self.batch_size:
+            results.append(self.flush())
+        return gather_pending(results)
+
+    def flush(self):
+        """Publish a batch of the first batch_size (or all remaining) samples"""
+        if not self._rows:
+            return None
+        rows, self._rows = self._rows[:self.batch_size], self._rows[self.batch_size:]
+        timestamps, self._timestamps = self._timestamps[:self.batch_size], self._timestamps[self.batch_size:]
+        self.samples += len(rows)
+        self.batches += 1
+        return self.publish(ImuBatch(np.array(timestamps), np.array(rows), self.sample_rate))
+
+class ImuBatch():
+    """A block of IMU samples as one (n, 12) float64 array, columns ordered like ImuReading.fields.
+
+    Derived quantities are computed for the whole batch at once.
+    """
+    __slots__ = ('timestamps', 'values', 'sample_rate')
+
+    def __init__(self, timestamps, values, sample_rate):
+        _import_numpy()
+        self.timestamps = timestamps
+        self.values = values
+        self.sample_rate = sample_rate
+
+    def __len__(self):
+        return len(self.values)
+
+    def column(self, field):
+        return self.values[:, ImuReading.fields.index(field)]
+
+    def get_orientation(self):
+        return self.values[:, 0:3]
+
+    def get_accel(self):
+        return self.values[:, 3:6]
+
+    def get_gyro(self):
+        return self.values[:, 6:9]
+
+    def get_mag(self):
+        return self.values[:, 9:12]
+
+    def get_accel_magnitude(self):
+        accel = self.accel
+        return np.sqrt(np.einsum('ij,ij->i', accel, accel))
+
+    def get_tilt(self):
+        """Angle between the z axis and gravity per sample, in degrees"""
+        magnitude = np.maximum(self.accel_magnitude, 1e-12)
+        return np.degrees(np.arccos(np.clip(self.values[:, 5] / magnitude, -1.0, 1.0)))
+
+    orientation = property(get_orientation)
+    accel = property(get_accel)
+    gyro = property(get_gyro)
+    mag = property(get_mag)
+    accel_magnitude = property(get_accel_magnitude)
+    tilt = property(get_tilt)
+
+    def smoothed_orientation(self, window = 5):
+        """Moving average of yaw, pitch and roll over `window` samples ((n - window + 1, 3) array).
+
+        Angles are unwrapped first, so averaging across +-180 degrees works.
+        """
+        window = max(1, min(window, len(self.values)))
+        angles = np.unwrap(np.radians(self.orientation), axis = 0)
+        cumulative = np.cumsum(np.vstack([np.zeros((1, 3)), angles]), axis = 0)
+        mean = (cumulative[window:] - cumulative[:-window]) / window
+        return (np.degrees(mean) + 180.0) % 360.0 - 180.0
+
+    def rms(self, fields = ('accel_x', 'accel_y', 'accel_z')):
+        """Root mean square per field, around the batch mean (the AC part)"""
+        columns = self.values[:, [ImuReading.fields.index(f) for f in fields]]
+        return np.sqrt(np.mean(np.square(columns - columns.mean(axis = 0)), axis = 0))
+
+    def vibration_rms(self):
+        """RMS of the acceleration magnitude around its mean, in g"""
+        return float(np.std(self.accel_magnitude))
+
+    def spectrum(self):
+        """(frequencies, amplitudes) of the Hann windowed, mean free acceleration magnitude"""
+        signal = self.accel_magnitude
+        signal = (signal - signal.mean()) * np.hanning(len(signal))
+        amplitudes = np.abs(np.fft.rfft(signal)) * 2.0 / len(signal)
+        return np.fft.rfftfreq(len(signal), 1.0 / self.sample_rate), amplitudes
+
+    def dominant_frequency(self):
+        frequencies, amplitudes = self.spectrum()
+        if len(amplitudes) < 2:
+            return 0.0
+        # skip the DC bin
+        return float(frequencies[1 + np.argmax(amplitudes[1:])])
+
+    def band_energy(self, low, high):
+        """Spectral energy of the acceleration magnitude between low and high Hz"""
+        frequencies, amplitudes = self.spectrum()
+        band = (frequencies >= low) & (frequencies < high)
+        return float(np.sum(np.square(amplitudes[band])))
+
+    def features(self):
+        """The usual vibration and motion features of the batch in one dict"""
+        return {
+            'start': float(self.timestamps[0]),
+            'end': float(self.timestamps[-1]),
+            'samples': len(self.values),
+            'accel_magnitude_mean': float(self.accel_magnitude.mean()),
+            'tilt_mean': float(self.tilt.mean()),
+            'vibration_rms': self.vibration_rms(),
+            'dominant_frequency': self.dominant_frequency()
+        }
+
+def _import_numpy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
 
 def construct_config_proto():
     driver_config_proto = driver_pb2.DriverConfig()
     driver_config_proto.delay_between_updates = 2.0
     driver_config_proto.timeout_after_last_ping = 6.0
     return driver_config_proto
-
-def humidity_data_callback(data):
-    """Capture any data and print them to stdout"""
-    imu_info = sense_pb2.Imu().FromString(data)
-    print('data: {0}'.format(imu_info))
@@ -1,9 +1,11 @@
 from matrix.components.component import Component
+from matrix.streams import Broadcast, DEFAULT_QUEUE_SIZE, DROP_OLDEST
 from matrix_io.proto.malos.v1 import driver_pb2
 from matrix_io.proto.malos.v1 import comm_pb2
 
 import math
 import logging
+from collections import OrderedDict
 from enum import Enum
 import asyncio
 from functools import partial
@@ -12,6 +14,61 @@ logging.basicConfig()
 _LOGGER = logging.getLogger(__name__)
 _LOGGER.setLevel(logging.INFO)
 
+# Enum values resolved once at import instead of on every message
+_ZigBeeMsg = comm_pb2.ZigBeeMsg
+ZCL = _ZigBeeMsg.ZigBeeCmdType.Value("ZCL")
+NETWORK_MGMT = _ZigBeeMsg.ZigBeeCmdType.Value("NETWORK_MGMT")
+
+ZCL_ON_OFF = _ZigBeeMsg.ZCLCmd.ZCLCmdType.Value("ON_OFF")
+ZCL_LEVEL = _ZigBeeMsg.ZCLCmd.ZCLCmdType.Value("LEVEL")
+ZCL_COLOR_CONTROL = _ZigBeeMsg.ZCLCmd.ZCLCmdType.Value("COLOR_CONTROL")
+ON = _ZigBeeMsg.ZCLCmd.OnOffCmd.ZCLOnOffCmdType.Value("ON")
+OFF = _ZigBeeMsg.ZCLCmd.OnOffCmd.ZCLOnOffCmdType.Value("OFF")
+TOGGLE = _ZigBeeMsg.ZCLCmd.OnOffCmd.ZCLOnOffCmdType.Value("TOGGLE")
+MOVE_TO_LEVEL = _ZigBeeMsg.ZCLCmd.LevelCmd.ZCLLevelCmdType.Value("MOVE_TO_LEVEL")
+MOVE_TO_COLOR_TEMP = _ZigBeeMsg.ZCLCmd.ColorControlCmd.ZCLColorControlCmdType.Value("MOVETOCOLORTEMP")
+
+_NetworkMgmtCmdTypes = _ZigBeeMsg.NetworkMgmtCmd.NetworkMgmtCmdTypes
+CREATE_NWK = _NetworkMgmtCmdTypes.Value("CREATE_NWK")
+PERMIT_JOIN = _NetworkMgmtCmdTypes.Value("PERMIT_JOIN")
+DISCOVERY_INFO = _NetworkMgmtCmdTypes.Value("DISCOVERY_INFO")
+RESET_PROXY = _NetworkMgmtCmdTypes.Value("RESET_PROXY")
+IS_PROXY_ACTIVE = _NetworkMgmtCmdTypes.Value("IS_PROXY_ACTIVE")
+NETWORK_STATUS = _NetworkMgmtCmdTypes.Value("NETWORK_STATUS")
+
+_NetworkStatus = _ZigBeeMsg.NetworkMgmtCmd.NetworkStatus.Status
+NO_NETWORK = _NetworkStatus.Value("NO_NETWORK")
+JOINING_NETWORK = _NetworkStatus.Value("JOINING_NETWORK")
+JOINED_NETWORK = _NetworkStatus.Value("JOINED_NETWORK")
+JOINED_NETWORK_NO_PARENT = _NetworkStatus.Value("JOINED_NETWORK_NO_PARENT")
+LEAVING_NETWORK = _NetworkStatus.Value("LEAVING_NETWORK")
+
+DEFAULT_TRANSITION_TIME = 10
+PERMIT_JOIN_TIME = 60
+
+# ZCL clusters a bulb endpoint can offer, and the capability each one stands for
+ON_OFF_CLUSTER = 0x0006
+LEVEL_CLUSTER = 0x0008
+COLOR_CONTROL_CLUSTER = 0x0300
+CAPABILITIES = {
+    ON_OFF_CLUSTER: 'on_off',
+    LEVEL_CLUSTER: 'level',
+    COLOR_CONTROL_CLUSTER: 'color',
+}
+
+# Seconds to wait for the first answer to a network management request,
+# doubled for every retry
+DEFAULT_REQUEST_TIMEOUT = 0.5
+DEFAULT_REQUEST_RETRIES = 3
+# Seconds bring_up waits for a missing network to be formed and joined
+DEFAULT_NETWORK_TIMEOUT = 30.0
+
+# Minimum seconds between two ZCL commands sent to the gateway
+DEFAULT_COMMAND_INTERVAL = 0.02
+# Minimum seconds between two level/color commands for the same node,
+# only the latest value requested in between is sent
+DEFAULT_DEBOUNCE_INTERVAL = 0.1
+
 class Status(Enum):
     NONE = 1
     RESET_GATEWAY = 2
@@ -23,13 +80,26 @@ class Status(Enum):
 class Zigbee(Component):
     status = Status.NONE
 
-    def __init__(self, config, push_fn):
-        Component.__init__(self, config, push_fn)
+    def __init__(self, config, push_fn, host = None):
+        Component.__init__(self, config, push_fn, host)
         self._configuration_proto = self.construct_config_proto()
         self._data_callback = self.zigbee_message_callback
         self._needs_keep_alive = True
         self.services = ZigbeeServices(push_fn)
-        self.devices = []
+        self.registry = ZigbeeDeviceRegistry(self.create_bulb)
+        self.pacer = Pacer(push_fn, getattr(config, 'command_interval', DEFAULT_COMMAND_INTERVAL))
+        self.debouncer = Debouncer(getattr(config, 'debounce_interval', DEFAULT_DEBOUNCE_INTERVAL))
+        # network management command type -> futures waiting for its answer
+        self._waiters = {}
+
+    def get_devices(self):
+        return list(self.registry)
+
+    devices = property(get_devices)
+
+    def device_events(self, maxsize = DEFAULT_QUEUE_SIZE, overflow = DROP_OLDEST):
+        """Subscribe to ('added' | 'removed' | 'changed', bulb) events"""
+        return self.registry.events.subscribe(maxsize, overflow)
 
     def construct_config_proto(self):
         # Create a new driver config
@@ -41,29 +111,35 @@ class Zigbee(Component):
         return driver_config_proto
 
     def zigbee_message_callback(self, data):
-        zig_msg = comm_pb2.ZigBeeMsg.FromString(data)
+        return self.deliver(decode_zigbee_message(data))
 
-        _LOGGER.info("Message: %s", zig_msg)
-        _LOGGER.info("network mgmt: %s", zig_msg.type == comm_pb2.ZigBeeMsg.ZigBeeCmdType.Value("NETWORK_MGMT"))
+    def get_decoder(self, quiet = False):
+        return partial(decode_zigbee_message, log = False) if quiet else decode_zigbee_message
+
+    def deliver(self, zig_msg):
+        _LOGGER.info("network mgmt: %s", zig_msg.type == NETWORK_MGMT)
 
-        if zig_msg.type == comm_pb2.ZigBeeMsg.ZigBeeCmdType.Value("NETWORK_MGMT"):
+        if zig_msg.type == NETWORK_MGMT:
             self.handleNetworkManagementMsg(zig_msg)
             
     def handleNetworkManagementMsg(self, zig_msg):
         network_mgmt_cmd_type = zig_msg.network_mgmt_cmd.type
-        all_network_mgmt_msg_types = comm_pb2.ZigBeeMsg.NetworkMgmtCmd.NetworkMgmtCmdTypes
+        awaited = self._resolve_waiters(network_mgmt_cmd_type, zig_msg)
 
-        if network_mgmt_cmd_type == all_network_mgmt_msg_types.Value("DISCOVERY_INFO"):
-            number_of_added_devices = self.add_zigbee_devices(zig_msg)
-            if number_of_added_devices > 0:
-                _LOGGER.info('%s nodes discovered and added', number_of_added_devices)
+        if network_mgmt_cmd_type == DISCOVERY_INFO:
+            # discovery lists every connected node, anything missing has left
+            number_of_found_devices = self.add_zigbee_devices(zig_msg, complete = True)
+            if number_of_found_devices > 0:
+                _LOGGER.info('%s nodes discovered', number_of_found_devices)
                 return Status.NODES_DISCOVERED
             else:
                 _LOGGER.warning('No devices found!')
                 return Status.NONE
-        elif network_mgmt_cmd_type == all_network_mgmt_msg_types.Value("IS_PROXY_ACTIVE"):
-            self.handle_proxy_active_msg(zig_msg)
-        elif network_mgmt_cmd_type == all_network_mgmt_msg_types.Value("NETWORK_STATUS"):
+        elif network_mgmt_cmd_type == IS_PROXY_ACTIVE:
+            # whoever awaited the answer handles an inactive gateway itself
+            if not awaited:
+                self.status = self.handle_proxy_active_msg(zig_msg)
+        elif network_mgmt_cmd_type == NETWORK_STATUS:
             self.handle_network_status(zig_msg)
 
     def handle_proxy_active_msg(self, zig_msg):
@@ -71,49 +147,167 @@ class Zigbee(Component):
             _LOGGER.info('Gateway connected')
             # self.services.RequestNetworkStatus()
             return Status.WAITING_FOR_NETWORK_STATUS
-        elif not status == Status.RESETTING:
+        elif not self.status == Status.RESET_GATEWAY:
             self.services.ResetGateway()
             _LOGGER.info('Waiting 3 sec ....')
             loop = asyncio.get_event_loop()
             loop.create_task(self.services.checkGatewayActive())
-            return Status.RESETTING
+            return Status.RESET_GATEWAY
         else:
             _LOGGER.warning('Gateway reset failed')
             return Status.NONE
 
+    async def request(self, command, response_type, timeout = DEFAULT_REQUEST_TIMEOUT, retries = DEFAULT_REQUEST_RETRIES):
+        """Send a network management command and wait for the gateway's answer of response_type.
+
+        The command is sent again (with a doubled timeout) when no answer
+        arrives in time. Concurrent requests for the same answer share it,
+        the command is only sent by the first of them. Without a command
+        this just waits for the next answer of response_type.
+        """
+        loop = asyncio.get_event_loop()
+        for attempt in range(retries + 1):
+            future = loop.create_future()
+            waiters = self._waiters.setdefault(response_type, [])
+            in_flight = len(waiters) > 0 and attempt == 0
+            waiters.append(future)
+            if command is not None and not in_flight:
+                self.push(command)
+            try:
+                return await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                _LOGGER.info('No answer to network management request %s after %.1fs', response_type, timeout)
+                timeout *= 2
+            finally:
+                if future in waiters:
+                    waiters.remove(future)
+        raise asyncio.TimeoutError('Zigbee gateway did not answer request {}'.format(response_type))
+
+    async def is_gateway_active(self, timeout = DEFAULT_REQUEST_TIMEOUT, retries = DEFAULT_REQUEST_RETRIES):
+        zig_msg = await self.request(_IS_PROXY_ACTIVE_COMMAND, IS_PROXY_ACTIVE, timeout, retries)
+        return zig_msg.network_mgmt_cmd.is_proxy_active
+
+    async def network_status(self, timeout = DEFAULT_REQUEST_TIMEOUT, retries = DEFAULT_REQUEST_RETRIES):
+        """One of NO_NETWORK, JOINING_NETWORK, JOINED_NETWORK, ..."""
+        zig_msg = await self.request(_NETWORK_STATUS_COMMAND, NETWORK_STATUS, timeout, retries)
+        return zig_msg.network_mgmt_cmd.network_status.type
+
+    async def discover(self, timeout = DEFAULT_REQUEST_TIMEOUT, retries = DEFAULT_REQUEST_RETRIES):
+        """Ask for the connected nodes, returns the bulbs once the registry is updated"""
+        await self.request(_DISCOVERY_INFO_COMMAND, DISCOVERY_INFO, timeout, retries)
+        return self.devices
+
+    async def bring_up(self, timeout = DEFAULT_REQUEST_TIMEOUT, retries = DEFAULT_REQUEST_RETRIES,
+                       network_timeout = DEFAULT_NETWORK_TIMEOUT):
+        """Connect to the gateway, make sure a network exists and discover its bulbs.
+
+        Every step continues as soon as the gateway answers. Raises
+        asyncio.TimeoutError when the network is not joined within
+        network_timeout seconds.
+        """
+        if not await self.is_gateway_active(timeout, retries):
+            self.status = self.services.ResetGateway()
+            if not await self.is_gateway_active(timeout, retries):
+                self.status = Status.NONE
+                raise RuntimeError('Zigbee gateway reset failed')
+
+        status = await self.network_status(timeout, retries)
+        if status != JOINED_NETWORK:
+            # handle_network_status asks to create a missing network, wait until it is joined
+            self.status = Status.WAITING_FOR_NETWORK_STATUS
+            deadline = asyncio.get_event_loop().time() + network_timeout
+            while status != JOINED_NETWORK:
+                remaining = deadline - asyncio.get_event_loop().time()
+                try:
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError()
+                    # nothing to send again, only the deadline limits the wait
+                    zig_msg = await self.request(None, NETWORK_STATUS, remaining, 0)
+                except asyncio.TimeoutError:
+                    self.status = Status.NONE
+                    _LOGGER.error('Zigbee network was not joined within %.1fs, last status %s', network_timeout, status)
+                    raise asyncio.TimeoutError('Zigbee network was not joined within {:.1f}s'.format(network_timeout)) from None
+                status = zig_msg.network_mgmt_cmd.network_status.type
+
+        devices = await self.discover(timeout, retries)
+        self.status = Status.NODES_DISCOVERED if devices else Status.WAITING_FOR_DEVICES
+        return devices
+
+    def _resolve_waiters(self, response_type, zig_msg):
+        waiters = self._waiters.pop(response_type, None)
+        if not waiters:
+            return False
+        for future in waiters:
+            if not future.done():
+                future.set_result(zig_msg)
+        return True
+
     def handle_network_status(self, zig_msg):
         network_status_type = zig_msg.network_mgmt_cmd.network_status.type
-        network_status_types = comm_pb2.ZigBeeMsg.NetworkMgmtCmd.NetworkStatus.Status
 
         _LOGGER.info('Network status type: %s', network_status_type)
 
-        if network_status_type == network_status_types.Value("NO_NETWORK"):
+        if network_status_type == NO_NETWORK:
             self.services.CreateNetwork()
             return Status.WAITING_FOR_NETWORK_STATUS
 
-        elif network_status_type == network_status_types.Value("JOINED_NETWORK"):
+        elif network_status_type == JOINED_NETWORK:
             # add already connected devices
             self.add_zigbee_devices(zig_msg)
             return Status.WAITING_FOR_DEVICES
         else:
-            message = 'JOINING_NETWORK message received' if network_status_type == network_status_types.Value("JOINING_NETWORK") else 'JOINED_NETWORK_NO_PARENT' if network_status_type == network_status_types.Value("JOINED_NETWORK_NO_PARENT") else 'LEAVING_NETWORK message received' if network_status_type ==  network_status_types.Value("LEAVING_NETWORK") else None
+            message = 'JOINING_NETWORK message received' if network_status_type == JOINING_NETWORK else 'JOINED_NETWORK_NO_PARENT' if network_status_type == JOINED_NETWORK_NO_PARENT else 'LEAVING_NETWORK message received' if network_status_type == LEAVING_NETWORK else None
             _LOGGER.info(message)
 
+    def batch(self, command, targets, *args):
+        """Apply one bulb command (e.g. 'set_brightness') to many (node_id, endpoint_index) pairs.
+
+        MALOS only addresses single nodes, there is no ZCL group addressing,
+        so the commands are paced by the shared Pacer instead.
+        """
+        for node_id, endpoint_index in targets:
+            getattr(self.get_device(node_id, endpoint_index), command)(*args)
+
+    def get_device(self, node_id, endpoint_index):
+        """The known bulb at node_id/endpoint_index, or a new one sending through this component"""
+        device = self.registry.get(node_id, endpoint_index)
+        if device is None:
+            device = self.create_bulb(node_id, endpoint_index)
+        return device
+
+    def create_bulb(self, node_id, endpoint_index):
+        return ZigbeeBulb(self.pacer.push, node_id, endpoint_index, self.debouncer)
+
+    def get_command_stats(self):
+        return {
+            # bulb commands asked for, including the ones debouncing swallowed
+            'requested': self.pacer.requested + self.debouncer.debounced,
+            'sent': self.pacer.sent,
+            'debounced': self.debouncer.debounced,
+            'coalesced': self.pacer.coalesced,
+            'queued': self.pacer.depth
+        }
+
+    command_stats = property(get_command_stats)
+
     def add_devices(self, devices):
         for d in devices:
             print("{}, %s", d.name, d.endpoint_index)
             d.toggle()
 
-    def add_zigbee_devices(self, zig_msg):
-        nodes_id = []
+    def add_zigbee_devices(self, zig_msg, complete = False):
+        """Merge the bulbs listed in zig_msg into the registry, returns how many were listed"""
+        discovered = {}
         for node in zig_msg.network_mgmt_cmd.connected_nodes:
             for endpoint in node.endpoints:
-                for cluster in endpoint.clusters:
-                    if cluster.cluster_id == 6:
-                        nodes_id.append((node.node_id, endpoint.endpoint_index))
+                clusters = frozenset(cluster.cluster_id for cluster in endpoint.clusters)
+                if ON_OFF_CLUSTER in clusters:
+                    discovered[(node.node_id, endpoint.endpoint_index)] = clusters
 
-        self.devices.extend([ ZigbeeBulb(self.push, x,y) for x, y in nodes_id])
-        return len(nodes_id)
+        added, removed, changed = self.registry.update(discovered, complete)
+        if added or removed or changed:
+            _LOGGER.info('Devices added: %s, removed: %s, changed: %s', len(added), len(removed), len(changed))
+        return len(discovered)
 
 class ZigbeeServices(object):
 
@@ -122,48 +316,33 @@ class ZigbeeServices(object):
 
     def ResetGateway(self):
         _LOGGER.info('Reseting the Gateway App')
-        _LOGGER.info(_comm_pb2.ZigBeeMsg.ZigBeeCmdType.keys())
-        driver_config_proto = driver_pb2.DriverConfig()
-        driver_config_proto.zigbee_message.type = comm_pb2.ZigBeeMsg.ZigBeeCmdType.Value("NETWORK_MGMT")
-        driver_config_proto.zigbee_message.network_mgmt_cmd.type = comm_pb2.ZigBeeMsg.NetworkMgmtCmd.NetworkMgmtCmdTypes.Value("RESET_PROXY")
-        self.push(driver_config_proto)
+        self.push(_RESET_PROXY_COMMAND)
         return Status.RESET_GATEWAY
         
     def IsGatewayActive(self):
         _LOGGER.info('Checking connection with the Gateway')
-        driver_config_proto = driver_pb2.DriverConfig()
-        driver_config_proto.zigbee_message.type = comm_pb2.ZigBeeMsg.ZigBeeCmdType.Value("NETWORK_MGMT")
-        driver_config_proto.zigbee_message.network_mgmt_cmd.type = comm_pb2.ZigBeeMsg.NetworkMgmtCmd.NetworkMgmtCmdTypes.Value("IS_PROXY_ACTIVE")
-        self.push(driver_config_proto)
+        self.push(_IS_PROXY_ACTIVE_COMMAND)
         return Status.CHECK_GATEWAY_ACTIVE
 
     def RequestNetworkStatus(self):
         _LOGGER.info('Requesting network status')
-        driver_config_proto = driver_pb2.DriverConfig()
-        driver_config_proto.zigbee_message.type = comm_pb2.ZigBeeMsg.ZigBeeCmdType.Value("NETWORK_MGMT")
-        driver_config_proto.zigbee_message.network_mgmt_cmd.type = comm_pb2.ZigBeeMsg.NetworkMgmtCmd.NetworkMgmtCmdTypes.Value("NETWORK_STATUS")
-        driver_config_proto.zigbee_message.network_mgmt_cmd.permit_join_params.time = 60
-        self.push(driver_config_proto)
+        self.push(_NETWORK_STATUS_COMMAND)
         return Status.WAITING_FOR_NETWORK_STATUS
 
     def CreateNetwork(self):
         _LOGGER.info('NO NETWORK')
         _LOGGER.info('CREATING A ZigBee Network')
-
-        driver_config_proto = driver_pb2.DriverConfig()
-        driver_config_proto.zigbee_message.type = comm_pb2.ZigBeeMsg.ZigBeeCmdType.Value("NETWORK_MGMT")
-        driver_config_proto.zigbee_message.network_mgmt_cmd.type = comm_pb2.ZigBeeMsg.NetworkMgmtCmd.NetworkMgmtCmdTypes.Value("CREATE_NWK")
-        driver_config_proto.zigbee_message.network_mgmt_cmd.permit_join_params.time = 60
-        self.push(driver_config_proto)
+        self.push(_CREATE_NWK_COMMAND)
         return Status.WAITING_FOR_NETWORK_STATUS
 
+    def RequestDiscoveryInfo(self):
+        _LOGGER.info('Requesting connected nodes')
+        self.push(_DISCOVERY_INFO_COMMAND)
+        return Status.WAITING_FOR_DEVICES
+
     def PermitJoin(self):
         _LOGGER.info('Permitting join')
-        driver_config_proto = driver_pb2.DriverConfig()
-        driver_config_proto.zigbee_message.type = comm_pb2.ZigBeeMsg.ZigBeeCmdType.Value("NETWORK_MGMT")
-        driver_config_proto.zigbee_message.network_mgmt_cmd.type = comm_pb2.ZigBeeMsg.NetworkMgmtCmd.NetworkMgmtCmdTypes.Value("PERMIT_JOIN")
-        driver_config_proto.zigbee_message.network_mgmt_cmd.permit_join_params.time = 60
-        self.push(driver_config_proto)
+        self.push(_PERMIT_JOIN_COMMAND)
         
         _LOGGER.info('Please reset your zigbee devices')
         _LOGGER.info('.. Waiting 60s for new devices')            
@@ -173,11 +352,238 @@ class ZigbeeServices(object):
         await asyncio.sleep(3)
         self.IsGatewayActive()
 
+class ZigbeeDeviceRegistry():
+    """Known bulbs keyed by (node_id, endpoint_index), indexed by capability.
+
+    update() applies a discovery as a diff: new endpoints get a new bulb,
+    known ones keep their bulb (and its state), and every addition,
+    removal and cluster change is published on `events`.
+    """
+    def __init__(self, create_device):
+        self.create_device = create_device
+        self.events = Broadcast()
+        self._devices = {}
+        self._clusters = {}
+        self._by_capability = {capability: {} for capability in CAPABILITIES.values()}
+
+    def get(self, node_id, endpoint_index):
+        return self._devices.get((node_id, endpoint_index))
+
+    def get_clusters(self, node_id, endpoint_index):
+        return self._clusters.get((node_id, endpoint_index), frozenset())
+
+    def with_capability(self, capability):
+        """All bulbs offering 'on_off', 'level' or 'color'"""
+        return list(self._by_capability[capability].values())
+
+    def update(self, discovered, complete = False):
+        """Apply {(node_id, endpoint_index): cluster ids}.
+
+        With complete=True, discovered is the whole network and known
+        devices missing from it are removed.
+        """
+        added, removed, changed = [], [], []
+        for key, clusters in discovered.items():
+            previous = self._clusters.get(key)
+            if previous == clusters:
+                continue
+            if previous is None:
+                device = self.create_device(*key)
+                self._devices[key] = device
+                added.append(device)
+            else:
+                device = self._devices[key]
+                changed.append(device)
+            self._clusters[key] = clusters
+            self._index(key, device, clusters)
+
+        if complete:
+            for key in [k for k in self._devices if k not in discovered]:
+                removed.append(self.remove(*key, publish = False))
+
+        for event, devices in (('added', added), ('removed', removed), ('changed', changed)):
+            for device in devices:
+                self.events.publish((event, device))
+        return added, removed, changed
+
+    def remove(self, node_id, endpoint_index, publish = True):
+        key = (node_id, endpoint_index)
+        device = self._devices.pop(key)
+        del self._clusters[key]
+        for devices in self._by_capability.values():
+            devices.pop(key, None)
+        if publish:
+            self.events.publish(('removed', device))
+        return device
+
+    def _index(self, key, device, clusters):
+        for cluster_id, capability in CAPABILITIES.items():
+            if cluster_id in clusters:
+                self._by_capability[capability][key] = device
+            else:
+                self._by_capability[capability].pop(key, None)
+
+    def __len__(self):
+        return len(self._devices)
+
+    def __iter__(self):
+        return iter(list(self._devices.values()))
+
+    def __contains__(self, key):
+        return key in self._devices
+
+class Delivery():
+    """Awaitable outcome of a bulb command.
+
+    The MALOS gateway does not acknowledge ZCL commands, so awaiting a
+    command waits until it was handed to the gateway socket (True), or
+    until a newer command for the same target replaced it (False).
+    """
+    __slots__ = ('result', '_waiters')
+
+    def __init__(self, result = None):
+        self.result = result
+        self._waiters = None
+
+    def resolve(self, result):
+        if self.result is not None:
+            return
+        self.result = result
+        for waiter in self._waiters or ():
+            if isinstance(waiter, Delivery):
+                waiter.resolve(result)
+            elif not waiter.done():
+                waiter.set_result(result)
+        self._waiters = None
+
+    def forward_to(self, other):
+        """Resolve other together with this delivery"""
+        if self.result is not None:
+            other.resolve(self.result)
+        else:
+            self._add(other)
+
+    def __await__(self):
+        if self.result is None:
+            future = asyncio.get_event_loop().create_future()
+            self._add(future)
+            yield from future
+        return self.result
+
+    def _add(self, waiter):
+        if self._waiters is None:
+            self._waiters = []
+        self._waiters.append(waiter)
+
+SENT = Delivery(True)
+
+class Pacer():
+    """Sends commands no faster than one per interval.
+
+    A command goes out right away when the last one is at least interval
+    old, otherwise it waits in a queue. Queued commands with the same key
+    replace each other, the newest one keeps the place of the oldest.
+    """
+    def __init__(self, push_fn, interval):
+        self.push_fn = push_fn
+        self.interval = interval
+        self.requested = 0
+        self.sent = 0
+        self.coalesced = 0
+        self._queue = OrderedDict()
+        self._counter = 0
+        self._last_sent = None
+        self._timer = None
+
+    def get_depth(self):
+        return len(self._queue)
+
+    depth = property(get_depth)
+
+    def push(self, proto, key = None):
+        """Send or queue proto, returns its Delivery"""
+        self.requested += 1
+        loop = asyncio.get_event_loop()
+        if not self._queue and (self._last_sent is None or loop.time() - self._last_sent >= self.interval):
+            self._send(proto, key, loop.time())
+            return SENT
+        if key is None:
+            self._counter += 1
+            key = self._counter
+        delivery = Delivery()
+        if key in self._queue:
+            self.coalesced += 1
+            self._queue[key][1].resolve(False)
+        self._queue[key] = (proto, delivery)
+        if self._timer is None:
+            self._timer = loop.call_at(self._last_sent + self.interval, self._flush)
+        return delivery
+
+    def _flush(self):
+        self._timer = None
+        if not self._queue:
+            return
+        loop = asyncio.get_event_loop()
+        key, (proto, delivery) = self._queue.popitem(last = False)
+        self._send(proto, key, loop.time())
+        delivery.resolve(True)
+        if self._queue:
+            self._timer = loop.call_at(self._last_sent + self.interval, self._flush)
+
+    def _send(self, proto, key, now):
+        self._last_sent = now
+        self.sent += 1
+        # keys made up for unkeyed commands must not coalesce downstream
+        self.push_fn(proto, key if isinstance(key, tuple) else None)
+
+class Debouncer():
+    """Latest-wins rate limit per key.
+
+    The first call for a key runs right away, later calls within
+    min_interval are held back and only the last of them runs once the
+    interval is over.
+    """
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self.requested = 0
+        self.debounced = 0
+        self._last_run = {}
+        self._pending = {}
+
+    def submit(self, key, fn):
+        """Run fn (returning a Delivery) now or later, returns its Delivery"""
+        self.requested += 1
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.debounced += 1
+            pending[1].resolve(False)
+            delivery = Delivery()
+            self._pending[key] = (fn, delivery)
+            return delivery
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        last = self._last_run.get(key)
+        if last is None or now - last >= self.min_interval:
+            self._last_run[key] = now
+            return fn()
+        delivery = Delivery()
+        self._pending[key] = (fn, delivery)
+        loop.call_at(last + self.min_interval, self._run_pending, key)
+        return delivery
+
+    def _run_pending(self, key):
+        pending = self._pending.pop(key, None)
+        if pending is not None:
+            fn, delivery = pending
+            self._last_run[key] = asyncio.get_event_loop().time()
+            fn().forward_to(delivery)
+
 class ZigbeeBulb():
 
-    def __init__(self, push_fn, nodeId, endointIndex):
+    def __init__(self, push_fn, nodeId, endointIndex, debouncer = None):
         """Initialize an ZigbeeDevice."""
         self.push = push_fn
+        self._debouncer = debouncer
         self._nodeId = nodeId
         self._endpointIndex = endointIndex
         self._name = str(nodeId)
@@ -185,11 +591,35 @@ class ZigbeeBulb():
         self._brightness = 50
         self._colorTemp = 340
 
+        # fixed commands are serialized once per device
+        self._on_command = _create_on_off_command(nodeId, endointIndex, ON).SerializeToString()
+        self._off_command = _create_on_off_command(nodeId, endointIndex, OFF).SerializeToString()
+        self._toggle_command = _create_on_off_command(nodeId, endointIndex, TOGGLE).SerializeToString()
+
+        # parameterized commands keep a prebuilt config and only patch their value
+        self._level_config = _create_zcl_command(nodeId, endointIndex, ZCL_LEVEL)
+        self._level_config.zigbee_message.zcl_cmd.level_cmd.type = MOVE_TO_LEVEL
+        self._level_params = self._level_config.zigbee_message.zcl_cmd.level_cmd.move_to_level_params
+        self._level_params.transition_time = DEFAULT_TRANSITION_TIME
+
+        self._color_temp_config = _create_zcl_command(nodeId, endointIndex, ZCL_COLOR_CONTROL)
+        self._color_temp_config.zigbee_message.zcl_cmd.colorcontrol_cmd.type = MOVE_TO_COLOR_TEMP
+        self._color_temp_params = self._color_temp_config.zigbee_message.zcl_cmd.colorcontrol_cmd.movetocolortemp_params
+        self._color_temp_params.transition_time = DEFAULT_TRANSITION_TIME
+
+        self._on_off_key = ('on_off', nodeId, endointIndex)
+        self._level_key = ('level', nodeId, endointIndex)
+        self._color_temp_key = ('color_temp', nodeId, endointIndex)
+
     @property
     def name(self):
         """Return the display name of this light."""
         return self._name
 
+    @property
+    def node_id(self):
+        return self._nodeId
+
     @property
     def endpoint_index(self):
         return self._endpointIndex
@@ -217,70 +647,44 @@ class ZigbeeBulb():
         """Return true if light is on."""
         return self._state
 
+    # Every command returns a Delivery, `await bulb.turn_on()` waits until it was sent
+
     def turn_on(self):
         self._state = True
-        config = driver_pb2.DriverConfig()
-
-        config.zigbee_message.type = comm_pb2.ZigBeeMsg.ZigBeeCmdType.Value("ZCL")
-        config.zigbee_message.zcl_cmd.type = comm_pb2.ZigBeeMsg.ZCLCmd.ZCLCmdType.Value("ON_OFF")
-        config.zigbee_message.zcl_cmd.onoff_cmd.type = comm_pb2.ZigBeeMsg.ZCLCmd.OnOffCmd.ZCLOnOffCmdType.Value("ON")
-        config.zigbee_message.zcl_cmd.node_id = self._nodeId
-        config.zigbee_message.zcl_cmd.endpoint_index = self._endpointIndex
-
-        self.push(config)
+        return self._push(self._on_command, self._on_off_key)
 
     def turn_off(self):
         self._state = False
-        
-        config = driver_pb2.DriverConfig()
-
-        config.zigbee_message.type = comm_pb2.ZigBeeMsg.ZigBeeCmdType.Value("ZCL")
-        config.zigbee_message.zcl_cmd.type = comm_pb2.ZigBeeMsg.ZCLCmd.ZCLCmdType.Value("ON_OFF")
-        config.zigbee_message.zcl_cmd.onoff_cmd.type = comm_pb2.ZigBeeMsg.ZCLCmd.OnOffCmd.ZCLOnOffCmdType.Value("OFF")
-        config.zigbee_message.zcl_cmd.node_id = self._nodeId
-        config.zigbee_message.zcl_cmd.endpoint_index = self._endpointIndex
-
-        self.push(config)
+        return self._push(self._off_command, self._on_off_key)
 
     def toggle(self):
-        config = driver_pb2.DriverConfig()
-
-        config.zigbee_message.type = comm_pb2.ZigBeeMsg.ZigBeeCmdType.Value("ZCL")
-        config.zigbee_message.zcl_cmd.type = comm_pb2.ZigBeeMsg.ZCLCmd.ZCLCmdType.Value("ON_OFF")
-        config.zigbee_message.zcl_cmd.onoff_cmd.type = comm_pb2.ZigBeeMsg.ZCLCmd.OnOffCmd.ZCLOnOffCmdType.Value("TOGGLE")
-        config.zigbee_message.zcl_cmd.node_id = self._nodeId
-        config.zigbee_message.zcl_cmd.endpoint_index = self._endpointIndex
-
-        self.push(config)
-
+        return self._push(self._toggle_command)
 
     def set_brightness(self, brightness):
         self._brightness = brightness
-        config = driver_pb2.DriverConfig()
-
-        config.zigbee_message.type = comm_pb2.ZigBeeMsg.ZigBeeCmdType.Value("ZCL")
-        config.zigbee_message.zcl_cmd.type = comm_pb2.ZigBeeMsg.ZCLCmd.ZCLCmdType.Value("LEVEL")
-        config.zigbee_message.zcl_cmd.level_cmd.type = comm_pb2.ZigBeeMsg.ZCLCmd.LevelCmd.ZCLLevelCmdType.Value("MOVE_TO_LEVEL")
-        config.zigbee_message.zcl_cmd.level_cmd.move_to_level_params.level = brightness
-        config.zigbee_message.zcl_cmd.level_cmd.move_to_level_params.transition_time = 10
-        config.zigbee_message.zcl_cmd.node_id = self._nodeId
-        config.zigbee_message.zcl_cmd.endpoint_index = self._endpointIndex
-
-        self.push(config)
+        if self._debouncer is not None:
+            return self._debouncer.submit(self._level_key, self._send_brightness)
+        return self._send_brightness()
 
     def set_color_temp(self, color_temp):
         self._colorTemp = color_temp
-        config = driver_pb2.DriverConfig()
+        if self._debouncer is not None:
+            return self._debouncer.submit(self._color_temp_key, self._send_color_temp)
+        return self._send_color_temp()
 
-        config.zigbee_message.type = comm_pb2.ZigBeeMsg.ZigBeeCmdType.Value("ZCL")
-        config.zigbee_message.zcl_cmd.type = comm_pb2.ZigBeeMsg.ZCLCmd.ZCLCmdType.Value("COLOR_CONTROL")
-        config.zigbee_message.zcl_cmd.colorcontrol_cmd.type = comm_pb2.ZigBeeMsg.ZCLCmd.ColorControlCmd.ZCLColorControlCmdType.Value("MOVETOCOLORTEMP")
-        config.zigbee_message.zcl_cmd.colorcontrol_cmd.movetocolortemp_params.color_temperature = color_temp
-        config.zigbee_message.zcl_cmd.colorcontrol_cmd.movetocolortemp_params.transition_time = 10
-        config.zigbee_message.zcl_cmd.node_id = self._nodeId
-        config.zigbee_message.zcl_cmd.endpoint_index = self._endpointIndex
+    def _send_brightness(self):
+        # only the variable field of the prebuilt command changes
+        self._level_params.level = self._brightness
+        return self._push(self._level_config.SerializeToString(), self._level_key)
 
-        self.push(config)
+    def _send_color_temp(self):
+        self._color_temp_params.color_temperature = self._colorTemp
+        return self._push(self._color_temp_config.SerializeToString(), self._color_temp_key)
+
+    def _push(self, command, key = None):
+        delivery = self.push(command, key)
+        # plain push functions send right away and return nothing
+        return delivery if isinstance(delivery, Delivery) else SENT
 
     def update(self):
         """Fetch new state data for this light.
@@ -289,4 +693,40 @@ class ZigbeeBulb():
         # TODO:
         #self._light.update()
         #self._state = self._light.is_on()
-        #self._brightness = self._light.brightness
\ No newline at end of file
+        #self._brightness = self._light.brightness
+
+def decode_zigbee_message(data, timestamp = None, log = True):
+    """Parse a message of the gateway; logging it is the costly part, so it happens here"""
+    zig_msg = comm_pb2.ZigBeeMsg.FromString(data)
+    if log:
+        _LOGGER.info("Message: %s", zig_msg)
+    return zig_msg
+
+def _create_zcl_command(node_id, endpoint_index, zcl_cmd_type):
+    config = driver_pb2.DriverConfig()
+    config.zigbee_message.type = ZCL
+    config.zigbee_message.zcl_cmd.type = zcl_cmd_type
+    config.zigbee_message.zcl_cmd.node_id = node_id
+    config.zigbee_message.zcl_cmd.endpoint_index = endpoint_index
+    return config
+
+def _create_on_off_command(node_id, endpoint_index, on_off_cmd_type):
+    config = _create_zcl_command(node_id, endpoint_index, ZCL_ON_OFF)
+    config.zigbee_message.zcl_cmd.onoff_cmd.type = on_off_cmd_type
+    return config
+
+def _create_network_mgmt_command(network_mgmt_cmd_type, permit_join_time = None):
+    config = driver_pb2.DriverConfig()
+    config.zigbee_message.type = NETWORK_MGMT
+    config.zigbee_message.network_mgmt_cmd.type = network_mgmt_cmd_type
+    if permit_join_time is not None:
+        config.zigbee_message.network_mgmt_cmd.permit_join_params.time = permit_join_time
+    return config
+
+# network management commands have no variable parts, serialize them once
+_RESET_PROXY_COMMAND = _create_network_mgmt_command(RESET_PROXY).SerializeToString()
+_IS_PROXY_ACTIVE_COMMAND = _create_network_mgmt_command(IS_PROXY_ACTIVE).SerializeToString()
+_NETWORK_STATUS_COMMAND = _create_network_mgmt_command(NETWORK_STATUS, PERMIT_JOIN_TIME).SerializeToString()
+_CREATE_NWK_COMMAND = _create_network_mgmt_command(CREATE_NWK, PERMIT_JOIN_TIME).SerializeToString()
+_PERMIT_JOIN_COMMAND = _create_network_mgmt_command(PERMIT_JOIN, PERMIT_JOIN_TIME).SerializeToString()
+_DISCOVERY_INFO_COMMAND = _create_network_mgmt_command(DISCOVERY_INFO).SerializeToString()
@@ -1,9 +1,45 @@
 class Config():
-    def __init__(self, host, components):
+    def __init__(self, host, components, batch_size = 1, send_queue_size = 0):
         self.host = host
         self.components = components
+        # > 1 drains up to batch_size queued data messages per wakeup, zero-copy
+        self.batch_size = batch_size
+        # > 0 sends configs from a coalescing queue of that size instead of inline
+        self.send_queue_size = send_queue_size
 
 class ComponentConfig():
-    def __init__(self, name, port): 
+    def __init__(
+        self, name, port, history_size = 0, suppress_duplicates = False,
+        deadbands = None, relative_thresholds = None, min_interval = 0.0, max_interval = None,
+        command_interval = 0.02, debounce_interval = 0.1, max_age = None,
+        execution = 'inline', workers = 1, work_queue_size = 256, work_overflow = 'drop_oldest', worker_fn = None
+    ):
         self.name = name
-        self.port = port
\ No newline at end of file
+        self.port = port
+        # number of readings a sensor keeps for windowed queries, 0 disables it
+        self.history_size = history_size
+        # drop data messages identical to the previous one before decoding
+        self.suppress_duplicates = suppress_duplicates
+        # sensor events only fire when a field moved by its deadband ({field: absolute change})
+        # or relative threshold ({field: fraction}), or max_interval seconds passed,
+        # and never more often than every min_interval seconds
+        self.deadbands = deadbands
+        self.relative_thresholds = relative_thresholds
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        # zigbee: minimum seconds between two commands to the gateway, and between
+        # two level/color commands for the same bulb (latest value wins)
+        self.command_interval = command_interval
+        self.debounce_interval = debounce_interval
+        # seconds after which a sensor's latest reading counts as stale,
+        # None allows a few missed updates at the current update interval
+        self.max_age = max_age
+        # where data messages are decoded: 'inline' on the event loop, or in a
+        # 'thread' or 'process' pool of `workers`, with at most work_queue_size
+        # waiting messages (overflow as in matrix.streams). worker_fn(decoded)
+        # runs in the pool too, its results are published on component.results
+        self.execution = execution
+        self.workers = workers
+        self.work_queue_size = work_queue_size
+        self.work_overflow = work_overflow
+        self.worker_fn = worker_fn
\ No newline at end of file
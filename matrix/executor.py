@@ -0,0 +1,275 @@
+"""Execution policies for a component's data messages.
+
+INLINE handles every message right in the socket callback, on the event
+loop. THREAD decodes messages (and runs the component's worker_fn) in a
+thread pool and hands the decoded messages back to the loop. PROCESS
+runs the component's worker_fn in a process pool; payloads travel through
+a shared memory ring and are decoded there for worker_fn only. Decoded
+protos do not pickle, so just worker_fn results come back and the loop
+handles the raw payload as INLINE would; without a worker_fn there is
+nothing to run in a process and the component stays INLINE.
+
+Either way at most maxsize messages wait for a worker; what happens to
+more is decided by the overflow policy of matrix.streams. Results are
+handed to the loop in the order the messages arrived.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from matrix import metrics
+from matrix.streams import BLOCK, DROP_NEWEST, DROP_OLDEST
+
+_LOGGER = logging.getLogger(__name__)
+
+INLINE = 'inline'
+THREAD = 'thread'
+PROCESS = 'process'
+
+DEFAULT_WORK_QUEUE_SIZE = 256
+# payloads up to this size go through shared memory, bigger ones are pickled
+DEFAULT_SLOT_SIZE = 4096
+# messages handed to each worker at once
+IN_FLIGHT_PER_WORKER = 2
+
+class WorkQueue():
+    """Bounded queue feeding one component's messages to a thread or process pool.
+
+    decoder(data, timestamp) and worker_fn(decoded) run in the pool. For
+    threads the decoded message goes to deliver() on the loop, for
+    processes the raw payload goes to inline(). Non-None worker_fn results
+    are passed to on_result(). When those return an awaitable (a full BLOCK
+    subscriber), nothing more is handed back or dispatched until it is done.
+    """
+    def __init__(self, name, decoder, deliver, inline = None, execution = THREAD, workers = 1,
+                 maxsize = DEFAULT_WORK_QUEUE_SIZE, overflow = DROP_OLDEST, worker_fn = None,
+                 on_result = None, slot_size = DEFAULT_SLOT_SIZE, host = None):
+        if execution not in (THREAD, PROCESS):
+            raise ValueError("Unknown execution policy {}".format(execution))
+        self.name = name
+        self.execution = execution
+        self.decoder = decoder
+        self.deliver = deliver
+        self.inline = inline
+        self.worker_fn = worker_fn
+        self.on_result = on_result
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.max_in_flight = workers * IN_FLIGHT_PER_WORKER
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.oversized = 0
+        self.max_depth = 0
+        self.work_time = 0.0
+        self.loop_time = 0.0
+        self.max_loop_time = 0.0
+        self._queue = deque()
+        self._in_flight = deque()
+        self._space = None
+        # a subscriber's backpressure being waited for, nothing is handed back meanwhile
+        self._blocked = None
+        self._work_seconds = metrics.registry.histogram('matrix_work_seconds', 'Time spent per message in workers', host = host, component = name)
+        self._loop_seconds = metrics.registry.histogram('matrix_work_loop_seconds', 'Event loop time spent handing a worked message back', host = host, component = name)
+        self._dropped_metric = metrics.registry.counter('matrix_work_dropped_total', 'Messages dropped from full work queues', host = host, component = name)
+        self._depth_metric = metrics.registry.gauge('matrix_work_queue_depth', 'Messages waiting for a worker', host = host, component = name)
+        if execution == THREAD:
+            self._pool = ThreadPoolExecutor(workers, thread_name_prefix = name)
+            self._memory = None
+        else:
+            # imported here, most setups never start a process pool
+            from multiprocessing import shared_memory
+            self._pool = ProcessPoolExecutor(workers)
+            self.slot_size = slot_size
+            self._memory = shared_memory.SharedMemory(create = True, size = slot_size * self.max_in_flight)
+            self._free_slots = list(range(self.max_in_flight))
+
+    def submit(self, data):
+        """Queue one message; an awaitable when the queue is full and overflow is BLOCK"""
+        self.submitted += 1
+        return self._enqueue(bytes(data), time.time())
+
+    def submit_batch(self, buffers):
+        now = time.time()
+        self.submitted += len(buffers)
+        pending = [self._enqueue(bytes(buf), now) for buf in buffers]
+        pending = [p for p in pending if p is not None]
+        return asyncio.gather(*pending) if pending else None
+
+    def get_depth(self):
+        return len(self._queue)
+
+    def get_pending(self):
+        """Messages queued or in a worker, not handed back to the loop yet"""
+        return len(self._queue) + len(self._in_flight)
+
+    def get_stats(self):
+        return {
+            'execution': self.execution,
+            'depth': len(self._queue),
+            'max_depth': self.max_depth,
+            'in_flight': len(self._in_flight),
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'oversized': self.oversized,
+            'work_time': self.work_time,
+            'loop_time': self.loop_time,
+            'max_loop_time': self.max_loop_time
+        }
+
+    depth = property(get_depth)
+    pending = property(get_pending)
+    stats = property(get_stats)
+
+    def close(self):
+        if self._blocked is not None:
+            self._blocked.cancel()
+            self._blocked = None
+        self._pool.shutdown(wait = False, cancel_futures = True)
+        self._queue.clear()
+        self._in_flight.clear()
+        if self._memory is not None:
+            self._memory.close()
+            self._memory.unlink()
+            self._memory = None
+
+    def _enqueue(self, data, timestamp):
+        if len(self._queue) >= self.maxsize:
+            if self.overflow == BLOCK:
+                return self._wait_for_space(data, timestamp)
+            self.dropped += 1
+            self._dropped_metric.inc()
+            if self.overflow == DROP_NEWEST:
+                return None
+            self._queue.popleft()
+        self._queue.append((data, timestamp))
+        self.max_depth = max(self.max_depth, len(self._queue))
+        self._depth_metric.set(len(self._queue))
+        self._dispatch()
+        return None
+
+    async def _wait_for_space(self, data, timestamp):
+        while len(self._queue) >= self.maxsize:
+            if self._space is None:
+                self._space = asyncio.get_event_loop().create_future()
+            await asyncio.shield(self._space)
+        self._enqueue(data, timestamp)
+
+    def _dispatch(self):
+        loop = asyncio.get_event_loop()
+        while self._queue and self._blocked is None and len(self._in_flight) < self.max_in_flight:
+            data, timestamp = self._queue.popleft()
+            slot = None
+            if self._memory is None:
+                future = loop.run_in_executor(self._pool, run_work, self.decoder, self.worker_fn, data, timestamp)
+            elif len(data) <= self.slot_size:
+                slot = self._free_slots.pop()
+                offset = slot * self.slot_size
+                self._memory.buf[offset:offset + len(data)] = data
+                future = loop.run_in_executor(
+                    self._pool, run_shared_work, self.decoder, self.worker_fn,
+                    self._memory.name, offset, len(data), timestamp
+                )
+            else:
+                self.oversized += 1
+                future = loop.run_in_executor(self._pool, run_work, self.decoder, self.worker_fn, data, timestamp, False)
+            entry = [future, data, slot]
+            self._in_flight.append(entry)
+            future.add_done_callback(self._completed)
+        self._depth_metric.set(len(self._queue))
+        if self._space is not None and len(self._queue) < self.maxsize:
+            self._space.set_result(None)
+            self._space = None
+
+    def _completed(self, _):
+        # hand results back in arrival order
+        while self._blocked is None and self._in_flight and self._in_flight[0][0].done():
+            future, data, slot = self._in_flight.popleft()
+            if slot is not None:
+                self._free_slots.append(slot)
+            if future.cancelled():
+                continue
+            started = time.perf_counter()
+            try:
+                item, result, seconds = future.result()
+                self.work_time += seconds
+                self._work_seconds.observe(seconds)
+                if self._memory is None:
+                    pending = self.deliver(item)
+                else:
+                    pending = self.inline(data)
+                if pending is not None:
+                    self._blocked = asyncio.ensure_future(pending)
+                    self._blocked.add_done_callback(self._unblocked)
+                if result is not None and self.on_result is not None:
+                    self.on_result(result)
+                self.completed += 1
+            except Exception:
+                self.failed += 1
+                _LOGGER.exception("%s: handling a message failed", self.name)
+            elapsed = time.perf_counter() - started
+            self.loop_time += elapsed
+            self.max_loop_time = max(self.max_loop_time, elapsed)
+            self._loop_seconds.observe(elapsed)
+        self._dispatch()
+
+    def _unblocked(self, task):
+        if task is not self._blocked:
+            return
+        self._blocked = None
+        if not task.cancelled() and task.exception() is not None:
+            self.failed += 1
+            _LOGGER.error("%s: waiting for a subscriber failed", self.name, exc_info = task.exception())
+        self._completed(None)
+
+def run_work(decoder, worker_fn, data, timestamp, return_item = True):
+    """Runs in the pool: decode, then worker_fn; returns (decoded, result, seconds)"""
+    started = time.perf_counter()
+    item = decoder(data, timestamp)
+    result = worker_fn(item) if worker_fn is not None else None
+    return item if return_item else None, result, time.perf_counter() - started
+
+# shared memory blocks already attached by this worker process
+_attached = {}
+
+def run_shared_work(decoder, worker_fn, memory_name, offset, length, timestamp):
+    memory = _attached.get(memory_name)
+    if memory is None:
+        memory = _attached[memory_name] = _attach(memory_name)
+    return run_work(decoder, worker_fn, bytes(memory.buf[offset:offset + length]), timestamp, False)
+
+def _attach(name):
+    from multiprocessing import shared_memory
+    try:
+        return shared_memory.SharedMemory(name, track = False)
+    except TypeError:
+        # before Python 3.13; pool workers share the parent's resource
+        # tracker, so registering the block again is harmless
+        return shared_memory.SharedMemory(name)
+
+def create_work_queue(component, config, host = None):
+    """The WorkQueue for a component's execution policy, None for INLINE or components that can not offload"""
+    execution = getattr(config, 'execution', INLINE)
+    if execution == INLINE:
+        return None
+    if execution == PROCESS and getattr(config, 'worker_fn', None) is None:
+        _LOGGER.warning("%s has no worker_fn to run in a process, handling it inline", component.name)
+        return None
+    decoder = component.get_decoder(quiet = execution == PROCESS)
+    if decoder is None:
+        _LOGGER.warning("%s can not run off the event loop, handling it inline", component.name)
+        return None
+    return WorkQueue(
+        component.name, decoder, component.deliver, component.inline_data_callback, execution,
+        workers = getattr(config, 'workers', 1),
+        maxsize = getattr(config, 'work_queue_size', DEFAULT_WORK_QUEUE_SIZE),
+        overflow = getattr(config, 'work_overflow', DROP_OLDEST),
+        worker_fn = getattr(config, 'worker_fn', None),
+        on_result = component.results.publish,
+        host = host
+    )
@@ -0,0 +1,83 @@
+class ChangeFilter():
+    """Lets a reading through only when it changed meaningfully.
+
+    A reading is reported when any watched field moved by at least its
+    absolute deadband or its relative threshold (a fraction of the last
+    reported value) since the last reported reading. Nothing is reported
+    sooner than min_interval after the last report, and once max_interval
+    passed the next reading is reported regardless, as a heartbeat.
+    A change held back by min_interval stays pending, heartbeat() reports
+    it once min_interval passed even if the payload did not change again.
+    """
+    def __init__(self, deadbands = None, relative_thresholds = None, min_interval = 0.0, max_interval = None):
+        self.deadbands = dict(deadbands or {})
+        self.relative_thresholds = dict(relative_thresholds or {})
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.fields = tuple(set(self.deadbands) | set(self.relative_thresholds))
+        self.passed = 0
+        self.suppressed = 0
+        self._last_values = None
+        self._last_time = None
+        self._held = False
+
+    def accept(self, reading):
+        if self._last_time is not None:
+            elapsed = reading.timestamp - self._last_time
+            if elapsed < self.min_interval:
+                self._held = self._changed(reading)
+                self.suppressed += 1
+                return False
+            if (self.max_interval is None or elapsed < self.max_interval) and not self._changed(reading):
+                self._held = False
+                self.suppressed += 1
+                return False
+        return self._report(reading)
+
+    def heartbeat(self, reading):
+        """Accept a repeat of the last reading once a held back change or max_interval is due"""
+        if self._last_time is not None:
+            elapsed = reading.timestamp - self._last_time
+            if self._held and elapsed >= self.min_interval:
+                return self._report(reading)
+            if self.max_interval is not None and elapsed >= self.max_interval:
+                return self._report(reading)
+        self.suppressed += 1
+        return False
+
+    def reset(self):
+        self._last_values = None
+        self._last_time = None
+        self._held = False
+
+    def _report(self, reading):
+        self._held = False
+        self._last_time = reading.timestamp
+        self._last_values = {field: getattr(reading, field) for field in self.fields}
+        self.passed += 1
+        return True
+
+    def _changed(self, reading):
+        if not self.fields:
+            return True
+        for field in self.fields:
+            last = self._last_values[field]
+            delta = abs(getattr(reading, field) - last)
+            deadband = self.deadbands.get(field)
+            if deadband is not None and delta >= deadband:
+                return True
+            threshold = self.relative_thresholds.get(field)
+            # nothing is relative to 0, only the deadband applies then
+            if threshold is not None and last and delta >= threshold * abs(last):
+                return True
+        return False
+
+def create_change_filter(config):
+    """A ChangeFilter for the thresholds of a ComponentConfig, None if it has none"""
+    deadbands = getattr(config, 'deadbands', None)
+    relative_thresholds = getattr(config, 'relative_thresholds', None)
+    min_interval = getattr(config, 'min_interval', 0.0)
+    max_interval = getattr(config, 'max_interval', None)
+    if not (deadbands or relative_thresholds or min_interval or max_interval):
+        return None
+    return ChangeFilter(deadbands, relative_thresholds, min_interval, max_interval)
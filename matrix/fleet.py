@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import zmq.asyncio
+
+from matrix.keepalive import KeepAlive
+from matrix.matrix import Matrix
+from matrix.receiver import Receiver, DEFAULT_BATCH_SIZE
+
+_LOGGER = logging.getLogger(__name__)
+
+class MatrixFleet():
+    """Runs many boards from one process.
+
+    All boards share one zmq context, one Receiver and one KeepAlive
+    scheduler, so the number of tasks stays the same no matter how many
+    boards are attached.
+    Boards are known by a name, 'host:port' of their lowest component port
+    unless one is given, so several boards (or simulators) can share a
+    host. Components are indexed by (board name, component name).
+    """
+    def __init__(self, context = None, batch_size = DEFAULT_BATCH_SIZE):
+        self.context = context if context is not None else zmq.asyncio.Context.instance()
+        self.receiver = Receiver(self.context, batch_size)
+        self.keep_alive = KeepAlive(self.context)
+        self.boards = {}
+        self._index = {}
+        # names of boards still starting up
+        self._starting = set()
+
+    async def add(self, config, name = None):
+        """Bring up the board described by config"""
+        name = name if name is not None else board_name(config)
+        if name in self.boards or name in self._starting:
+            raise ValueError("Board {} is already part of the fleet".format(name))
+        # reserved before awaiting, a concurrent add() of the same board fails
+        self._starting.add(name)
+        try:
+            matrix = await Matrix.create(config, self.receiver, self.context, keep_alive = self.keep_alive)
+        finally:
+            self._starting.discard(name)
+        self.boards[name] = matrix
+        for c in matrix.components:
+            self._index[(name, c.name)] = c
+        return matrix
+
+    async def add_all(self, configs):
+        return await asyncio.gather(*[self.add(config) for config in configs])
+
+    def remove(self, name):
+        """Take a board down, closing its sockets and tasks"""
+        matrix = self.boards.pop(name)
+        for c in matrix.components:
+            self._index.pop((name, c.name), None)
+        matrix.close()
+        _LOGGER.info("Board %s removed", name)
+
+    def get(self, board, name):
+        """The component called name on the board called board, or None"""
+        return self._index.get((board, name))
+
+    def get_board(self, name):
+        return self.boards.get(name)
+
+    def components(self, name):
+        """The component called name of every board, as {board name: component}"""
+        components = {}
+        for board in self.boards:
+            c = self._index.get((board, name))
+            if c is not None:
+                components[board] = c
+        return components
+
+    def read_all(self, now = None):
+        """Latest readings of every board, as {board name: {name: Snapshot}}"""
+        return {board: matrix.read_all(now) for board, matrix in self.boards.items()}
+
+    def get_hosts(self):
+        return sorted({matrix.config.host for matrix in self.boards.values()})
+
+    def get_names(self):
+        return list(self.boards)
+
+    hosts = property(get_hosts)
+    names = property(get_names)
+
+    def close(self):
+        for name in list(self.boards):
+            self.remove(name)
+        self.receiver.close()
+        self.keep_alive.close()
+
+    def __contains__(self, name):
+        return name in self.boards
+
+    def __len__(self):
+        return len(self.boards)
+
+def board_name(config):
+    """The default name of a board: its host and lowest component port"""
+    ports = [c.port for c in config.components]
+    return '{}:{}'.format(config.host, min(ports)) if ports else config.host
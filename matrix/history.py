@@ -0,0 +1,151 @@
+from array import array
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class History():
+    """Fixed capacity columnar ring buffer of sensor readings.
+
+    Every field lives in its own preallocated float64 array next to a
+    timestamp column, so memory use is exactly nbytes no matter how long
+    it runs and appending never allocates. Window queries look at the
+    samples of the last `seconds` and are vectorized with NumPy when it
+    is installed.
+    """
+    def __init__(self, fields, capacity):
+        if capacity < 1:
+            raise ValueError("History capacity must be positive")
+        self.fields = tuple(fields)
+        self.capacity = capacity
+        self._timestamps = array('d', bytes(8 * capacity))
+        self._columns = {f: array('d', bytes(8 * capacity)) for f in self.fields}
+        if np is not None:
+            # zero-copy views sharing memory with the arrays above
+            self._timestamp_view = np.frombuffer(self._timestamps, dtype=np.float64)
+            self._views = {f: np.frombuffer(c, dtype=np.float64) for f, c in self._columns.items()}
+        self._next = 0
+        self._count = 0
+
+    def get_nbytes(self):
+        return 8 * self.capacity * (len(self.fields) + 1)
+
+    nbytes = property(get_nbytes)
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, values):
+        """Store one sample, values ordered like fields"""
+        idx = self._next
+        self._timestamps[idx] = timestamp
+        for field, value in zip(self.fields, values):
+            self._columns[field][idx] = value
+        self._next = (idx + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+
+    def append_reading(self, reading):
+        idx = self._next
+        self._timestamps[idx] = reading.timestamp
+        for field in self.fields:
+            self._columns[field][idx] = getattr(reading, field)
+        self._next = (idx + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+
+    def mean(self, field, seconds = None, now = None):
+        parts = self._window(self._columns[field], field, seconds, now)
+        count = sum(len(p) for p in parts)
+        if count == 0:
+            return None
+        if np is not None:
+            return float(sum(p.sum() for p in parts)) / count
+        return sum(sum(p) for p in parts) / count
+
+    def min(self, field, seconds = None, now = None):
+        parts = [p for p in self._window(self._columns[field], field, seconds, now) if len(p)]
+        if not parts:
+            return None
+        return float(min(p.min() if np is not None else min(p) for p in parts))
+
+    def max(self, field, seconds = None, now = None):
+        parts = [p for p in self._window(self._columns[field], field, seconds, now) if len(p)]
+        if not parts:
+            return None
+        return float(max(p.max() if np is not None else max(p) for p in parts))
+
+    def percentile(self, field, q, seconds = None, now = None):
+        """q-th percentile (0..100), linearly interpolated"""
+        values = self.values(field, seconds, now)
+        if len(values) == 0:
+            return None
+        if np is not None:
+            return float(np.percentile(values, q))
+        values = sorted(values)
+        pos = (len(values) - 1) * q / 100.0
+        lower = int(pos)
+        upper = min(lower + 1, len(values) - 1)
+        return values[lower] + (values[upper] - values[lower]) * (pos - lower)
+
+    def rate(self, field, seconds = None, now = None):
+        """Change per second between the first and the last sample of the window"""
+        lo, count = self._range(seconds, now)
+        if count - lo < 2:
+            return None
+        first = (self._start() + lo) % self.capacity
+        last = (self._start() + count - 1) % self.capacity
+        elapsed = self._timestamps[last] - self._timestamps[first]
+        if elapsed <= 0:
+            return None
+        column = self._columns[field]
+        return (column[last] - column[first]) / elapsed
+
+    def values(self, field, seconds = None, now = None):
+        """Samples of the window in chronological order (a copy)"""
+        parts = self._window(self._columns[field], field, seconds, now)
+        if np is not None:
+            return np.concatenate(parts)
+        return [v for p in parts for v in p]
+
+    def timestamps(self, seconds = None, now = None):
+        parts = self._window(self._timestamps, None, seconds, now)
+        if np is not None:
+            return np.concatenate(parts)
+        return [v for p in parts for v in p]
+
+    def _start(self):
+        return (self._next - self._count) % self.capacity
+
+    def _range(self, seconds, now):
+        """Logical [lo, count) range of samples newer than now - seconds"""
+        if seconds is None or self._count == 0:
+            return 0, self._count
+        cutoff = (time.time() if now is None else now) - seconds
+        start = self._start()
+        lo, hi = 0, self._count
+        # timestamps grow in insertion order, binary search the oldest one in the window
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._timestamps[(start + mid) % self.capacity] < cutoff:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo, self._count
+
+    def _window(self, column, field, seconds, now):
+        """The window as at most two contiguous slices (views with NumPy)"""
+        lo, count = self._range(seconds, now)
+        if np is not None:
+            column = self._timestamp_view if field is None else self._views[field]
+        begin = (self._start() + lo) % self.capacity
+        end = begin + (count - lo)
+        if end <= self.capacity:
+            return [column[begin:end]]
+        return [column[begin:], column[:end - self.capacity]]
@@ -0,0 +1,178 @@
+import asyncio
+import heapq
+import logging
+import random
+import zmq
+import zmq.asyncio
+
+from matrix import metrics
+
+_LOGGER = logging.getLogger(__name__)
+
+# Used when a component does not configure timeout_after_last_ping
+DEFAULT_PING_INTERVAL = 5.0
+# Ping after this fraction of the driver's timeout
+SAFETY_MARGIN = 0.5
+# Random spread of each interval (as a fraction), so pings of many ports do not line up
+JITTER = 0.1
+MIN_PING_INTERVAL = 0.05
+
+class KeepAlive():
+    """Pings the keep-alive ports of any number of components from one task.
+
+    Pending pings are kept in a heap ordered by deadline. Each port is
+    pinged after SAFETY_MARGIN of its driver timeout, with some jitter.
+    MALOS listens for keep-alives on a port of its own, next to the
+    config port, so every keep-alive port needs its own PUSH socket. The
+    scheduler opens that socket once and keeps it.
+    """
+    def __init__(self, context = None, margin = SAFETY_MARGIN, jitter = JITTER):
+        self.context = context if context is not None else zmq.asyncio.Context.instance()
+        self.margin = margin
+        self.jitter = jitter
+        self.pings = 0
+        self.late = 0
+        self.missed = 0
+        self.failed = 0
+        self.max_lateness = 0.0
+        self._heap = []
+        self._entries = {}
+        self._counter = 0
+        self._wakeup = None
+        self._task = None
+
+    def add(self, host, port, timeout = None):
+        """Start pinging host:port often enough for a driver timeout of `timeout` seconds"""
+        key = (host, port)
+        if key in self._entries:
+            self.remove(host, port)
+        if timeout:
+            interval = max(timeout * self.margin, MIN_PING_INTERVAL)
+        else:
+            interval = DEFAULT_PING_INTERVAL
+            timeout = interval / self.margin
+        s = self.context.socket(zmq.PUSH)
+        s.connect('tcp://{0}:{1}'.format(host, port))
+        loop = asyncio.get_event_loop()
+        entry = _Entry(key, s, interval, timeout, loop.time())
+        # sends on the asyncio socket never raise, its blocking twin reports a full queue
+        entry.sender = zmq.Socket.shadow(s.underlying)
+        entry.pinged = metrics.registry.counter('matrix_keepalive_pings_total', 'Keep-alive pings sent', host = host, port = port)
+        entry.late = metrics.registry.counter('matrix_keepalive_late_total', 'Keep-alive pings sent late', host = host, port = port)
+        entry.missed = metrics.registry.counter('matrix_keepalive_missed_total', 'Keep-alive pings sent after the driver timeout', host = host, port = port)
+        entry.failed = metrics.registry.counter('matrix_keepalive_failures_total', 'Keep-alive pings that could not be sent', host = host, port = port)
+        self._entries[key] = entry
+        # ping right away so the driver starts streaming
+        self._schedule(entry, loop.time())
+        return entry
+
+    def remove(self, host, port):
+        entry = self._entries.pop((host, port), None)
+        if entry is not None:
+            # the heap item is skipped once it comes up
+            entry.active = False
+            entry.socket.close(linger = 0)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self.run())
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def close(self):
+        self.stop()
+        for host, port in list(self._entries):
+            self.remove(host, port)
+
+    def get_stats(self):
+        return {
+            'ports': len(self._entries),
+            'pings': self.pings,
+            'late': self.late,
+            'missed': self.missed,
+            'failed': self.failed,
+            'max_lateness': self.max_lateness
+        }
+
+    stats = property(get_stats)
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        self._wakeup = asyncio.Event()
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            deadline, _, entry = self._heap[0]
+            delay = deadline - loop.time()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    # wake up early when a port with an earlier deadline is added
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            if not entry.active:
+                continue
+            self._ping(entry, deadline, loop.time())
+            self._schedule(entry, deadline + entry.next_interval(self.jitter))
+
+    def _ping(self, entry, deadline, now):
+        lateness = now - deadline
+        self.max_lateness = max(self.max_lateness, lateness)
+        if lateness > entry.interval * self.jitter:
+            self.late += 1
+            entry.late.inc()
+        if now - entry.last_ping > entry.timeout:
+            # the driver may already have stopped for lack of pings
+            self.missed += 1
+            entry.missed.inc()
+            _LOGGER.warning("Keep-alive for %s:%s missed its deadline by %.3fs", entry.key[0], entry.key[1], now - entry.last_ping - entry.timeout)
+        try:
+            # Ping with empty string to let the drive know we're still listening
+            entry.sender.send(b'', zmq.NOBLOCK)
+        except zmq.Again:
+            self.failed += 1
+            entry.failed.inc()
+            _LOGGER.warning("Keep-alive for %s:%s could not be sent", entry.key[0], entry.key[1])
+            return
+        entry.last_ping = now
+        self.pings += 1
+        entry.pinged.inc()
+
+    def _schedule(self, entry, deadline):
+        loop = asyncio.get_event_loop()
+        # never try to catch up with a burst after the loop was blocked
+        deadline = max(deadline, loop.time())
+        self._counter += 1
+        heapq.heappush(self._heap, (deadline, self._counter, entry))
+        if self._wakeup is not None and self._heap[0][2] is entry:
+            self._wakeup.set()
+
+class _Entry():
+    __slots__ = ('key', 'socket', 'sender', 'interval', 'timeout', 'last_ping', 'active', 'pinged', 'late', 'missed', 'failed')
+
+    def __init__(self, key, socket, interval, timeout, now):
+        self.key = key
+        self.socket = socket
+        self.sender = socket
+        self.interval = interval
+        self.timeout = timeout
+        self.last_ping = now
+        self.active = True
+        self.pinged = metrics.NULL_METRIC
+        self.late = metrics.NULL_METRIC
+        self.missed = metrics.NULL_METRIC
+        self.failed = metrics.NULL_METRIC
+
+    def next_interval(self, jitter):
+        return self.interval * (1.0 + random.uniform(-jitter, jitter))
@@ -1,65 +1,227 @@
+import functools
 import logging
 import asyncio
+import time
 import zmq
 import zmq.asyncio
-from matrix_io.proto.malos.v1 import driver_pb2
-from matrix_io.proto.malos.v1 import comm_pb2
-from matrix_io.proto.malos.v1 import sense_pb2
-from matrix_io.proto.malos.v1 import io_pb2
 
+from matrix import metrics
 from matrix.components.component import Component
+from matrix.keepalive import KeepAlive
+from matrix.receiver import drain, feed
+from matrix.sender import Sender
 
 _LOGGER = logging.getLogger(__name__)
 ctx = zmq.asyncio.Context.instance()
 
 class Matrix():
     @classmethod
-    async def create(cls, config):
+    async def create(cls, config, receiver = None, context = None, keep_alive = None, recorder = None):
+        """Connect all configured components.
+
+        When a Receiver is given, all error and data sockets are served by its
+        single poller task instead of one task per socket. A zmq context can
+        be passed in to share it between several boards. Sockets connect in
+        the background, so no component waits for another to be reachable
+        before it is configured. The time spent in each phase is
+        kept in startup_timings. Keep-alives of all components are sent by one
+        KeepAlive scheduler, which can be shared between boards as well.
+        With metrics enabled, sockets and callbacks of the board are measured.
+        A Recorder captures everything received (and optionally pushed).
+        """
         self = cls()
         self.config = config
         self.components = []
+        self.context = context if context is not None else ctx
+        self.receiver = receiver
+        self.recorder = recorder
+        self._owns_keep_alive = keep_alive is None
+        self.keep_alive = keep_alive if keep_alive is not None else KeepAlive(self.context)
+        self._tasks = []
+        self._subscriptions = []
+        self.startup_timings = {}
         loop = asyncio.get_event_loop()
+        started = time.perf_counter()
 
         _LOGGER.warning("Host: %s", 'tcp://{0}'.format(config.host))
 
-        self.components = [Component.create(c, await get_push_fn(config.host, c.port)) for c in config.components]
- 
+        queue_size = config.send_queue_size
+        push_fns = [await get_push_fn(config.host, c.port, self.context, queue_size) for c in config.components]
+        if recorder is not None and recorder.record_pushes:
+            push_fns = [recorder.wrap_push_fn(c.port, push_fn) for c, push_fn in zip(config.components, push_fns)]
+        phase = _record_phase(self.startup_timings, 'connect', started)
+
+        self.components = [Component.create(c, push_fn, config.host) for c, push_fn in zip(config.components, push_fns)]
+        for c, component_config in zip(self.components, config.components):
+            if getattr(component_config, 'execution', 'inline') != 'inline':
+                # imported here, the default inline setup never needs a pool
+                from matrix.executor import create_work_queue
+                c.work_queue = create_work_queue(c, component_config, config.host)
+        self._components_by_name = {c.name: c for c in self.components}
+        phase = _record_phase(self.startup_timings, 'load', phase)
+
         for c in self.components:
             c.push(c.configuration_proto)
-
+        phase = _record_phase(self.startup_timings, 'configure', phase)
+ 
+        for c in self.components:
             if c.needs_keep_alive:
-                loop.create_task(ping_component(config.host, c.port + 1))
+                self.keep_alive.add(config.host, c.port + 1, c.configuration_proto.timeout_after_last_ping)
+                if hasattr(c, 'update_keep_alive'):
+                    c.update_keep_alive = functools.partial(self.keep_alive.add, config.host, c.port + 1)
+
+            if receiver is not None:
+                self._subscriptions.append(receiver.subscribe(config.host, c.port + 2, c.error_callback, recorder = recorder))
+                if c.data_callback is not None:
+                    if config.batch_size > 1:
+                        self._subscriptions.append(receiver.subscribe(config.host, c.port + 3, c.batch_data_callback, batch = True, recorder = recorder))
+                    else:
+                        self._subscriptions.append(receiver.subscribe(config.host, c.port + 3, c.data_callback, recorder = recorder))
+                continue
 
-            loop.create_task(register_callback(config.host, c.port + 2, c.error_callback))
+            self._tasks.append(loop.create_task(register_callback(config.host, c.port + 2, c.error_callback, context = self.context, recorder = recorder)))
 
             if c.data_callback is not None:
-                loop.create_task(register_callback(config.host, c.port + 3, c.data_callback))
+                if config.batch_size > 1:
+                    self._tasks.append(loop.create_task(register_callback(config.host, c.port + 3, c.batch_data_callback, config.batch_size, self.context, recorder)))
+                else:
+                    self._tasks.append(loop.create_task(register_callback(config.host, c.port + 3, c.data_callback, context = self.context, recorder = recorder)))
+
+        if receiver is not None:
+            receiver.start()
+        self.keep_alive.start()
+        phase = _record_phase(self.startup_timings, 'subscribe', phase)
+        self.startup_timings['total'] = phase - started
+        _LOGGER.debug("Startup timings: %s", self.startup_timings)
+
+        if metrics.is_enabled():
+            for name, seconds in self.startup_timings.items():
+                metrics.registry.gauge('matrix_startup_seconds', 'Time spent per startup phase', host = config.host, phase = name).set(seconds)
+            metrics.registry.gauge('matrix_components', 'Connected components per board', host = config.host).set(len(self.components))
+            metrics.monitor_event_loop()
 
         return self
 
-async def ping_component(host, port, ping = 5):
-    s = ctx.socket(zmq.PUSH)
-    s.connect('tcp://{0}:{1}'.format(host, port))
-    # Start a forever loop
-    while True:
-        # Ping with empty string to let the drive know we're still listening
-        s.send_string('')
-        # Delay between next ping
-        await asyncio.sleep(ping)
-
-async def get_push_fn(host, port):
-    s = ctx.socket(zmq.PUSH)
+    def get_component(self, name):
+        """The component with the given name, None if it is not configured"""
+        return self._components_by_name.get(name)
+
+    def read(self, name, now = None):
+        """Snapshot of the latest reading of the sensor called name, None without one"""
+        c = self._components_by_name.get(name)
+        if c is None or not hasattr(c, 'snapshot'):
+            return None
+        return c.snapshot(now)
+
+    def read_all(self, now = None):
+        """{name: Snapshot} of every sensor, taken at one instant without waiting for new data"""
+        now = time.time() if now is None else now
+        return {c.name: c.snapshot(now) for c in self.components if hasattr(c, 'snapshot')}
+
+    def close(self):
+        """Stop all tasks and close every socket of this board"""
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        for s in self._subscriptions:
+            self.receiver.unsubscribe(s)
+        self._subscriptions = []
+        if self._owns_keep_alive:
+            self.keep_alive.close()
+        else:
+            for c in self.components:
+                if c.needs_keep_alive:
+                    self.keep_alive.remove(self.config.host, c.port + 1)
+        for c in self.components:
+            if c.work_queue is not None:
+                c.work_queue.close()
+            sender = getattr(c.push, 'sender', None)
+            if sender is not None:
+                sender.stop()
+            socket = getattr(c.push, 'socket', None)
+            if socket is not None:
+                socket.close(linger = 0)
+
+def _record_phase(timings, name, phase_started):
+    now = time.perf_counter()
+    timings[name] = now - phase_started
+    return now
+
+async def get_push_fn(host, port, context = None, queue_size = 0):
+    """A function sending configs to host:port.
+
+    With a queue_size the function only queues the config for a Sender,
+    configs pushed with the same key then replace each other while queued.
+    """
+    s = (context or ctx).socket(zmq.PUSH)
     s.connect('tcp://{0}:{1}'.format(host, port))
-    def sendConfig(proto):
-        s.send(proto.SerializeToString())
+    if queue_size:
+        sender = Sender(s, queue_size)
+        sender.failed_metric = metrics.registry.counter('matrix_push_failures_total', 'Configs that could not be sent', host = host, port = port)
+        sender.start()
+        # bound methods do not take attributes, wrap it
+        def sendConfig(proto, key = None):
+            return sender.push(proto, key)
+        sendConfig.sender = sender
+    elif metrics.is_enabled():
+        # asyncio sends never raise, errors end up in the returned future
+        check_sent = functools.partial(_check_sent, metrics.registry.counter('matrix_push_failures_total', 'Configs that could not be sent', host = host, port = port), host, port)
+
+        def sendConfig(proto, key = None):
+            s.send(proto if isinstance(proto, bytes) else proto.SerializeToString()).add_done_callback(check_sent)
+    else:
+        def sendConfig(proto, key = None):
+            # already serialized configs (e.g. cached everloop frames) are sent as is
+            s.send(proto if isinstance(proto, bytes) else proto.SerializeToString())
+    if metrics.is_enabled():
+        sendConfig = _instrument_push_fn(sendConfig, host, port)
+    sendConfig.socket = s
+    return sendConfig
+
+def _check_sent(failures, host, port, future):
+    if not future.cancelled() and future.exception() is not None:
+        failures.inc()
+        _LOGGER.error("Sending a config to %s:%s failed: %s", host, port, future.exception())
+
+def _instrument_push_fn(push_fn, host, port):
+    pushes = metrics.registry.counter('matrix_pushes_total', 'Configs pushed', host = host, port = port)
+
+    def sendConfig(proto, key = None):
+        pushes.inc()
+        return push_fn(proto, key)
+    if hasattr(push_fn, 'sender'):
+        sendConfig.sender = push_fn.sender
     return sendConfig
 
-async def register_callback(host, port, callback):
-    s = ctx.socket(zmq.SUB)
+async def register_callback(host, port, callback, batch_size = None, context = None, recorder = None):
+    """Feed every message published on host:port to callback.
+
+    With a batch_size, messages are received without copying and every
+    already queued message (up to batch_size) is drained at once; the
+    callback then gets a list of memoryviews per wakeup. A recorder
+    captures every message before the callback sees it.
+    """
+    s = (context or ctx).socket(zmq.SUB)
     s.connect('tcp://{0}:{1}'.format(host, port))
     s.subscribe(b'')
-    while True:
-        msg = await s.recv()
-        callback(msg)
-    s.close()
+    if recorder is not None:
+        callback = recorder.wrap_callback(port, callback, batch_size is not None)
+    callback = metrics.instrument_callback(callback, host, port, batch_size is not None)
+    try:
+        if batch_size is None:
+            while True:
+                msg = await s.recv()
+                pending = feed(callback, msg)
+                # callbacks return an awaitable when a subscriber asks for backpressure
+                if pending is not None:
+                    await pending
+        else:
+            sync_socket = zmq.Socket.shadow(s.underlying)
+            while True:
+                frames = drain(sync_socket, batch_size - 1, copy = False, msgs = [await s.recv(copy = False)])
+                pending = feed(callback, [frame.buffer for frame in frames])
+                if pending is not None:
+                    await pending
+    finally:
+        s.close(linger = 0)
     
@@ -0,0 +1,278 @@
+"""Runtime counters and histograms of the client.
+
+Metrics are off by default and then cost (almost) nothing: hot paths
+are only wrapped with measuring code when metrics were enabled before
+the board was created, everything else gets a shared no-op metric.
+
+    from matrix import metrics
+    metrics.enable()
+    matrix = await Matrix.create(config)
+    server = await metrics.serve(port = 9108)  # Prometheus text on /metrics
+    metrics.registry.snapshot()                # or read them directly
+"""
+import asyncio
+import bisect
+import logging
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds in seconds, from 50us up to 5s
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0
+)
+DEFAULT_PORT = 9108
+LOOP_MONITOR_INTERVAL = 0.25
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+class Counter():
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount = 1):
+        self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+class Gauge():
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount = 1):
+        self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+class Histogram():
+    """Counts observations per bucket, the last slot counts everything above the largest bound"""
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile, None without observations"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99)
+        }
+
+class _NullMetric():
+    """Stands in for every metric while metrics are disabled"""
+    __slots__ = ()
+
+    def inc(self, amount = 1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+NULL_METRIC = _NullMetric()
+
+_TYPES = {COUNTER: Counter, GAUGE: Gauge, HISTOGRAM: Histogram}
+
+class Registry():
+    """All metric families, each with one child per label set"""
+    def __init__(self):
+        self.enabled = False
+        self._families = {}
+
+    def counter(self, name, help, **labels):
+        return self._get(COUNTER, name, help, labels)
+
+    def gauge(self, name, help, **labels):
+        return self._get(GAUGE, name, help, labels)
+
+    def histogram(self, name, help, **labels):
+        return self._get(HISTOGRAM, name, help, labels)
+
+    def clear(self):
+        self._families = {}
+
+    def snapshot(self):
+        """{name: {label string: value}} of all metrics, histograms as count/sum/p50/p99"""
+        return {
+            name: {_format_labels(labels): metric.snapshot() for labels, metric in children.items()}
+            for name, (_, _, children) in sorted(self._families.items())
+        }
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for name, (metric_type, help, children) in sorted(self._families.items()):
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} {}'.format(name, metric_type))
+            for labels, metric in children.items():
+                if metric_type != HISTOGRAM:
+                    lines.append('{}{} {}'.format(name, _format_labels(labels), _format_value(metric.value)))
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), metric.counts):
+                    cumulative += count
+                    lines.append('{}_bucket{} {}'.format(name, _format_labels(labels + (('le', _format_value(bound)),)), cumulative))
+                lines.append('{}_sum{} {}'.format(name, _format_labels(labels), _format_value(metric.sum)))
+                lines.append('{}_count{} {}'.format(name, _format_labels(labels), metric.count))
+        return '\n'.join(lines) + '\n'
+
+    def _get(self, metric_type, name, help, labels):
+        if not self.enabled:
+            return NULL_METRIC
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = (metric_type, help, {})
+        elif family[0] != metric_type:
+            raise ValueError("Metric {} is a {}, not a {}".format(name, family[0], metric_type))
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        children = family[2]
+        metric = children.get(key)
+        if metric is None:
+            metric = children[key] = _TYPES[metric_type]()
+        return metric
+
+registry = Registry()
+
+def enable():
+    """Turn metrics on; only boards and sockets created afterwards are measured"""
+    registry.enabled = True
+
+def disable():
+    registry.enabled = False
+
+def is_enabled():
+    return registry.enabled
+
+def instrument_callback(callback, host, port, batch = False):
+    """Count and time every call of a socket callback, the callback itself while disabled"""
+    if not registry.enabled or callback is None:
+        return callback
+    received = registry.counter('matrix_messages_received_total', 'Messages received per socket', host = host, port = port)
+    duration = registry.histogram('matrix_callback_seconds', 'Time spent in socket callbacks', host = host, port = port)
+    perf_counter = time.perf_counter
+
+    def instrumented(msg):
+        started = perf_counter()
+        try:
+            return callback(msg)
+        finally:
+            duration.observe(perf_counter() - started)
+            received.inc(len(msg) if batch else 1)
+    return instrumented
+
+class LoopMonitor():
+    """Measures how late the event loop wakes up a task sleeping for `interval`"""
+    def __init__(self, interval = LOOP_MONITOR_INTERVAL):
+        self.interval = interval
+        self.lag = registry.histogram('matrix_event_loop_lag_seconds', 'Delay of event loop wakeups')
+        self.max_lag = registry.gauge('matrix_event_loop_max_lag_seconds', 'Largest delay of an event loop wakeup')
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self.run())
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        largest = 0.0
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - expected, 0.0)
+            self.lag.observe(lag)
+            if lag > largest:
+                largest = lag
+                self.max_lag.set(lag)
+
+_loop_monitor = None
+
+def monitor_event_loop(interval = LOOP_MONITOR_INTERVAL):
+    """Start the (single) event loop lag monitor if metrics are enabled"""
+    global _loop_monitor
+    if not registry.enabled:
+        return None
+    if _loop_monitor is None or _loop_monitor._task is None or _loop_monitor._task.done():
+        _loop_monitor = LoopMonitor(interval)
+        _loop_monitor.start()
+    return _loop_monitor
+
+async def serve(host = '127.0.0.1', port = DEFAULT_PORT, registry = registry):
+    """Serve the Prometheus text format on http://host:port/metrics"""
+    async def handle(reader, writer):
+        try:
+            request = await reader.readline()
+            # skip the headers
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request.split()
+            if len(parts) >= 2 and parts[0] == b'GET' and parts[1].split(b'?')[0] in (b'/', b'/metrics'):
+                status, body = '200 OK', registry.render().encode('utf-8')
+            else:
+                status, body = '404 Not Found', b'not found\n'
+            writer.write(
+                'HTTP/1.0 {}\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {}\r\n\r\n'
+                .format(status, len(body)).encode('ascii') + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    _LOGGER.info("Serving metrics on http://%s:%s/metrics", host, port)
+    return server
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, _escape(v)) for k, v in labels) + '}'
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import zmq
+import zmq.asyncio
+
+from matrix import metrics
+
+_LOGGER = logging.getLogger(__name__)
+
+# Upper bound of messages taken from one socket per wakeup, so a single
+# busy socket can not starve the others
+DEFAULT_BATCH_SIZE = 64
+
+class Receiver():
+    """Receives from any number of SUB sockets with a single poller task.
+
+    Every wakeup drains all ready sockets without blocking (up to
+    batch_size messages each) before any callback is run. A callback
+    asking for backpressure only pauses its own socket: it is taken out of
+    the poller until the subscriber caught up, all other sockets go on.
+    """
+    def __init__(self, ctx = None, batch_size = DEFAULT_BATCH_SIZE):
+        self.ctx = ctx if ctx is not None else zmq.asyncio.Context.instance()
+        self.batch_size = batch_size
+        self.wakeups = 0
+        self.messages = 0
+        self._poller = zmq.asyncio.Poller()
+        self._subscriptions = {}
+        # socket -> task waiting for its subscribers while the socket is not polled
+        self._paused = {}
+        self._poll_future = None
+        self._task = None
+
+    def subscribe(self, host, port, callback, batch = False, recorder = None):
+        """Connect a SUB socket to host:port and feed every message to callback.
+
+        With batch=True the callback instead gets one list of zero-copy
+        buffers per wakeup. A recorder captures every message first.
+        """
+        s = self.ctx.socket(zmq.SUB)
+        s.connect('tcp://{0}:{1}'.format(host, port))
+        s.subscribe(b'')
+        if recorder is not None:
+            callback = recorder.wrap_callback(port, callback, batch)
+        callback = metrics.instrument_callback(callback, host, port, batch)
+        # blocking twin of the same socket, used to drain it with NOBLOCK
+        self._subscriptions[s] = (zmq.Socket.shadow(s.underlying), callback, batch)
+        self._poller.register(s, zmq.POLLIN)
+        self._restart_poll()
+        return s
+
+    def unsubscribe(self, s):
+        if self._subscriptions.pop(s, None) is not None:
+            paused = self._paused.pop(s, None)
+            if paused is not None:
+                paused.cancel()
+            else:
+                self._poller.unregister(s)
+                self._restart_poll()
+            s.close(linger=0)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self.run())
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def close(self):
+        self.stop()
+        for s in list(self._subscriptions):
+            self.unsubscribe(s)
+
+    def get_stats(self):
+        return {
+            'sockets': len(self._subscriptions),
+            'wakeups': self.wakeups,
+            'messages': self.messages,
+            'messages_per_wakeup': self.messages / self.wakeups if self.wakeups else 0.0
+        }
+
+    stats = property(get_stats)
+
+    async def run(self):
+        while True:
+            self._poll_future = asyncio.ensure_future(self._poller.poll())
+            try:
+                await asyncio.wait([self._poll_future])
+            finally:
+                if not self._poll_future.done():
+                    self._poll_future.cancel()
+            # the socket set changed while we were waiting, poll again
+            if self._poll_future.cancelled():
+                continue
+
+            self.wakeups += 1
+            batches = []
+            for s, _ in self._poll_future.result():
+                subscription = self._subscriptions.get(s)
+                if subscription is not None:
+                    sync_socket, callback, batch = subscription
+                    batches.append((s, callback, batch, drain(sync_socket, self.batch_size, copy = not batch)))
+
+            for s, callback, batch, msgs in batches:
+                self.messages += len(msgs)
+                if batch:
+                    msgs = [[frame.buffer for frame in msgs]]
+                for i, msg in enumerate(msgs):
+                    pending = feed(callback, msg)
+                    # callbacks return an awaitable when a subscriber asks for backpressure
+                    if pending is not None:
+                        self._pause(s, pending, callback, msgs[i + 1:])
+                        break
+
+    def _pause(self, s, pending, callback, msgs):
+        """Stop polling s until pending is done and the rest of its messages are fed"""
+        self._poller.unregister(s)
+        self._paused[s] = asyncio.ensure_future(self._resume(s, pending, callback, msgs))
+
+    async def _resume(self, s, pending, callback, msgs):
+        try:
+            await pending
+            for msg in msgs:
+                pending = feed(callback, msg)
+                if pending is not None:
+                    await pending
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            _LOGGER.exception("Waiting for a subscriber failed")
+        finally:
+            # meanwhile unsubscribed sockets stay out of the poller
+            if self._paused.pop(s, None) is not None and s in self._subscriptions:
+                self._poller.register(s, zmq.POLLIN)
+                self._restart_poll()
+
+    def _restart_poll(self):
+        if self._poll_future is not None and not self._poll_future.done():
+            self._poll_future.cancel()
+
+def feed(callback, msg):
+    """callback(msg), logging instead of raising when it fails.
+
+    A failing message must not take the rest of its wakeup or the
+    receiving task with it.
+    """
+    try:
+        return callback(msg)
+    except Exception:
+        _LOGGER.exception("Receive callback failed")
+        return None
+
+def drain(s, limit, copy = True, msgs = None):
+    """Receive up to limit already queued messages from a blocking socket without waiting.
+
+    With copy=False zmq.Frame objects are returned instead of bytes.
+    """
+    if msgs is None:
+        msgs = []
+    limit += len(msgs)
+    try:
+        while len(msgs) < limit:
+            msgs.append(s.recv(zmq.NOBLOCK, copy = copy))
+    except zmq.Again:
+        pass
+    return msgs
@@ -0,0 +1,263 @@
+"""Capture raw MALOS traffic to an append-only log and replay it later.
+
+A log starts with MAGIC and is followed by records of a fixed header
+(timestamp, port, direction, payload length; see RECORD) and the raw
+payload. Records are appended through a large write buffer and read back
+through mmap, so captures of any size are replayed without loading them.
+
+    recorder = Recorder('capture.mxlog', record_pushes = True)
+    matrix = await Matrix.create(config, recorder = recorder)
+    ...
+    replay = Replay.for_components(LogReader('capture.mxlog'), components, speed = 10)
+    stats = await replay.run()
+
+    python -m matrix.recorder capture.mxlog
+"""
+import argparse
+import asyncio
+import functools
+import mmap
+import os
+import struct
+import time
+
+from collections import Counter
+
+MAGIC = b'MXLOG\x00\x01\n'
+# timestamp (seconds since the epoch), port, direction, payload length
+RECORD = struct.Struct('<dHBI')
+RECEIVED = 0
+PUSHED = 1
+DEFAULT_BUFFER_SIZE = 1 << 20
+# records replayed at max speed before the event loop gets a turn
+YIELD_EVERY = 1024
+
+class Recorder():
+    """Appends records to a log file through a write buffer of buffer_size bytes"""
+    def __init__(self, path, buffer_size = DEFAULT_BUFFER_SIZE, record_pushes = False):
+        self.path = path
+        self.record_pushes = record_pushes
+        self.records = 0
+        self.bytes = 0
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'ab', buffering = buffer_size)
+        if new:
+            self._file.write(MAGIC)
+
+    def record(self, port, payload, direction = RECEIVED, timestamp = None):
+        payload = payload if isinstance(payload, (bytes, bytearray, memoryview)) else bytes(payload)
+        self._file.write(RECORD.pack(time.time() if timestamp is None else timestamp, port, direction, len(payload)))
+        self._file.write(payload)
+        self.records += 1
+        self.bytes += RECORD.size + len(payload)
+
+    def wrap_callback(self, port, callback, batch = False):
+        """A callback recording every message it gets before passing it on"""
+        record = self.record
+        if batch:
+            def recording(buffers):
+                now = time.time()
+                for buf in buffers:
+                    record(port, buf, RECEIVED, now)
+                return callback(buffers)
+        else:
+            def recording(msg):
+                record(port, msg)
+                return callback(msg)
+        return recording
+
+    def wrap_push_fn(self, port, push_fn):
+        """A push function recording every config the way it goes out.
+
+        Queued push functions are returned as they are, their Sender
+        records a config once it was actually sent, so configs replaced in
+        the queue are never recorded.
+        """
+        sender = getattr(push_fn, 'sender', None)
+        if sender is not None:
+            sender.record = functools.partial(self.record, port, direction = PUSHED)
+            return push_fn
+        record = self.record
+
+        def sendConfig(proto, key = None):
+            # serialized once, for the log and the socket
+            data = proto if isinstance(proto, bytes) else proto.SerializeToString()
+            record(port, data, PUSHED)
+            return push_fn(data, key)
+        if hasattr(push_fn, 'socket'):
+            sendConfig.socket = push_fn.socket
+        return sendConfig
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class LogReader():
+    """Memory-mapped, sequential reader of a log written by Recorder.
+
+    Payloads are memoryviews into the mapping, copy them to keep them
+    around; a payload still referenced on close keeps the mapping open
+    until it is garbage collected. A record cut short at the end of the
+    file (e.g. by a crash while writing) ends the log.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        if size < len(MAGIC):
+            self._file.close()
+            raise ValueError("{} is not a recorder log".format(path))
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError("{} is not a recorder log".format(path))
+        self._view = memoryview(self._mmap)
+        self.size = size
+
+    def __iter__(self):
+        """(timestamp, port, direction, payload) of every record"""
+        view = self._view
+        unpack_from = RECORD.unpack_from
+        header_size = RECORD.size
+        size = self.size
+        offset = len(MAGIC)
+        while offset + header_size <= size:
+            timestamp, port, direction, length = unpack_from(view, offset)
+            start = offset + header_size
+            offset = start + length
+            if offset > size:
+                break
+            yield timestamp, port, direction, view[start:offset]
+
+    def summary(self):
+        """Record count per (port, direction), first and last timestamp"""
+        counts = Counter()
+        first = last = None
+        for timestamp, port, direction, _ in self:
+            counts[(port, direction)] += 1
+            if first is None:
+                first = timestamp
+            last = timestamp
+        return {'records': counts, 'first': first, 'last': last}
+
+    def close(self):
+        view = getattr(self, '_view', None)
+        if view is not None:
+            view.release()
+            self._view = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class Replay():
+    """Feeds received records of a log to the callbacks registered for their ports.
+
+    speed 1.0 keeps the recorded timing, larger values replay faster and
+    None replays as fast as the callbacks allow. Awaitables returned by
+    callbacks are awaited, as register_callback does.
+    """
+    def __init__(self, reader, callbacks, speed = 1.0):
+        self.reader = reader
+        # port -> callback(bytes)
+        self.callbacks = callbacks
+        self.speed = speed
+        self.records = 0
+        self.bytes = 0
+        self.skipped = 0
+        self.max_lag = 0.0
+        self.elapsed = 0.0
+
+    @classmethod
+    def for_components(cls, reader, components, speed = 1.0):
+        """Replay into the error and data callbacks of components, e.g. Matrix.components"""
+        callbacks = {}
+        for c in components:
+            callbacks[c.port + 2] = c.error_callback
+            if c.data_callback is not None:
+                callbacks[c.port + 3] = c.data_callback
+        return cls(reader, callbacks, speed)
+
+    def get_stats(self):
+        return {
+            'records': self.records,
+            'bytes': self.bytes,
+            'skipped': self.skipped,
+            'seconds': self.elapsed,
+            'records_per_second': self.records / self.elapsed if self.elapsed else 0.0,
+            'mb_per_second': self.bytes / self.elapsed / 1e6 if self.elapsed else 0.0,
+            'max_lag': self.max_lag
+        }
+
+    stats = property(get_stats)
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        callbacks = self.callbacks
+        speed = self.speed
+        started = loop.time()
+        first = None
+        try:
+            for timestamp, port, direction, payload in self.reader:
+                callback = callbacks.get(port) if direction == RECEIVED else None
+                if callback is None:
+                    self.skipped += 1
+                    continue
+
+                if speed:
+                    if first is None:
+                        first = timestamp
+                    due = started + (timestamp - first) / speed
+                    delay = due - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    else:
+                        self.max_lag = max(self.max_lag, -delay)
+                elif self.records % YIELD_EVERY == 0:
+                    await asyncio.sleep(0)
+
+                pending = callback(bytes(payload))
+                if pending is not None:
+                    await pending
+                self.records += 1
+                self.bytes += len(payload)
+        finally:
+            self.elapsed = loop.time() - started
+        return self.stats
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Summarize a recorder log and measure its raw replay rate.')
+    parser.add_argument('path')
+    args = parser.parse_args()
+
+    with LogReader(args.path) as reader:
+        summary = reader.summary()
+        for (port, direction), count in sorted(summary['records'].items()):
+            print('port {:>5} {:>8}: {:>10,} records'.format(port, 'pushed' if direction == PUSHED else 'received', count))
+        if summary['first'] is not None:
+            print('duration: {:.1f}s'.format(summary['last'] - summary['first']))
+
+        # every received record into a no-op callback, as fast as possible
+        ports = {port for port, direction in summary['records'] if direction == RECEIVED}
+        replay = Replay(reader, {port: lambda data: None for port in ports}, speed = None)
+        stats = asyncio.get_event_loop().run_until_complete(replay.run())
+        print('replay: {records_per_second:,.0f} records/s, {mb_per_second:,.1f} MB/s'.format(**stats))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import time
+import zmq
+from collections import OrderedDict
+
+from matrix.metrics import NULL_METRIC
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 256
+# marks the made up keys of unkeyed configs
+_UNKEYED = object()
+
+class Sender():
+    """Asynchronous, coalescing outbound queue of one component's config socket.
+
+    push() only queues the proto; serialization and the actual send
+    happen in the sender's own task. Protos pushed with a key replace a
+    still queued proto with the same key (in its place in the queue), so
+    only the newest frame, level, ... goes out. When the queue is full
+    the oldest keyed entry is dropped, a newer one of its kind is bound to
+    follow. Unkeyed configs (network commands, initial configs) are never
+    dropped: with a queue full of them the push is refused, logged and
+    push() returns False.
+    """
+    def __init__(self, socket, maxsize = DEFAULT_QUEUE_SIZE):
+        self.socket = socket
+        self.maxsize = maxsize
+        self.queued = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.refused = 0
+        self.failed = 0
+        self.blocked = 0
+        self.max_depth = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+        self.failed_metric = NULL_METRIC
+        # called with the bytes of every config sent, e.g. by a Recorder
+        self.record = None
+        self._queue = OrderedDict()
+        self._counter = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def push(self, proto, key = None):
+        """Queue proto, False if the queue is full of configs that must not be dropped"""
+        keyed = key is not None
+        if not keyed:
+            self._counter += 1
+            key = (_UNKEYED, self._counter)
+        if key in self._queue:
+            self.coalesced += 1
+            # keep the queue position and enqueue time of the replaced entry
+            self._queue[key] = (proto, self._queue[key][1], keyed)
+        else:
+            if len(self._queue) >= self.maxsize and not self._drop_keyed():
+                self.refused += 1
+                self.failed_metric.inc()
+                _LOGGER.warning("Send queue to %s is full, refusing a config", self.socket.getsockopt_string(zmq.LAST_ENDPOINT))
+                return False
+            self._queue[key] = (proto, time.perf_counter(), keyed)
+            self.max_depth = max(self.max_depth, len(self._queue))
+        self.queued += 1
+        self._wakeup.set()
+        return True
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self.run())
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def get_depth(self):
+        return len(self._queue)
+
+    def get_stats(self):
+        return {
+            'depth': len(self._queue),
+            'max_depth': self.max_depth,
+            'queued': self.queued,
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'dropped': self.dropped,
+            'refused': self.refused,
+            'failed': self.failed,
+            'blocked': self.blocked,
+            'latency': self.latency,
+            'max_latency': self.max_latency
+        }
+
+    depth = property(get_depth)
+    stats = property(get_stats)
+
+    async def run(self):
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            _, (proto, enqueued, _) = self._queue.popitem(last = False)
+            try:
+                data = proto if isinstance(proto, bytes) else proto.SerializeToString()
+                sending = self.socket.send(data)
+                if not sending.done():
+                    # the socket is at its high-water mark, MALOS is not keeping up
+                    self.blocked += 1
+                await sending
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failed += 1
+                self.failed_metric.inc()
+                _LOGGER.exception("Sending to %s failed", self.socket.getsockopt_string(zmq.LAST_ENDPOINT))
+                continue
+
+            self.sent += 1
+            if self.record is not None:
+                self.record(data)
+            latency = time.perf_counter() - enqueued
+            # smoothed send latency
+            self.latency += (latency - self.latency) / 16
+            self.max_latency = max(self.max_latency, latency)
+
+    def _drop_keyed(self):
+        for key, (_, _, keyed) in self._queue.items():
+            if keyed:
+                del self._queue[key]
+                self.dropped += 1
+                return True
+        return False
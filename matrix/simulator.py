@@ -0,0 +1,361 @@
+"""A local stand-in for MALOS, for load and latency tests without a board.
+
+Every simulated component binds the port layout Matrix.create expects:
+config on port, keep-alive on port + 1, errors on port + 2 and data on
+port + 3. Sensors publish synthetic sense_pb2 readings while they are
+kept alive, the Zigbee gateway answers network management requests for
+a number of fake bulbs.
+
+    python -m matrix.simulator --rate 50 --bulbs 8 --drop 0.01
+"""
+import argparse
+import asyncio
+import logging
+import math
+import random
+import time
+import zmq
+import zmq.asyncio
+from matrix_io.proto.malos.v1 import comm_pb2
+from matrix_io.proto.malos.v1 import driver_pb2
+from matrix_io.proto.malos.v1 import sense_pb2
+
+from matrix.components.zigbee import (
+    NETWORK_MGMT, ZCL, ZCL_ON_OFF, ZCL_LEVEL, ON, OFF, TOGGLE,
+    IS_PROXY_ACTIVE, NETWORK_STATUS, DISCOVERY_INFO, CREATE_NWK, RESET_PROXY,
+    JOINED_NETWORK, ON_OFF_CLUSTER, LEVEL_CLUSTER, COLOR_CONTROL_CLUSTER
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+# Same layout as test.py
+DEFAULT_PORTS = {
+    'imu': 20013,
+    'humidity': 20013 + 4,
+    'everloop': 20013 + (4 * 2),
+    'pressure': 20013 + (4 * 3),
+    'uv': 20013 + (4 * 4),
+    'zigbee': 40000 + 1,
+}
+
+class Faults():
+    """Faults applied to every published message.
+
+    drop: probability a message is lost.
+    delay: seconds every message is held back, plus up to delay_jitter.
+    burst: probability a message is published burst_size times at once.
+    """
+    def __init__(self, drop = 0.0, delay = 0.0, delay_jitter = 0.0, burst = 0.0, burst_size = 10, seed = None):
+        self.drop = drop
+        self.delay = delay
+        self.delay_jitter = delay_jitter
+        self.burst = burst
+        self.burst_size = burst_size
+        self.random = random.Random(seed)
+
+class SimulatedComponent():
+    def __init__(self, name, port, host = '127.0.0.1', context = None, faults = None, rate = None):
+        self.name = name
+        self.port = port
+        self.host = host
+        self.context = context if context is not None else zmq.asyncio.Context.instance()
+        self.faults = faults if faults is not None else Faults()
+        # messages per second, None follows the pushed delay_between_updates
+        self.rate = rate
+        self.delay_between_updates = 1.0
+        self.timeout_after_last_ping = 0.0
+        self.last_ping = None
+        self.configs = 0
+        self.pings = 0
+        self.published = 0
+        self.dropped = 0
+        self._sockets = []
+        self._tasks = []
+
+    def start(self):
+        loop = asyncio.get_event_loop()
+        self._config_socket = self._bind(zmq.PULL, self.port)
+        self._keep_alive_socket = self._bind(zmq.PULL, self.port + 1)
+        self._error_socket = self._bind(zmq.PUB, self.port + 2)
+        self._data_socket = self._bind(zmq.PUB, self.port + 3)
+        self._tasks = [
+            loop.create_task(self._receive_configs()),
+            loop.create_task(self._receive_pings()),
+            loop.create_task(self._publish_loop())
+        ]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for s in self._sockets:
+            s.close(linger = 0)
+        self._tasks = []
+        self._sockets = []
+
+    def get_stats(self):
+        return {
+            'configs': self.configs,
+            'pings': self.pings,
+            'published': self.published,
+            'dropped': self.dropped
+        }
+
+    stats = property(get_stats)
+
+    def handle_config(self, config):
+        """Called for every received DriverConfig"""
+        if config.delay_between_updates:
+            self.delay_between_updates = config.delay_between_updates
+        if config.timeout_after_last_ping:
+            self.timeout_after_last_ping = config.timeout_after_last_ping
+
+    def create_message(self, now):
+        """The next data message, None for components without a data stream"""
+        return None
+
+    def is_alive(self, now):
+        if not self.timeout_after_last_ping:
+            return True
+        return self.last_ping is not None and now - self.last_ping <= self.timeout_after_last_ping
+
+    def publish(self, data):
+        """Publish one data message, with the configured faults applied"""
+        faults = self.faults
+        if faults.drop and faults.random.random() < faults.drop:
+            self.dropped += 1
+            return
+        count = faults.burst_size if faults.burst and faults.random.random() < faults.burst else 1
+        delay = faults.delay + (faults.random.random() * faults.delay_jitter if faults.delay_jitter else 0.0)
+        if delay > 0:
+            asyncio.get_event_loop().call_later(delay, self._send, data, count)
+        else:
+            self._send(data, count)
+
+    def publish_error(self, message):
+        self._error_socket.send_string(message)
+
+    def _send(self, data, count):
+        for _ in range(count):
+            self._data_socket.send(data)
+        self.published += count
+
+    def _bind(self, socket_type, port):
+        s = self.context.socket(socket_type)
+        if socket_type == zmq.PUB:
+            s.setsockopt(zmq.SNDHWM, 0)
+        s.bind('tcp://{0}:{1}'.format(self.host, port))
+        self._sockets.append(s)
+        return s
+
+    async def _receive_configs(self):
+        while True:
+            data = await self._config_socket.recv()
+            self.configs += 1
+            try:
+                config = driver_pb2.DriverConfig.FromString(data)
+            except Exception:
+                self.publish_error('invalid config')
+                continue
+            self.handle_config(config)
+
+    async def _receive_pings(self):
+        while True:
+            await self._keep_alive_socket.recv()
+            self.pings += 1
+            self.last_ping = time.monotonic()
+
+    async def _publish_loop(self):
+        loop = asyncio.get_event_loop()
+        next_tick = loop.time()
+        while True:
+            rate = self.rate
+            interval = 1.0 / rate if rate else self.delay_between_updates
+            next_tick = max(next_tick + interval, loop.time())
+            await asyncio.sleep(next_tick - loop.time())
+            now = time.monotonic()
+            if not self.is_alive(now):
+                continue
+            data = self.create_message(now)
+            if data is not None:
+                self.publish(data)
+
+class SimulatedSensor(SimulatedComponent):
+    """Publishes slowly varying synthetic readings"""
+    def __init__(self, name, port, **kwargs):
+        SimulatedComponent.__init__(self, name, port, **kwargs)
+        self._started = time.monotonic()
+
+    def create_message(self, now):
+        t = now - self._started
+        wave = math.sin(t / 10.0)
+        if self.name == 'imu':
+            return sense_pb2.Imu(
+                yaw = 180.0 * wave, pitch = 10.0 * math.sin(t), roll = 5.0 * math.cos(t),
+                accel_x = 0.01 * wave, accel_y = 0.01 * math.cos(t), accel_z = 1.0 + 0.02 * math.sin(7 * t),
+                gyro_x = wave, gyro_y = 0.5 * wave, gyro_z = 0.1,
+                mag_x = 0.3, mag_y = 0.1 * wave, mag_z = -0.4
+            ).SerializeToString()
+        if self.name == 'humidity':
+            temperature = 22.0 + 2.0 * wave
+            return sense_pb2.Humidity(
+                humidity = 45.0 + 5.0 * wave, temperature = temperature,
+                temperature_raw = temperature + 3.0, temperature_is_calibrated = True
+            ).SerializeToString()
+        if self.name == 'pressure':
+            return sense_pb2.Pressure(
+                pressure = 101325.0 + 50.0 * wave, altitude = 120.0 + wave, temperature = 23.0 + wave
+            ).SerializeToString()
+        if self.name == 'uv':
+            uv_index = max(0.0, 3.0 + 3.0 * wave)
+            return sense_pb2.UV(uv_index = uv_index, oms_risk = 'Low' if uv_index < 3 else 'Moderate').SerializeToString()
+        return None
+
+class SimulatedEverloop(SimulatedComponent):
+    """Accepts frames and keeps the last image"""
+    def __init__(self, name, port, **kwargs):
+        SimulatedComponent.__init__(self, name, port, **kwargs)
+        self.frames = 0
+        self.image = None
+
+    def handle_config(self, config):
+        SimulatedComponent.handle_config(self, config)
+        if len(config.image.led):
+            self.frames += 1
+            self.image = [(led.red, led.green, led.blue, led.white) for led in config.image.led]
+
+class SimulatedZigbee(SimulatedComponent):
+    """A gateway with a joined network of `bulbs` dimmable color bulbs"""
+    def __init__(self, name, port, bulbs = 4, **kwargs):
+        SimulatedComponent.__init__(self, name, port, **kwargs)
+        self.proxy_active = True
+        self.network = JOINED_NETWORK
+        self.commands = 0
+        # (node_id, endpoint_index) -> {'on': bool, 'level': int}
+        self.bulbs = {(0x1000 + i, 1): {'on': False, 'level': 0} for i in range(bulbs)}
+
+    def handle_config(self, config):
+        SimulatedComponent.handle_config(self, config)
+        if not config.HasField('zigbee_message'):
+            return
+        msg = config.zigbee_message
+        if msg.type == ZCL:
+            self._handle_zcl(msg.zcl_cmd)
+        elif msg.type == NETWORK_MGMT:
+            self._handle_network_mgmt(msg.network_mgmt_cmd)
+
+    def _handle_zcl(self, cmd):
+        self.commands += 1
+        bulb = self.bulbs.get((cmd.node_id, cmd.endpoint_index))
+        if bulb is None:
+            return
+        if cmd.type == ZCL_ON_OFF:
+            if cmd.onoff_cmd.type == ON:
+                bulb['on'] = True
+            elif cmd.onoff_cmd.type == OFF:
+                bulb['on'] = False
+            elif cmd.onoff_cmd.type == TOGGLE:
+                bulb['on'] = not bulb['on']
+        elif cmd.type == ZCL_LEVEL:
+            bulb['level'] = cmd.level_cmd.move_to_level_params.level
+
+    def _handle_network_mgmt(self, cmd):
+        answer = comm_pb2.ZigBeeMsg()
+        answer.type = NETWORK_MGMT
+        if cmd.type == RESET_PROXY:
+            self.proxy_active = True
+            return
+        if cmd.type == IS_PROXY_ACTIVE:
+            answer.network_mgmt_cmd.type = IS_PROXY_ACTIVE
+            answer.network_mgmt_cmd.is_proxy_active = self.proxy_active
+        elif cmd.type in (NETWORK_STATUS, CREATE_NWK):
+            self.network = JOINED_NETWORK
+            answer.network_mgmt_cmd.type = NETWORK_STATUS
+            answer.network_mgmt_cmd.network_status.type = self.network
+        elif cmd.type == DISCOVERY_INFO:
+            answer.network_mgmt_cmd.type = DISCOVERY_INFO
+            for node_id, endpoint_index in self.bulbs:
+                node = answer.network_mgmt_cmd.connected_nodes.add()
+                node.node_id = node_id
+                endpoint = node.endpoints.add()
+                endpoint.endpoint_index = endpoint_index
+                for cluster_id in (ON_OFF_CLUSTER, LEVEL_CLUSTER, COLOR_CONTROL_CLUSTER):
+                    endpoint.clusters.add().cluster_id = cluster_id
+        else:
+            return
+        self.publish(answer.SerializeToString())
+
+SIMULATORS = {
+    'imu': SimulatedSensor,
+    'humidity': SimulatedSensor,
+    'pressure': SimulatedSensor,
+    'uv': SimulatedSensor,
+    'everloop': SimulatedEverloop,
+    'zigbee': SimulatedZigbee,
+}
+
+class MalosSimulator():
+    """A set of simulated components on one host"""
+    def __init__(self, host = '127.0.0.1', context = None, faults = None):
+        self.host = host
+        self.context = context if context is not None else zmq.asyncio.Context.instance()
+        self.faults = faults if faults is not None else Faults()
+        self.components = {}
+
+    def add(self, name, port = None, **kwargs):
+        port = port if port is not None else DEFAULT_PORTS[name]
+        kwargs.setdefault('faults', self.faults)
+        component = SIMULATORS[name](name, port, host = self.host, context = self.context, **kwargs)
+        self.components[name] = component
+        return component
+
+    def start(self):
+        for component in self.components.values():
+            component.start()
+        return self
+
+    def stop(self):
+        for component in self.components.values():
+            component.stop()
+
+    def get_stats(self):
+        return {name: c.stats for name, c in self.components.items()}
+
+    stats = property(get_stats)
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Simulate a Matrix Creator running MALOS.')
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--components', default = ','.join(DEFAULT_PORTS), help = 'comma separated component names')
+    parser.add_argument('--rate', type = float, default = None, help = 'sensor messages per second (default: as configured by the client)')
+    parser.add_argument('--bulbs', type = int, default = 4)
+    parser.add_argument('--drop', type = float, default = 0.0, help = 'probability of dropping a message')
+    parser.add_argument('--delay', type = float, default = 0.0, help = 'seconds every message is delayed')
+    parser.add_argument('--delay-jitter', type = float, default = 0.0)
+    parser.add_argument('--burst', type = float, default = 0.0, help = 'probability of publishing a burst')
+    parser.add_argument('--burst-size', type = int, default = 10)
+    parser.add_argument('--seed', type = int, default = None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level = logging.INFO)
+    simulator = MalosSimulator(args.host, faults = Faults(
+        args.drop, args.delay, args.delay_jitter, args.burst, args.burst_size, args.seed
+    ))
+    for name in args.components.split(','):
+        if name == 'zigbee':
+            simulator.add(name, bulbs = args.bulbs)
+        else:
+            simulator.add(name, rate = args.rate)
+
+    async def run():
+        simulator.start()
+        while True:
+            await asyncio.sleep(5)
+            _LOGGER.info('%s', simulator.stats)
+
+    try:
+        asyncio.get_event_loop().run_until_complete(run())
+    except KeyboardInterrupt:
+        simulator.stop()
+
+if __name__ == '__main__':
+    main()
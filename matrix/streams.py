@@ -0,0 +1,108 @@
+import asyncio
+
+# What to do when a subscriber's queue is full
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+BLOCK = 'block'
+
+DEFAULT_QUEUE_SIZE = 64
+
+_CLOSED = object()
+
+class Broadcast():
+    """Fans published items out to any number of bounded subscriptions"""
+    def __init__(self):
+        self._subscriptions = []
+
+    def subscribe(self, maxsize = DEFAULT_QUEUE_SIZE, overflow = DROP_OLDEST):
+        subscription = Subscription(self, maxsize, overflow)
+        self._subscriptions.append(subscription)
+        return subscription
+
+    def attach(self, subscriber):
+        """Add any other subscriber with put(item) and close() methods"""
+        self._subscriptions.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscription):
+        if subscription in self._subscriptions:
+            self._subscriptions.remove(subscription)
+
+    def publish(self, item):
+        """Queue item for every subscriber.
+
+        Returns None, or an awaitable that completes once subscribers with
+        the BLOCK policy had room for the item.
+        """
+        blocked = None
+        for subscription in self._subscriptions:
+            waiter = subscription.put(item)
+            if waiter is not None:
+                blocked = [waiter] if blocked is None else blocked + [waiter]
+        if blocked is None:
+            return None
+        return asyncio.gather(*blocked)
+
+    def close(self):
+        for subscription in list(self._subscriptions):
+            subscription.close()
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+class Subscription():
+    """A bounded queue of published items, consumed with `async for`"""
+    def __init__(self, broadcast, maxsize = DEFAULT_QUEUE_SIZE, overflow = DROP_OLDEST):
+        if overflow not in (DROP_OLDEST, DROP_NEWEST, BLOCK):
+            raise ValueError("Unknown overflow policy: {}".format(overflow))
+        self.overflow = overflow
+        self.dropped = 0
+        self.closed = False
+        self._broadcast = broadcast
+        self._queue = asyncio.Queue(maxsize)
+
+    def put(self, item):
+        if self.closed:
+            return None
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            if self.overflow == BLOCK:
+                return self._queue.put(item)
+            self.dropped += 1
+            if self.overflow == DROP_OLDEST:
+                self._queue.get_nowait()
+                self._queue.put_nowait(item)
+        return None
+
+    async def get(self):
+        item = await self._queue.get()
+        if item is _CLOSED:
+            # keep the marker for other waiters of this subscription
+            self._queue.put_nowait(_CLOSED)
+            raise StopAsyncIteration
+        return item
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._broadcast.unsubscribe(self)
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(_CLOSED)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.get()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
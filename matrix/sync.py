@@ -0,0 +1,277 @@
+"""A blocking client for code that does not run an event loop.
+
+SyncMatrix owns one background thread running the event loop of the
+board; all sockets live on that thread. Other threads hand it commands
+through a deque, and the loop is only woken up when the deque was empty.
+Snapshots are read straight from the caller's thread, streams are
+bridged into thread-safe queues.
+
+    with SyncMatrix(config) as matrix:
+        matrix.component('everloop').set_uniform_color(0, 0, 20, 0)
+        print(matrix.read('humidity'))
+        for reading in matrix.stream('imu'):
+            ...
+"""
+import asyncio
+import concurrent.futures
+import functools
+import inspect
+import logging
+import queue
+import threading
+from collections import deque
+from enum import Enum
+
+from google.protobuf.message import Message
+
+from matrix.components.component import Reading, Snapshot
+from matrix.matrix import Matrix
+from matrix.streams import DEFAULT_QUEUE_SIZE
+
+_LOGGER = logging.getLogger(__name__)
+
+# Seconds a blocking call waits for the I/O thread
+DEFAULT_TIMEOUT = 10.0
+
+class SyncMatrix():
+    def __init__(self, config, timeout = DEFAULT_TIMEOUT, **create_kwargs):
+        """Start the I/O thread and connect the board; extra arguments go to Matrix.create"""
+        self.timeout = timeout
+        self.matrix = None
+        self._commands = deque()
+        self._wakeup_pending = False
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target = self._run, name = 'matrix-io-{}'.format(config.host), daemon = True)
+        self._thread.start()
+        try:
+            self.matrix = self.call(Matrix.create, config, **create_kwargs)
+        except BaseException:
+            self._stop_loop()
+            raise
+
+    def call(self, fn, *args, **kwargs):
+        """Run fn on the I/O thread and wait up to self.timeout for its result.
+
+        Awaitable results are awaited there. All arguments go to fn, use
+        post(...).result(seconds) to wait for a different time.
+        """
+        return self.post(fn, *args, **kwargs).result(self.timeout)
+
+    def post(self, fn, *args, **kwargs):
+        """Run fn on the I/O thread without waiting, returns a concurrent.futures.Future"""
+        future = concurrent.futures.Future()
+        self._commands.append((fn, args, kwargs, future))
+        # a wakeup already on its way drains this command as well
+        if not self._wakeup_pending:
+            self._wakeup_pending = True
+            self._loop.call_soon_threadsafe(self._drain)
+        return future
+
+    def component(self, name):
+        """A thread-safe proxy of the component called name"""
+        component = self.matrix.get_component(name)
+        if component is None:
+            raise KeyError(name)
+        return SyncProxy(self, component)
+
+    def read(self, name):
+        """Snapshot of the latest reading of a sensor, straight from the caller's thread"""
+        return self.matrix.read(name)
+
+    def read_all(self):
+        return self.matrix.read_all()
+
+    def stream(self, name, maxsize = DEFAULT_QUEUE_SIZE):
+        """Readings of a sensor as a SyncStream, iterable from any thread"""
+        component = self.matrix.get_component(name)
+        if component is None or not hasattr(component, 'readings'):
+            raise KeyError(name)
+        stream = SyncStream(self, maxsize)
+        self.call(stream._attach, component.readings)
+        return stream
+
+    def close(self):
+        if not self._thread.is_alive():
+            return
+        if self.matrix is not None:
+            try:
+                self.call(self.matrix.close)
+            except Exception:
+                _LOGGER.exception("Closing the board failed")
+        self._stop_loop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.close()
+
+    def _stop_loop(self):
+        try:
+            self.call(self._shutdown)
+        except Exception:
+            _LOGGER.exception("Shutting down the I/O thread failed")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(self.timeout)
+
+    async def _shutdown(self):
+        # let cancelled tasks finish before the loop goes away
+        current = asyncio.current_task()
+        tasks = [t for t in asyncio.all_tasks() if t is not current]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions = True)
+        await self._loop.shutdown_asyncgens()
+
+    def _drain(self):
+        self._wakeup_pending = False
+        commands = self._commands
+        while commands:
+            fn, args, kwargs, future = commands.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+                continue
+            if inspect.isawaitable(result):
+                self._loop.create_task(_complete(result, future))
+            else:
+                future.set_result(result)
+
+async def _complete(awaitable, future):
+    try:
+        future.set_result(await awaitable)
+    except BaseException as e:
+        future.set_exception(e)
+
+class SyncProxy():
+    """Forwards attribute access and method calls to an object owned by the I/O thread.
+
+    `proxy.set_uniform_color(...)` blocks until the call (and anything it
+    returned to await) finished; post() does not wait. Attributes are read
+    on the I/O thread as well. Whatever comes back is made safe for the
+    caller's thread: plain values and readings as they are, containers and
+    protos copied, any other object (e.g. a Zigbee bulb) wrapped in another
+    SyncProxy.
+    """
+    def __init__(self, sync_matrix, target):
+        self._sync = sync_matrix
+        self._target = target
+
+    def call(self, method, *args, **kwargs):
+        return self._sync.call(_exporting, self._sync, getattr(self._target, method), args, kwargs)
+
+    def post(self, method, *args, **kwargs):
+        return self._sync.post(_exporting, self._sync, getattr(self._target, method), args, kwargs)
+
+    def __getattr__(self, name):
+        # methods are looked up on the class, reading that is safe from any thread
+        if inspect.isfunction(getattr(type(self._target), name, None)):
+            return _remote(self._sync, getattr(self._target, name))
+        return self._sync.call(_exporting, self._sync, getattr, (self._target, name), {})
+
+    def __repr__(self):
+        return 'SyncProxy({})'.format(type(self._target).__name__)
+
+def _remote(sync_matrix, fn):
+    """fn called on the I/O thread"""
+    def call(*args, **kwargs):
+        return sync_matrix.call(_exporting, sync_matrix, fn, args, kwargs)
+    call.__name__ = getattr(fn, '__name__', 'call')
+    return call
+
+def _exporting(sync_matrix, fn, args, kwargs):
+    """Run fn on the I/O thread, its result exported for another thread"""
+    result = fn(*args, **kwargs)
+    if inspect.isawaitable(result):
+        return _export_later(sync_matrix, result)
+    return _export(sync_matrix, result)
+
+async def _export_later(sync_matrix, awaitable):
+    return _export(sync_matrix, await awaitable)
+
+def _export(sync_matrix, value):
+    """A copy or proxy of value that can be used from another thread; runs on the I/O thread"""
+    if value is None or isinstance(value, _SHAREABLE):
+        return value
+    if type(value) in (list, tuple, set, frozenset):
+        return type(value)(_export(sync_matrix, v) for v in value)
+    if type(value) is dict:
+        return {k: _export(sync_matrix, v) for k, v in value.items()}
+    if isinstance(value, Message):
+        copy = type(value)()
+        copy.CopyFrom(value)
+        return copy
+    if hasattr(value, '__array_interface__'):
+        return value.copy()
+    if inspect.isroutine(value) or isinstance(value, functools.partial):
+        return _remote(sync_matrix, value)
+    return SyncProxy(sync_matrix, value)
+
+# never changed once created, handed over as they are
+_SHAREABLE = (bool, int, float, complex, str, bytes, Enum, Reading, Snapshot, SyncProxy)
+
+class SyncStream():
+    """A thread-safe queue of a broadcast's items; the oldest are dropped when it is full"""
+    def __init__(self, sync_matrix, maxsize = DEFAULT_QUEUE_SIZE):
+        self._sync = sync_matrix
+        self._queue = queue.Queue(maxsize)
+        self._broadcast = None
+        self.dropped = 0
+        self.closed = False
+
+    def get(self, timeout = None):
+        """The next item, raises queue.Empty after timeout seconds"""
+        return self._queue.get(timeout = timeout)
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._sync.post(self._detach)
+
+    def __iter__(self):
+        while not self.closed:
+            try:
+                yield self._queue.get(timeout = 0.5)
+            except queue.Empty:
+                continue
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def put(self, item):
+        # called by the broadcast on the I/O thread
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return None
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _attach(self, broadcast):
+        self._broadcast = broadcast
+        broadcast.attach(self)
+
+    def _detach(self):
+        if self._broadcast is not None:
+            self._broadcast.unsubscribe(self)
+            self._broadcast = None
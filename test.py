@@ -23,12 +23,12 @@ async def setup_matrix():
     for c in matrix.components:
         print(c.name)
 
-    # everloop = next(c for c in matrix.components if c.name == "everloop")
+    # everloop = matrix.get_component("everloop")
     # everloop.set_uniform_color(0,150,150,0)
 
-    zigbee = next(c for c in matrix.components if c.name == "zigbee")
+    zigbee = matrix.get_component("zigbee")
     loop = asyncio.get_event_loop()
-    loop.create_task(zigbee.services.checkGatewayActive())
+    loop.create_task(zigbee.bring_up())
 
     toggledOnce = False
 
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from matrix.components.everloop import EverloopAnimator, EverloopFrame, interpolate_keyframes
+
+def check_counters(animator):
+    stats = animator.stats
+    assert stats['produced'] == stats['sent'] + stats['dropped'] + stats['queued']
+
+async def wait_for(condition, timeout = 2.0):
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, 'timed out'
+        await asyncio.sleep(0.001)
+
+def test_only_newest_frame_is_sent():
+    async def run():
+        sent = []
+        animator = EverloopAnimator(sent.append, fps = 100)
+        for i in range(10):
+            animator.submit(i)
+            check_counters(animator)
+        animator.start()
+        await wait_for(lambda: sent)
+        await asyncio.sleep(0.05)
+        animator.stop()
+        return animator, sent
+
+    animator, sent = asyncio.run(run())
+    assert sent == [9]
+    assert animator.frames_dropped == 9
+    check_counters(animator)
+
+def test_counters_add_up_with_animations():
+    async def run():
+        sent = []
+        animator = EverloopAnimator(sent.append, fps = 200)
+        animator.start()
+
+        animator.play(list(range(100, 110)))
+        check_counters(animator)
+        await wait_for(lambda: len(sent) >= 3)
+        # a frame cuts the animation short, its remaining frames are dropped
+        animator.submit(0)
+        check_counters(animator)
+        await wait_for(lambda: sent[-1] == 0)
+        check_counters(animator)
+
+        animator.play([1, 2, 3], repeat = True)
+        await wait_for(lambda: len(sent) >= 12)
+        check_counters(animator)
+        animator.play([4, 5])
+        await wait_for(lambda: animator.queued == 0)
+        animator.stop()
+        return animator, sent
+
+    animator, sent = asyncio.run(run())
+    check_counters(animator)
+    assert animator.queued == 0
+    assert sent[-2:] == [4, 5]
+    # every sent frame of the first animation was sent in order
+    first = [f for f in sent if f >= 100]
+    assert first == list(range(100, 100 + len(first)))
+
+def test_interpolate_keyframes():
+    start = EverloopFrame.from_colors(2, (0, 0, 0, 0))
+    end = EverloopFrame.from_colors(2, (100, 0, 200, 0))
+    frames = interpolate_keyframes(2, [(1.0, end), (0.0, start)], 2)
+    assert [f[1] for f in frames] == [(0, 0, 0, 0), (50, 0, 100, 0), (100, 0, 200, 0)]
+
+def test_interpolate_no_keyframes():
+    with pytest.raises(ValueError):
+        interpolate_keyframes(2, [], 30)
@@ -0,0 +1,112 @@
+import asyncio
+import threading
+import time
+
+from matrix.executor import THREAD, WorkQueue
+from matrix.streams import BLOCK, DROP_NEWEST, DROP_OLDEST
+
+async def wait_for(condition, timeout = 2.0):
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, 'timed out'
+        await asyncio.sleep(0.002)
+
+class SlowDecoder():
+    """Decodes only while open; with delays, the first messages take longest"""
+    def __init__(self, delays = None):
+        self.open = threading.Event()
+        self.delays = delays or {}
+
+    def __call__(self, data, timestamp):
+        self.open.wait(2.0)
+        time.sleep(self.delays.get(data, 0.0))
+        return data
+
+def run_queue(test, decoder, deliver = None, **kwargs):
+    async def run():
+        delivered = []
+        queue = WorkQueue('test', decoder, deliver or delivered.append, execution = THREAD, **kwargs)
+        try:
+            return await test(queue, delivered)
+        finally:
+            decoder.open.set()
+            queue.close()
+    return asyncio.run(run())
+
+def test_results_come_back_in_arrival_order():
+    decoder = SlowDecoder({b'0': 0.06, b'1': 0.04, b'2': 0.02})
+    decoder.open.set()
+
+    async def test(queue, delivered):
+        for i in range(8):
+            queue.submit(str(i).encode())
+        await wait_for(lambda: len(delivered) == 8)
+        return queue, delivered
+
+    queue, delivered = run_queue(test, decoder, workers = 4)
+    assert delivered == [str(i).encode() for i in range(8)]
+    assert queue.completed == 8
+    assert queue.pending == 0
+
+def fill(overflow):
+    """Six messages into a queue of two behind a single, stuck worker"""
+    decoder = SlowDecoder()
+
+    async def test(queue, delivered):
+        results = [queue.submit(str(i).encode()) for i in range(6)]
+        assert queue.depth == 2
+        decoder.open.set()
+        waiting = [r for r in results if r is not None]
+        if waiting:
+            await asyncio.gather(*waiting)
+        await wait_for(lambda: queue.pending == 0)
+        return queue, delivered, len(waiting)
+
+    return run_queue(test, decoder, workers = 1, maxsize = 2, overflow = overflow)
+
+def test_drop_oldest():
+    queue, delivered, waiting = fill(DROP_OLDEST)
+    # two in a worker, the oldest queued ones made room for the newest
+    assert delivered == [b'0', b'1', b'4', b'5']
+    assert queue.dropped == 2
+
+def test_drop_newest():
+    queue, delivered, waiting = fill(DROP_NEWEST)
+    assert delivered == [b'0', b'1', b'2', b'3']
+    assert queue.dropped == 2
+
+def test_block_waits_for_space():
+    queue, delivered, waiting = fill(BLOCK)
+    assert waiting == 2
+    assert delivered == [str(i).encode() for i in range(6)]
+    assert queue.dropped == 0
+
+def test_subscriber_backpressure_holds_back_results():
+    decoder = SlowDecoder()
+    decoder.open.set()
+
+    async def test(queue, delivered):
+        room = asyncio.get_event_loop().create_future()
+
+        def deliver(item):
+            delivered.append(item)
+            # the first message fills a BLOCK subscriber
+            return room if item == b'0' else None
+        queue.deliver = deliver
+
+        for i in range(6):
+            queue.submit(str(i).encode())
+        await wait_for(lambda: delivered)
+        await asyncio.sleep(0.05)
+        # nothing handed back or dispatched while the subscriber is full
+        assert delivered == [b'0']
+        assert queue.pending == 5
+
+        room.set_result(None)
+        await wait_for(lambda: len(delivered) == 6)
+        return queue, delivered
+
+    queue, delivered = run_queue(test, decoder, workers = 1)
+    assert delivered == [str(i).encode() for i in range(6)]
+    assert queue.failed == 0
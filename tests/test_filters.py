@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+from matrix.filters import ChangeFilter
+
+def reading(timestamp, uv_index):
+    return SimpleNamespace(timestamp = timestamp, uv_index = uv_index)
+
+def test_relative_threshold_ignores_last_zero():
+    change_filter = ChangeFilter(relative_thresholds = {'uv_index': 0.1})
+    assert change_filter.accept(reading(0.0, 0.0))
+    assert not change_filter.accept(reading(1.0, 0.0))
+    assert not change_filter.accept(reading(2.0, 0.0))
+    assert change_filter.suppressed == 2
+
+def test_deadband_still_applies_at_zero():
+    change_filter = ChangeFilter(deadbands = {'uv_index': 0.5}, relative_thresholds = {'uv_index': 0.1})
+    assert change_filter.accept(reading(0.0, 0.0))
+    assert not change_filter.accept(reading(1.0, 0.2))
+    assert change_filter.accept(reading(2.0, 0.6))
+
+def test_relative_threshold():
+    change_filter = ChangeFilter(relative_thresholds = {'uv_index': 0.1})
+    assert change_filter.accept(reading(0.0, 5.0))
+    assert not change_filter.accept(reading(1.0, 5.4))
+    assert change_filter.accept(reading(2.0, 5.6))
+
+def test_heartbeat_after_max_interval():
+    change_filter = ChangeFilter(deadbands = {'uv_index': 1.0}, max_interval = 5.0)
+    assert change_filter.accept(reading(0.0, 1.0))
+    assert not change_filter.heartbeat(reading(4.0, 1.0))
+    assert change_filter.heartbeat(reading(5.0, 1.0))
+
+def test_heartbeat_reports_change_held_by_min_interval():
+    change_filter = ChangeFilter(deadbands = {'uv_index': 1.0}, min_interval = 5.0)
+    assert change_filter.accept(reading(0.0, 1.0))
+    assert not change_filter.accept(reading(1.0, 3.0))
+    assert not change_filter.heartbeat(reading(3.0, 3.0))
+    assert change_filter.heartbeat(reading(5.0, 3.0))
+    assert not change_filter.heartbeat(reading(7.0, 3.0))
+
+def test_held_change_reverted_is_not_reported():
+    change_filter = ChangeFilter(deadbands = {'uv_index': 1.0}, min_interval = 5.0)
+    assert change_filter.accept(reading(0.0, 1.0))
+    assert not change_filter.accept(reading(1.0, 3.0))
+    assert not change_filter.accept(reading(2.0, 1.0))
+    assert not change_filter.heartbeat(reading(6.0, 1.0))
@@ -0,0 +1,37 @@
+import asyncio
+
+from matrix import fleet
+from matrix.config import Config, ComponentConfig
+from matrix.fleet import MatrixFleet, board_name
+
+def test_board_name():
+    config = Config('10.0.0.2', [ComponentConfig('humidity', 20017), ComponentConfig('imu', 20013)])
+    assert board_name(config) == '10.0.0.2:20013'
+    assert board_name(Config('10.0.0.2', [])) == '10.0.0.2'
+
+def test_concurrent_add_of_same_board_fails(monkeypatch):
+    class FakeMatrix():
+        components = []
+        def __init__(self, config):
+            self.config = config
+        def close(self):
+            pass
+
+    async def create(config, *args, **kwargs):
+        await asyncio.sleep(0.01)
+        return FakeMatrix(config)
+    monkeypatch.setattr(fleet.Matrix, 'create', create)
+
+    async def run():
+        boards = MatrixFleet()
+        config = Config('10.0.0.2', [ComponentConfig('humidity', 20017)])
+        other = Config('10.0.0.2', [ComponentConfig('humidity', 30017)])
+        results = await asyncio.gather(boards.add(config), boards.add(config), boards.add(other), return_exceptions = True)
+        names, hosts = boards.names, boards.hosts
+        boards.close()
+        return results, names, hosts
+
+    results, names, hosts = asyncio.run(run())
+    assert isinstance(results[1], ValueError)
+    assert names == ['10.0.0.2:20017', '10.0.0.2:30017']
+    assert hosts == ['10.0.0.2']
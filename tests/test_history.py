@@ -0,0 +1,72 @@
+import pytest
+
+from matrix import history
+from matrix.history import History
+
+@pytest.fixture(params = ['numpy', 'pure'])
+def backend(request, monkeypatch):
+    if request.param == 'pure':
+        monkeypatch.setattr(history, 'np', None)
+    elif history.np is None:
+        pytest.skip('NumPy is not installed')
+    return request.param
+
+def filled(capacity, count):
+    """History of count samples at t = 1, 2, ... with value 10 * t"""
+    h = History(['value'], capacity)
+    for t in range(1, count + 1):
+        h.append(float(t), [10.0 * t])
+    return h
+
+def test_capacity_must_be_positive():
+    with pytest.raises(ValueError):
+        History(['value'], 0)
+
+def test_empty(backend):
+    h = History(['value'], 4)
+    assert len(h) == 0
+    assert list(h.values('value')) == []
+    assert h.mean('value') is None
+    assert h.min('value') is None
+    assert h.max('value') is None
+    assert h.percentile('value', 50) is None
+    assert h.rate('value') is None
+
+def test_wrap_around_keeps_latest_in_order(backend):
+    h = filled(4, 10)
+    assert len(h) == 4
+    assert list(h.timestamps()) == [7.0, 8.0, 9.0, 10.0]
+    assert list(h.values('value')) == [70.0, 80.0, 90.0, 100.0]
+    assert h.mean('value') == 85.0
+    assert h.min('value') == 70.0
+    assert h.max('value') == 100.0
+    assert h.rate('value') == 10.0
+
+@pytest.mark.parametrize('count', [3, 4, 5, 6, 7, 8, 9])
+def test_window_after_wrap(backend, count):
+    h = filled(4, count)
+    # the window straddles the end of the ring for some counts
+    assert list(h.values('value', seconds = 2.5, now = float(count))) == [10.0 * t for t in range(count - 2, count + 1)]
+    assert list(h.timestamps(seconds = 100.0, now = float(count))) == [float(t) for t in range(max(1, count - 3), count + 1)]
+    assert list(h.values('value', seconds = 0.5, now = float(count + 1))) == []
+    assert h.mean('value', seconds = 1.5, now = float(count)) == 10.0 * count - 5.0
+
+def test_capacity_one(backend):
+    h = filled(1, 3)
+    assert len(h) == 1
+    assert list(h.values('value')) == [30.0]
+    assert h.percentile('value', 90) == 30.0
+    assert h.rate('value') is None
+
+def test_exactly_full(backend):
+    h = filled(4, 4)
+    assert list(h.values('value')) == [10.0, 20.0, 30.0, 40.0]
+    assert h.percentile('value', 50) == 25.0
+
+def test_clear(backend):
+    h = filled(4, 6)
+    h.clear()
+    assert len(h) == 0
+    h.append(20.0, [1.0])
+    assert list(h.values('value')) == [1.0]
+    assert h.nbytes == 8 * 4 * 2
@@ -0,0 +1,38 @@
+import pytest
+
+from matrix import metrics
+from matrix.components.component import Component
+from matrix.config import ComponentConfig
+from matrix_io.proto.malos.v1 import sense_pb2
+
+class Collector():
+    def __init__(self):
+        self.items = []
+
+    def put(self, item):
+        self.items.append(item)
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def enabled_metrics():
+    metrics.registry.clear()
+    metrics.enable()
+    yield metrics.registry
+    metrics.disable()
+    metrics.registry.clear()
+
+def test_high_rate_samples_are_decoded_with_metrics(enabled_metrics):
+    imu = Component.create(ComponentConfig('imu', 20013), lambda proto, key = None: None, '10.0.0.2')
+    imu.enable_high_rate(100.0, batch_size = 2)
+    batches = imu.batches.attach(Collector())
+
+    imu.data_callback(sense_pb2.Imu(yaw = 1.0).SerializeToString())
+    imu.data_callback(sense_pb2.Imu(yaw = 2.0).SerializeToString())
+
+    assert isinstance(imu.latest, imu.reading_type)
+    assert imu.latest.yaw == 2.0
+    assert list(batches.items[0].values[:, 0]) == [1.0, 2.0]
+    decoded = enabled_metrics.snapshot()['matrix_decode_seconds']
+    assert [value['count'] for labels, value in decoded.items() if 'imu' in labels] == [2]
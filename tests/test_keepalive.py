@@ -0,0 +1,49 @@
+import asyncio
+
+import zmq
+import zmq.asyncio
+
+from matrix.keepalive import KeepAlive
+
+class ImmediateContext(zmq.asyncio.Context):
+    """Sockets refuse to queue messages for peers that are not connected"""
+    def socket(self, *args, **kwargs):
+        s = super().socket(*args, **kwargs)
+        s.setsockopt(zmq.IMMEDIATE, 1)
+        return s
+
+def test_ping_that_can_not_be_queued_fails():
+    async def run():
+        context = ImmediateContext()
+        keep_alive = KeepAlive(context)
+        # nothing listens on this port
+        entry = keep_alive.add('127.0.0.1', 29901, 1.0)
+        last_ping = entry.last_ping
+        keep_alive._ping(entry, asyncio.get_event_loop().time(), asyncio.get_event_loop().time())
+        keep_alive.close()
+        context.term()
+        return keep_alive, entry, last_ping
+
+    keep_alive, entry, last_ping = asyncio.run(run())
+    assert keep_alive.failed == 1
+    assert keep_alive.pings == 0
+    assert entry.last_ping == last_ping
+
+def test_ping_is_sent():
+    async def run():
+        context = zmq.asyncio.Context()
+        pull = context.socket(zmq.PULL)
+        pull.bind('tcp://127.0.0.1:29902')
+        keep_alive = KeepAlive(context)
+        keep_alive.add('127.0.0.1', 29902, 1.0)
+        keep_alive.start()
+        ping = await asyncio.wait_for(pull.recv(), 2.0)
+        keep_alive.close()
+        pull.close(linger = 0)
+        context.term()
+        return keep_alive, ping
+
+    keep_alive, ping = asyncio.run(run())
+    assert ping == b''
+    assert keep_alive.pings >= 1
+    assert keep_alive.failed == 0
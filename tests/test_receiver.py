@@ -0,0 +1,126 @@
+import asyncio
+import logging
+
+import zmq
+import zmq.asyncio
+
+from matrix.matrix import register_callback
+from matrix.receiver import Receiver
+
+async def publish(pub, *msgs):
+    for msg in msgs:
+        await pub.send(msg)
+
+async def wait_for(condition, timeout = 2.0):
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, 'timed out'
+        await asyncio.sleep(0.005)
+
+def run_with_publishers(count, test):
+    async def run():
+        context = zmq.asyncio.Context()
+        pubs = [context.socket(zmq.PUB) for _ in range(count)]
+        ports = [pub.bind_to_random_port('tcp://127.0.0.1') for pub in pubs]
+        receiver = Receiver(context)
+        receiver.start()
+        try:
+            return await test(receiver, pubs, ports)
+        finally:
+            receiver.close()
+            for pub in pubs:
+                pub.close(linger = 0)
+            context.term()
+    return asyncio.run(run())
+
+def test_backpressure_pauses_only_its_own_socket():
+    async def test(receiver, pubs, ports):
+        loop = asyncio.get_event_loop()
+        release = loop.create_future()
+        slow, fast = [], []
+        def slow_callback(msg):
+            slow.append(msg)
+            # the first message asks for backpressure until released
+            return release if len(slow) == 1 else None
+
+        slow_socket = receiver.subscribe('127.0.0.1', ports[0], slow_callback)
+        receiver.subscribe('127.0.0.1', ports[1], fast.append)
+        # let the subscriptions reach the publishers
+        await asyncio.sleep(0.2)
+
+        await publish(pubs[0], b's1', b's2')
+        await wait_for(lambda: slow)
+        assert slow_socket in receiver._paused
+
+        await publish(pubs[1], b'f1', b'f2')
+        await wait_for(lambda: len(fast) == 2)
+        await publish(pubs[0], b's3')
+        await asyncio.sleep(0.05)
+        assert slow == [b's1']
+
+        release.set_result(None)
+        await wait_for(lambda: len(slow) == 3)
+        assert slow_socket not in receiver._paused
+        # polled again once the subscriber caught up
+        await publish(pubs[0], b's4')
+        await wait_for(lambda: len(slow) == 4)
+        return slow, fast
+
+    slow, fast = run_with_publishers(2, test)
+    assert slow == [b's1', b's2', b's3', b's4']
+    assert fast == [b'f1', b'f2']
+
+def test_failing_callback_is_logged_and_polling_goes_on(caplog):
+    async def test(receiver, pubs, ports):
+        received = []
+        def callback(msg):
+            if msg == b'bad':
+                raise ValueError('bad message')
+            received.append(msg)
+
+        receiver.subscribe('127.0.0.1', ports[0], callback)
+        await asyncio.sleep(0.2)
+        await publish(pubs[0], b'one', b'bad', b'two')
+        await wait_for(lambda: len(received) == 2)
+        await publish(pubs[0], b'three')
+        await wait_for(lambda: len(received) == 3)
+        assert not receiver._task.done()
+        return received
+
+    with caplog.at_level(logging.ERROR, logger = 'matrix.receiver'):
+        received = run_with_publishers(1, test)
+    assert received == [b'one', b'two', b'three']
+    assert 'Receive callback failed' in caplog.text
+
+def test_register_callback_outlives_failing_callback(caplog):
+    async def run(batch_size):
+        context = zmq.asyncio.Context()
+        pub = context.socket(zmq.PUB)
+        port = pub.bind_to_random_port('tcp://127.0.0.1')
+        received = []
+        def callback(msg):
+            msgs = msg if batch_size else [msg]
+            if any(bytes(m) == b'bad' for m in msgs):
+                raise ValueError('bad message')
+            received.extend(bytes(m) for m in msgs)
+
+        task = asyncio.ensure_future(register_callback('127.0.0.1', port, callback, batch_size, context))
+        await asyncio.sleep(0.2)
+        await publish(pub, b'one')
+        await wait_for(lambda: received)
+        await publish(pub, b'bad')
+        await asyncio.sleep(0.05)
+        await publish(pub, b'two')
+        await wait_for(lambda: len(received) == 2)
+        assert not task.done()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions = True)
+        pub.close(linger = 0)
+        context.term()
+        return received
+
+    with caplog.at_level(logging.ERROR, logger = 'matrix.receiver'):
+        assert asyncio.run(run(None)) == [b'one', b'two']
+        assert asyncio.run(run(8)) == [b'one', b'two']
+    assert caplog.text.count('Receive callback failed') == 2
@@ -0,0 +1,68 @@
+import asyncio
+
+import zmq
+import zmq.asyncio
+
+from matrix.matrix import get_push_fn
+from matrix.recorder import LogReader, PUSHED, RECEIVED, Recorder, Replay
+from matrix_io.proto.malos.v1 import driver_pb2
+
+def config(delay):
+    proto = driver_pb2.DriverConfig()
+    proto.delay_between_updates = delay
+    return proto
+
+def test_record_read_replay(tmp_path):
+    path = str(tmp_path / 'capture.mxlog')
+    received = []
+    with Recorder(path) as recorder:
+        callback = recorder.wrap_callback(20016, received.append)
+        batch_callback = recorder.wrap_callback(20020, lambda buffers: None, batch = True)
+        callback(b'first')
+        batch_callback([memoryview(b'second'), memoryview(b'third')])
+        callback(b'')
+    assert recorder.records == 4
+
+    with LogReader(path) as reader:
+        records = [(port, direction, bytes(payload)) for _, port, direction, payload in reader]
+        assert records == [(20016, RECEIVED, b'first'), (20020, RECEIVED, b'second'), (20020, RECEIVED, b'third'), (20016, RECEIVED, b'')]
+
+        replayed = {20016: [], 20020: []}
+        replay = Replay(reader, {port: messages.append for port, messages in replayed.items()}, speed = None)
+        stats = asyncio.run(replay.run())
+    assert replayed == {20016: [b'first', b''], 20020: [b'second', b'third']}
+    assert stats['records'] == 4
+    # a replay of what was received must not include the pushed configs
+    assert received == [b'first', b'']
+
+def test_pushes_are_recorded_as_sent(tmp_path):
+    path = str(tmp_path / 'capture.mxlog')
+
+    async def run():
+        context = zmq.asyncio.Context()
+        pull = context.socket(zmq.PULL)
+        port = pull.bind_to_random_port('tcp://127.0.0.1')
+        recorder = Recorder(path, record_pushes = True)
+        inline = recorder.wrap_push_fn(port, await get_push_fn('127.0.0.1', port, context))
+        queued_fn = await get_push_fn('127.0.0.1', port, context, queue_size = 8)
+        queued = recorder.wrap_push_fn(port, queued_fn)
+
+        inline(config(1.0))
+        # coalesced in the send queue, only the second one goes out
+        queued(config(2.0), 'delay')
+        queued(config(3.0), 'delay')
+        sent = [await asyncio.wait_for(pull.recv(), 2.0) for _ in range(2)]
+
+        queued_fn.sender.stop()
+        for fn in (inline, queued):
+            fn.socket.close(linger = 0)
+        pull.close(linger = 0)
+        context.term()
+        recorder.close()
+        return sent
+
+    sent = asyncio.run(run())
+    with LogReader(path) as reader:
+        pushed = [bytes(payload) for _, _, direction, payload in reader if direction == PUSHED]
+    assert pushed == sent
+    assert [driver_pb2.DriverConfig.FromString(p).delay_between_updates for p in pushed] == [1.0, 3.0]
@@ -0,0 +1,47 @@
+import asyncio
+
+import zmq
+import zmq.asyncio
+
+from matrix.sender import Sender
+
+def create_sender(maxsize):
+    async def create():
+        context = zmq.asyncio.Context()
+        s = context.socket(zmq.PUSH)
+        s.connect('tcp://127.0.0.1:29903')
+        return context, s, Sender(s, maxsize)
+    return asyncio.run(create())
+
+def close(context, s):
+    s.close(linger = 0)
+    context.term()
+
+def test_full_queue_drops_oldest_keyed():
+    context, s, sender = create_sender(2)
+    assert sender.push(b'a', key = 'frame')
+    assert sender.push(b'b')
+    assert sender.push(b'c')
+    assert sender.dropped == 1
+    assert sender.depth == 2
+    close(context, s)
+
+def test_full_queue_of_unkeyed_refuses():
+    context, s, sender = create_sender(2)
+    assert sender.push(b'a')
+    assert sender.push(b'b')
+    assert not sender.push(b'c', key = 'frame')
+    assert not sender.push(b'd')
+    assert sender.refused == 2
+    assert sender.dropped == 0
+    assert sender.depth == 2
+    close(context, s)
+
+def test_keyed_push_coalesces():
+    context, s, sender = create_sender(2)
+    assert sender.push(b'a')
+    assert sender.push(b'b', key = 'frame')
+    assert sender.push(b'c', key = 'frame')
+    assert sender.coalesced == 1
+    assert sender.depth == 2
+    close(context, s)
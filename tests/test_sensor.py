@@ -0,0 +1,92 @@
+"""Duplicate suppression together with snapshots, adaptive polling and the change filter"""
+import pytest
+
+from matrix.adaptive import AdaptivePolling
+from matrix.components import component
+from matrix.components.component import Component
+from matrix.config import ComponentConfig
+from matrix_io.proto.malos.v1 import sense_pb2
+
+PAYLOAD = sense_pb2.Humidity(humidity = 40.0, temperature = 20.0).SerializeToString()
+CHANGED = sense_pb2.Humidity(humidity = 80.0, temperature = 20.0).SerializeToString()
+
+class Collector():
+    def __init__(self):
+        self.items = []
+
+    def put(self, item):
+        self.items.append(item)
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(component.time, 'time', lambda: now[0])
+    return now
+
+def create_humidity(**kwargs):
+    config = ComponentConfig('humidity', 20017, suppress_duplicates = True, **kwargs)
+    return Component.create(config, lambda proto, key = None: None)
+
+def test_duplicate_keeps_snapshot_fresh(clock):
+    sensor = create_humidity()
+    sensor.data_callback(PAYLOAD)
+    clock[0] += 100
+    sensor.data_callback(PAYLOAD)
+
+    assert sensor.skipped_decodes == 1
+    snapshot = sensor.snapshot(clock[0] + 0.5)
+    assert not snapshot.stale
+    assert snapshot.timestamp == clock[0]
+    assert snapshot.get('humidity') == 40.0
+
+def test_duplicate_in_batch_keeps_order(clock):
+    sensor = create_humidity()
+    sensor.batch_data_callback([memoryview(PAYLOAD), memoryview(CHANGED), memoryview(CHANGED)])
+
+    assert sensor.skipped_decodes == 1
+    assert sensor.latest.humidity == 80.0
+
+def test_duplicates_let_adaptive_polling_back_off(clock):
+    sensor = create_humidity()
+    policy = AdaptivePolling(sensor, 0.5, 10.0, hold = 1, backoff = 4.0)
+    policy.start()
+    sensor.data_callback(PAYLOAD)
+    clock[0] += 1
+    sensor.data_callback(CHANGED)
+    assert policy.interval == 0.5
+
+    for _ in range(5):
+        clock[0] += 1
+        sensor.data_callback(CHANGED)
+    assert policy.interval == 10.0
+
+def test_duplicates_fire_filter_heartbeat(clock):
+    sensor = create_humidity(deadbands = {'humidity': 1.0}, max_interval = 5.0)
+    published = sensor.readings.attach(Collector())
+    sensor.data_callback(PAYLOAD)
+    clock[0] += 1
+    sensor.data_callback(PAYLOAD)
+    assert len(published.items) == 1
+
+    clock[0] += 5
+    sensor.data_callback(PAYLOAD)
+    assert len(published.items) == 2
+    assert published.items[-1].timestamp == clock[0]
+    assert sensor.change_filter.passed == 2
+
+def test_duplicates_report_change_held_by_min_interval(clock):
+    sensor = create_humidity(deadbands = {'humidity': 1.0}, min_interval = 5.0)
+    published = sensor.readings.attach(Collector())
+    sensor.data_callback(PAYLOAD)
+    clock[0] += 1
+    sensor.data_callback(CHANGED)
+    for _ in range(20):
+        clock[0] += 2
+        sensor.data_callback(CHANGED)
+
+    assert [r.humidity for r in published.items] == [40.0, 80.0]
+    assert published.items[1].timestamp == 1005.0
+    assert sensor.latest.humidity == 80.0
@@ -0,0 +1,40 @@
+import gc
+import logging
+
+from matrix.config import Config, ComponentConfig
+from matrix.sync import SyncMatrix, SyncProxy
+
+# nothing has to listen there, configs are only queued
+CONFIG = Config('127.0.0.1', [ComponentConfig('humidity', 29017), ComponentConfig('zigbee', 29041)])
+
+def test_proxy_passes_timeout_to_the_method():
+    with SyncMatrix(CONFIG, timeout = 5.0) as matrix:
+        humidity = matrix.component('humidity')
+        humidity.set_update_interval(0.5, timeout = 3.0)
+        config = humidity.configuration_proto
+        assert config.delay_between_updates == 0.5
+        assert config.timeout_after_last_ping == 3.0
+
+def test_results_are_copied_or_proxied():
+    with SyncMatrix(CONFIG) as matrix:
+        humidity = matrix.component('humidity')
+        config = humidity.configuration_proto
+        config.delay_between_updates = 42.0
+        # a copy, the component's own config is untouched
+        assert humidity.update_interval != 42.0
+
+        zigbee = matrix.component('zigbee')
+        bulb = zigbee.get_device(0x1000, 1)
+        assert isinstance(bulb, SyncProxy)
+        assert bulb.node_id == 0x1000
+        assert isinstance(zigbee.devices, list)
+
+def test_post_returns_future():
+    with SyncMatrix(CONFIG) as matrix:
+        assert matrix.post(lambda: 42).result(1.0) == 42
+
+def test_close_finishes_cancelled_tasks(caplog):
+    with caplog.at_level(logging.ERROR, logger = 'asyncio'):
+        SyncMatrix(CONFIG).close()
+        gc.collect()
+    assert 'Task was destroyed' not in caplog.text
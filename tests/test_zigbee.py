@@ -0,0 +1,282 @@
+"""Zigbee command pacing, debouncing, device registry and network management requests"""
+import asyncio
+
+import pytest
+
+from matrix.components import zigbee
+from matrix.components.zigbee import Debouncer, Pacer, SENT, Zigbee, ZigbeeDeviceRegistry
+from matrix.components.zigbee import COLOR_CONTROL_CLUSTER, LEVEL_CLUSTER, ON_OFF_CLUSTER
+from matrix.config import ComponentConfig
+from matrix_io.proto.malos.v1 import comm_pb2, driver_pb2
+
+class FakeLoop():
+    """Just enough of an event loop for Pacer and Debouncer, with a clock moved by hand"""
+    def __init__(self):
+        self.now = 0.0
+        self._timers = []
+
+    def time(self):
+        return self.now
+
+    def call_at(self, when, fn, *args):
+        timer = (when, fn, args)
+        self._timers.append(timer)
+        self._timers.sort(key = lambda timer: timer[0])
+        return timer
+
+    def advance(self, seconds):
+        end = self.now + seconds
+        while self._timers and self._timers[0][0] <= end:
+            when, fn, args = self._timers.pop(0)
+            self.now = max(self.now, when)
+            fn(*args)
+        self.now = end
+
+@pytest.fixture
+def loop(monkeypatch):
+    loop = FakeLoop()
+    monkeypatch.setattr(zigbee.asyncio, 'get_event_loop', lambda: loop)
+    return loop
+
+class Collector():
+    def __init__(self):
+        self.items = []
+
+    def put(self, item):
+        self.items.append(item)
+
+    def close(self):
+        pass
+
+class Pushed():
+    def __init__(self, loop = None):
+        self.loop = loop
+        self.items = []
+
+    def __call__(self, proto, key = None):
+        self.items.append((self.loop.time() if self.loop else None, proto, key))
+
+    def protos(self):
+        return [proto for _, proto, _ in self.items]
+
+def test_pacer_sends_one_command_per_interval(loop):
+    pushed = Pushed(loop)
+    pacer = Pacer(pushed, 0.02)
+    assert pacer.push(b'a') is SENT
+    loop.advance(0.005)
+    b = pacer.push(b'b')
+    c = pacer.push(b'c')
+    assert pacer.depth == 2
+
+    loop.advance(0.015)
+    assert b.result is True and c.result is None
+    loop.advance(0.02)
+    assert c.result is True
+    assert [(round(t, 3), proto) for t, proto, _ in pushed.items] == [(0.0, b'a'), (0.02, b'b'), (0.04, b'c')]
+
+    # idle long enough, the next command goes out right away
+    loop.advance(1.0)
+    assert pacer.push(b'd') is SENT
+    assert pacer.sent == 4
+
+def test_pacer_coalesces_keyed_commands_in_oldest_slot(loop):
+    pushed = Pushed(loop)
+    pacer = Pacer(pushed, 0.02)
+    pacer.push(b'first')
+    old = pacer.push(b'level 10', ('level', 1, 1))
+    other = pacer.push(b'toggle')
+    new = pacer.push(b'level 90', ('level', 1, 1))
+    assert old.result is False
+    assert pacer.coalesced == 1
+
+    loop.advance(0.04)
+    assert pushed.protos() == [b'first', b'level 90', b'toggle']
+    # keyed commands keep their key downstream, made up ones are dropped
+    assert [key for _, _, key in pushed.items] == [None, ('level', 1, 1), None]
+    assert new.result is True and other.result is True
+
+def test_debouncer_runs_only_latest_within_interval(loop):
+    debouncer = Debouncer(0.1)
+    runs = []
+    def run(value):
+        runs.append((loop.time(), value))
+        return SENT
+
+    assert debouncer.submit('level', lambda: run(1)) is SENT
+    loop.advance(0.01)
+    second = debouncer.submit('level', lambda: run(2))
+    third = debouncer.submit('level', lambda: run(3))
+    # other keys are not held back
+    assert debouncer.submit('color', lambda: run(4)) is SENT
+    assert second.result is False
+    assert third.result is None
+
+    loop.advance(0.1)
+    assert third.result is True
+    assert [value for _, value in runs] == [1, 4, 3]
+    assert debouncer.debounced == 1
+
+def create_zigbee(push_fn):
+    return Zigbee(ComponentConfig('zigbee', 20033), push_fn)
+
+def discovery(*nodes):
+    """A DISCOVERY_INFO answer listing nodes given as (node_id, {endpoint_index: cluster ids})"""
+    zig_msg = comm_pb2.ZigBeeMsg()
+    zig_msg.type = zigbee.NETWORK_MGMT
+    zig_msg.network_mgmt_cmd.type = zigbee.DISCOVERY_INFO
+    for node_id, endpoints in nodes:
+        node = zig_msg.network_mgmt_cmd.connected_nodes.add()
+        node.node_id = node_id
+        for endpoint_index, clusters in endpoints.items():
+            endpoint = node.endpoints.add()
+            endpoint.endpoint_index = endpoint_index
+            for cluster_id in clusters:
+                endpoint.clusters.add().cluster_id = cluster_id
+    return zig_msg
+
+def test_registry_publishes_changes_only():
+    registry = ZigbeeDeviceRegistry(lambda node_id, endpoint_index: (node_id, endpoint_index))
+    events = registry.events.attach(Collector())
+
+    registry.update({(1, 1): frozenset([ON_OFF_CLUSTER]), (2, 1): frozenset([ON_OFF_CLUSTER, LEVEL_CLUSTER])})
+    assert sorted(events.items) == [('added', (1, 1)), ('added', (2, 1))]
+    assert registry.with_capability('level') == [(2, 1)]
+
+    # an unchanged discovery publishes nothing
+    events.items.clear()
+    registry.update({(1, 1): frozenset([ON_OFF_CLUSTER])})
+    assert events.items == []
+
+    registry.update({(1, 1): frozenset([ON_OFF_CLUSTER, COLOR_CONTROL_CLUSTER])})
+    assert events.items == [('changed', (1, 1))]
+    assert registry.with_capability('color') == [(1, 1)]
+
+    # incomplete discoveries never remove anything
+    events.items.clear()
+    registry.update({}, complete = False)
+    assert len(registry) == 2
+
+    registry.update({(1, 1): frozenset([ON_OFF_CLUSTER, COLOR_CONTROL_CLUSTER])}, complete = True)
+    assert events.items == [('removed', (2, 1))]
+    assert (2, 1) not in registry
+    assert registry.with_capability('level') == []
+
+    registry.remove(1, 1)
+    assert events.items[-1] == ('removed', (1, 1))
+    assert len(registry) == 0
+
+def test_discovery_keeps_known_bulbs():
+    component = create_zigbee(Pushed())
+    component.deliver(discovery((0x10, {1: [ON_OFF_CLUSTER, LEVEL_CLUSTER], 2: [LEVEL_CLUSTER]})))
+    bulb = component.get_device(0x10, 1)
+    assert component.devices == [bulb]
+    # endpoints without on/off are no bulbs
+    assert component.registry.get(0x10, 2) is None
+
+    component.deliver(discovery((0x10, {1: [ON_OFF_CLUSTER]}), (0x20, {1: [ON_OFF_CLUSTER]})))
+    assert component.get_device(0x10, 1) is bulb
+    assert len(component.devices) == 2
+    assert component.registry.with_capability('level') == []
+
+    component.deliver(discovery((0x20, {1: [ON_OFF_CLUSTER]})))
+    assert (0x10, 1) not in component.registry
+
+def answer(cmd_type, **fields):
+    zig_msg = comm_pb2.ZigBeeMsg()
+    zig_msg.type = zigbee.NETWORK_MGMT
+    zig_msg.network_mgmt_cmd.type = cmd_type
+    if 'is_proxy_active' in fields:
+        zig_msg.network_mgmt_cmd.is_proxy_active = fields['is_proxy_active']
+    if 'network_status' in fields:
+        zig_msg.network_mgmt_cmd.network_status.type = fields['network_status']
+    return zig_msg
+
+class Gateway():
+    """Records network management commands and answers them a little later"""
+    def __init__(self, answers):
+        self.answers = answers
+        self.component = None
+        self.sent = []
+
+    def __call__(self, proto, key = None):
+        cmd_type = driver_pb2.DriverConfig.FromString(proto).zigbee_message.network_mgmt_cmd.type
+        loop = asyncio.get_event_loop()
+        self.sent.append((loop.time(), cmd_type))
+        answers = self.answers.get(cmd_type)
+        if answers:
+            loop.call_later(0.005, self.component.deliver, answers.pop(0))
+
+def create_gateway(answers):
+    gateway = Gateway(answers)
+    gateway.component = create_zigbee(gateway)
+    return gateway, gateway.component
+
+def test_concurrent_requests_share_one_send():
+    async def run():
+        gateway, component = create_gateway({zigbee.IS_PROXY_ACTIVE: [answer(zigbee.IS_PROXY_ACTIVE, is_proxy_active = True)]})
+        results = await asyncio.gather(component.is_gateway_active(), component.is_gateway_active())
+        return gateway, component, results
+
+    gateway, component, results = asyncio.run(run())
+    assert results == [True, True]
+    assert len(gateway.sent) == 1
+    assert component._waiters == {}
+
+def test_request_is_sent_again_with_doubled_timeout():
+    async def run():
+        gateway, component = create_gateway({})
+        with pytest.raises(asyncio.TimeoutError):
+            await component.is_gateway_active(timeout = 0.02, retries = 2)
+        return gateway
+
+    sent = [t for t, _ in asyncio.run(run()).sent]
+    assert len(sent) == 3
+    assert sent[1] - sent[0] >= 0.02
+    assert sent[2] - sent[1] >= 0.04
+
+def test_request_answered_after_retry():
+    async def run():
+        gateway, component = create_gateway({})
+        loop = asyncio.get_event_loop()
+        # the answer to the first attempt arrives late, after the retry went out
+        loop.call_later(0.03, component.deliver, answer(zigbee.NETWORK_STATUS, network_status = zigbee.JOINED_NETWORK))
+        status = await component.network_status(timeout = 0.02, retries = 2)
+        return gateway, status
+
+    gateway, status = asyncio.run(run())
+    assert status == zigbee.JOINED_NETWORK
+    assert len(gateway.sent) == 2
+
+def test_bring_up_creates_network_and_discovers():
+    async def run():
+        gateway, component = create_gateway({
+            zigbee.IS_PROXY_ACTIVE: [answer(zigbee.IS_PROXY_ACTIVE, is_proxy_active = True)],
+            zigbee.NETWORK_STATUS: [answer(zigbee.NETWORK_STATUS, network_status = zigbee.NO_NETWORK)],
+            zigbee.CREATE_NWK: [answer(zigbee.NETWORK_STATUS, network_status = zigbee.JOINED_NETWORK)],
+            zigbee.DISCOVERY_INFO: [discovery((0x10, {1: [ON_OFF_CLUSTER]}))],
+        })
+        devices = await component.bring_up(timeout = 0.5, retries = 0, network_timeout = 1.0)
+        return gateway, component, devices
+
+    gateway, component, devices = asyncio.run(run())
+    assert [cmd_type for _, cmd_type in gateway.sent] == [
+        zigbee.IS_PROXY_ACTIVE, zigbee.NETWORK_STATUS, zigbee.CREATE_NWK, zigbee.DISCOVERY_INFO]
+    assert [d.node_id for d in devices] == [0x10]
+    assert component.status == zigbee.Status.NODES_DISCOVERED
+
+def test_bring_up_gives_up_after_network_timeout():
+    async def run():
+        gateway, component = create_gateway({
+            zigbee.IS_PROXY_ACTIVE: [answer(zigbee.IS_PROXY_ACTIVE, is_proxy_active = True)],
+            zigbee.NETWORK_STATUS: [answer(zigbee.NETWORK_STATUS, network_status = zigbee.NO_NETWORK)],
+        })
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        with pytest.raises(asyncio.TimeoutError):
+            # a short request timeout must not cut the network wait short
+            await component.bring_up(timeout = 0.01, retries = 0, network_timeout = 0.1)
+        return component, loop.time() - started
+
+    component, elapsed = asyncio.run(run())
+    assert elapsed >= 0.1
+    assert component.status == zigbee.Status.NONE